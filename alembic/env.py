@@ -20,7 +20,7 @@ load_dotenv()
 
 # Импортируем Base и модели
 from app.db.database import Base
-from app.db.models import User  # Импортируем все модели
+from app.db.models import User, IngestJob  # Импортируем все модели
 
 # this is the Alembic Config object
 config = context.config
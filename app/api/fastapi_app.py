@@ -3,17 +3,23 @@ FastAPI приложение с мультитенантностью.
 Поддерживает работу с множественными клиентами через заголовок X-Tenant-Id.
 """
 from datetime import timedelta
-from fastapi import FastAPI, HTTPException, Header, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
+from pathlib import Path
 from sqlalchemy.orm import Session
+from starlette.datastructures import UploadFile
 import os
+import json
+import shutil
+import asyncio
 
 from app.core.rag_manager import RAGManager
+from app.core.ingest_queue import IngestQueue
 from app.rag.rag_pipeline import RAGPipeline
 from app.db.database import get_db
 from app.db.models import User
@@ -79,6 +85,25 @@ class TenantConfig(BaseModel):
     top_k: int = 3
     rag_threshold: float = 0.5
     system_prompt: Optional[str] = None
+    embedding_model: Optional[str] = None
+    embedding_dimensions: Optional[int] = None
+    chunk_tokens: int = 256
+    chunk_overlap_tokens: int = 32
+    dedup_chunks: bool = True
+    dedup_max_distance: int = 0
+    watch_documents: Optional[bool] = None
+    min_index_coverage: Optional[float] = None
+    answer_cache: Optional[bool] = None
+    answer_cache_threshold: Optional[float] = None
+    answer_cache_ttl: Optional[float] = None
+    answer_cache_size: Optional[int] = None
+    faq_threshold: Optional[float] = None
+    lexical_threshold: Optional[float] = None
+    retrieval_gate: Optional[bool] = None
+    retrieval_gate_min_overlap: Optional[float] = None
+    context_tokens: Optional[int] = None
+    history_keep_turns: Optional[int] = None
+    history_summary_tokens: Optional[int] = None
 
 
 # === Dependencies ===
@@ -93,6 +118,16 @@ async def get_rag_manager() -> RAGManager:
     return app.state.rag_manager
 
 
+async def get_ingest_queue() -> IngestQueue:
+    """Получить очередь индексации из состояния приложения."""
+    if not hasattr(app.state, 'ingest_queue'):
+        raise HTTPException(
+            status_code=503,
+            detail="Очередь индексации не запущена"
+        )
+    return app.state.ingest_queue
+
+
 async def get_tenant_id(
     x_tenant_id: Optional[str] = Header(
         None,
@@ -300,17 +335,58 @@ async def chat(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/chat/stream", tags=["Chat"])
+async def chat_stream(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    pipeline: RAGPipeline = Depends(get_rag_pipeline),
+    tenant_id: str = Depends(get_tenant_id)
+):
+    """
+    Отправить сообщение боту с потоковым ответом (Server-Sent Events).
+    
+    События: `sources` (источники и уверенность), `token` (части ответа
+    по мере генерации), `usage` (время до первого токена, размер ответа).
+    
+    **Пример запроса:**
+    ```bash
+    curl -N -X POST http://localhost:8000/chat/stream \
+      -H "Content-Type: application/json" \
+      -H "X-Tenant-Id: client1" \
+      -d '{"message": "Как оплатить заказ?"}'
+    ```
+    """
+    print(f"💬 [{tenant_id}] Потоковый запрос: {request.message[:100]}...")
+
+    async def events():
+        try:
+            async for event in pipeline.query_stream(
+                question=request.message,
+                chat_history=[],
+                use_rag=request.use_rag
+            ):
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            print(f"✅ [{tenant_id}] Потоковый ответ отправлен")
+        except Exception as e:
+            print(f"❌ [{tenant_id}] Ошибка: {e}")
+            error = {'type': 'error', 'detail': str(e)}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.post("/documents/upload", tags=["Documents"])
 async def upload_document(
     doc: DocumentUpload,
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     pipeline: RAGPipeline = Depends(get_rag_pipeline),
     tenant_id: str = Depends(get_tenant_id),
-    rag_manager: RAGManager = Depends(get_rag_manager)
+    ingest_queue: IngestQueue = Depends(get_ingest_queue)
 ):
     """
     Загрузить документ в векторное хранилище клиента.
+    Документ ставится в персистентную очередь индексации,
+    статус доступен по `GET /documents/jobs/{job_id}`.
     
     **Требуется заголовок:** `X-Tenant-Id: client1`
     
@@ -327,56 +403,169 @@ async def upload_document(
     ```
     """
     try:
-        from app.schemas import Document
-        from app.rag.rag_ingest import DocumentIngestor
-        from pathlib import Path
-        import os
-        
-        # Создаём документ
-        document = Document(
-            content=doc.content,
-            metadata={
-                "title": doc.title,
-                "source": "api_upload",
-                "tenant_id": tenant_id,
-                **(doc.metadata or {})
-            }
+        job = await ingest_queue.enqueue(
+            tenant_id,
+            payload={
+                "content": doc.content,
+                "metadata": {
+                    "title": doc.title,
+                    "source": "api_upload",
+                    "tenant_id": tenant_id,
+                    **(doc.metadata or {})
+                }
+            },
+            title=doc.title
         )
         
-        # Получаем векторное хранилище
-        vectorstore = rag_manager.get_vectorstore(tenant_id)
-        if not vectorstore:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Векторное хранилище для {tenant_id} не найдено"
-            )
+        return {
+            "status": "queued",
+            "tenant_id": tenant_id,
+            "job_id": job["id"],
+            "message": f"Документ '{doc.title}' добавлен в очередь индексации"
+        }
+    
+    except Exception as e:
+        print(f"❌ [{tenant_id}] Ошибка загрузки документа: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _stage_ndjson(request: Request, target: Path) -> int:
+    """Записать тело NDJSON в файл по мере получения; вернуть число строк-документов."""
+    documents = 0
+    pending = b""
+    with open(target, 'wb') as f:
+        async for block in request.stream():
+            f.write(block)
+            lines = (pending + block).split(b"\n")
+            pending = lines.pop()
+            documents += sum(1 for line in lines if line.strip())
+    if pending.strip():
+        documents += 1
+    return documents
+
+
+async def _stage_files(request: Request, staging_dir: Path) -> List[dict]:
+    """Сохранить файлы multipart формы (Starlette держит их на диске, а не в памяти)."""
+    max_files = int(os.getenv("BULK_UPLOAD_MAX_FILES", "10000"))
+    form = await request.form(max_files=max_files)
+    files = []
+    try:
+        for _, value in form.multi_items():
+            if not isinstance(value, UploadFile):
+                continue
+            name = Path(value.filename or "document.txt").name
+            target = staging_dir / f"{len(files):06d}_{name}"
+            with open(target, 'wb') as out:
+                await asyncio.to_thread(shutil.copyfileobj, value.file, out)
+            files.append({'name': name, 'path': str(target)})
+    finally:
+        await form.close()
+    return files
+
+
+@app.post("/documents/bulk", tags=["Documents"])
+async def bulk_upload_documents(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    pipeline: RAGPipeline = Depends(get_rag_pipeline),
+    tenant_id: str = Depends(get_tenant_id),
+    ingest_queue: IngestQueue = Depends(get_ingest_queue)
+):
+    """
+    Массовая загрузка документов одним заданием индексации.
+    
+    Принимает поток NDJSON (`Content-Type: application/x-ndjson`, строка -
+    `{"title": ..., "content": ..., "metadata": {...}}`) или файлы
+    `multipart/form-data` (.txt, .md, .pdf, .docx). Тело не буферизуется
+    в памяти. Результат по каждому документу - в `GET /documents/jobs/{job_id}`.
+    
+    **Требуется заголовок:** `X-Tenant-Id: client1`
+    
+    **Пример:**
+    ```bash
+    curl -X POST http://localhost:8000/documents/bulk \
+      -H "Content-Type: application/x-ndjson" \
+      -H "X-Tenant-Id: client1" \
+      --data-binary @documents.ndjson
+    
+    curl -X POST http://localhost:8000/documents/bulk \
+      -H "X-Tenant-Id: client1" \
+      -F "files=@price.pdf" -F "files=@faq.docx"
+    ```
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in ("application/x-ndjson", "application/jsonl", "multipart/form-data"):
+        raise HTTPException(
+            status_code=415,
+            detail="Ожидается application/x-ndjson или multipart/form-data"
+        )
+    
+    job_id = ingest_queue.new_job_id()
+    staging_dir = ingest_queue.staging_dir(tenant_id, job_id)
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    
+    try:
+        payload = {'staging_dir': str(staging_dir), 'ndjson': None, 'files': []}
+        if content_type == "multipart/form-data":
+            payload['files'] = await _stage_files(request, staging_dir)
+            documents = len(payload['files'])
+        else:
+            payload['ndjson'] = "documents.ndjson"
+            documents = await _stage_ndjson(request, staging_dir / payload['ndjson'])
         
-        # Индексируем в фоне
-        async def ingest_task():
-            ingestor = DocumentIngestor(vectorstore)
-            chunks = await ingestor.ingest_document(document)
-            
-            # Сохраняем обновлённое хранилище
-            base_data_dir = Path(os.getenv("DATA_DIR", "./data"))
-            vectorstore_path = base_data_dir / tenant_id / "vectorstore"
-            await vectorstore.save(str(vectorstore_path))
-            
-            print(f"✅ [{tenant_id}] Документ '{doc.title}' проиндексирован ({chunks} чанков)")
-            return chunks
+        if not documents:
+            raise HTTPException(status_code=400, detail="Нет документов для загрузки")
+        payload['documents'] = documents
         
-        background_tasks.add_task(ingest_task)
+        job = await ingest_queue.enqueue(
+            tenant_id,
+            payload=payload,
+            kind="bulk",
+            title=f"bulk: {documents} документов",
+            job_id=job_id
+        )
         
         return {
-            "status": "processing",
+            "status": "queued",
             "tenant_id": tenant_id,
-            "message": f"Документ '{doc.title}' добавлен в очередь индексации"
+            "job_id": job["id"],
+            "documents": documents,
+            "message": f"{documents} документов добавлено в очередь индексации"
         }
     
+    except HTTPException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
     except Exception as e:
-        print(f"❌ [{tenant_id}] Ошибка загрузки документа: {e}")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        print(f"❌ [{tenant_id}] Ошибка массовой загрузки: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/documents/jobs/{job_id}", tags=["Documents"])
+async def get_ingest_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    tenant_id: str = Depends(get_tenant_id),
+    ingest_queue: IngestQueue = Depends(get_ingest_queue)
+):
+    """
+    Статус и прогресс задания индексации.
+    
+    **Требуется заголовок:** `X-Tenant-Id: client1`
+    """
+    job = await ingest_queue.get_job(job_id)
+    
+    # Задания других клиентов не раскрываем
+    if not job or job["tenant_id"] != tenant_id:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Задание '{job_id}' не найдено"
+        )
+    
+    return job
+
+
 @app.get("/documents/search", tags=["Documents"])
 async def search_documents(
     query: str,
@@ -497,6 +686,36 @@ async def reload_tenant(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/tenants/{tenant_id}/sync", tags=["Tenants"])
+async def sync_tenant(
+    tenant_id: str,
+    current_user: User = Depends(require_admin),
+    rag_manager: RAGManager = Depends(get_rag_manager)
+):
+    """
+    Инкрементально переиндексировать документы клиента.
+    Индексируются только добавленные и изменённые файлы директории
+    документов, чанки удалённых файлов удаляются из индекса.
+    """
+    if not rag_manager.get_pipeline(tenant_id):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Клиент '{tenant_id}' не найден"
+        )
+    
+    try:
+        stats = await rag_manager.sync_tenant(tenant_id)
+        
+        return {
+            "status": "success",
+            "tenant_id": tenant_id,
+            **stats
+        }
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/tenants/{tenant_id}/stats", tags=["Tenants"])
 async def get_tenant_stats(
     tenant_id: str,
@@ -519,13 +738,18 @@ async def get_tenant_stats(
         llm = rag_manager.get_llm(tenant_id)
         llm_type = type(llm).__name__ if llm else "Unknown"
         
+        indexing = rag_manager.get_tenant_status(tenant_id)
+        
         return {
             "tenant_id": tenant_id,
-            "status": "active",
+            "status": "indexing" if indexing and indexing["status"] == "indexing" else "active",
+            "indexing": indexing,
             "vectorstore_size": vectorstore_size,
             "llm_type": llm_type,
             "top_k": pipeline.retriever.top_k,
-            "rag_threshold": pipeline.use_rag_threshold
+            "rag_threshold": pipeline.use_rag_threshold,
+            "answer_cache": pipeline.answer_cache.get_stats() if pipeline.answer_cache else None,
+            "faq": pipeline.faq.get_stats() if pipeline.faq else None
         }
     
     except Exception as e:
@@ -556,6 +780,14 @@ async def startup_event():
     else:
         print(f"✅ RAG Manager подключен")
         print(f"   Активных клиентов: {len(app.state.rag_manager.list_tenants())}")
+        
+        # Очередь индексации загрузок (задания хранятся в БД)
+        ingest_queue = IngestQueue(app.state.rag_manager)
+        try:
+            await ingest_queue.start()
+            app.state.ingest_queue = ingest_queue
+        except Exception as e:
+            print(f"⚠️  Очередь индексации не запущена (БД недоступна?): {e}")
     
     print("="*60 + "\n")
 
@@ -566,6 +798,9 @@ async def shutdown_event():
     print("\n" + "="*60)
     print("🛑 FastAPI сервер останавливается...")
     print("="*60 + "\n")
+    
+    if hasattr(app.state, 'ingest_queue'):
+        await app.state.ingest_queue.stop()
 
 
 # === Обслуживание Vue.js фронтенда ===
@@ -14,6 +14,7 @@ from telegram.ext import (
 )
 
 from app.core.rag_manager import RAGManager
+from app.rag.rag_history import HistoryManager
 
 
 class TelegramBot:
@@ -111,8 +112,8 @@ class TelegramBot:
     async def clear_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /clear - очистка истории."""
         # Очищаем историю пользователя из context.user_data
-        if 'chat_history' in context.user_data:
-            context.user_data['chat_history'] = []
+        context.user_data.pop('chat_history', None)
+        context.user_data.pop('conversation', None)
         
         await update.message.reply_text(
             "🗑️ История диалога очищена!\n"
@@ -177,38 +178,30 @@ class TelegramBot:
             return
         
         try:
-            # Получаем историю чата из context.user_data
-            if 'chat_history' not in context.user_data:
-                context.user_data['chat_history'] = []
+            # Диалог из context.user_data: краткое содержание + последние сообщения
+            # (история старого формата - список сообщений - переносится в диалог)
+            history_manager = pipeline.history_manager or HistoryManager(pipeline.generator.llm)
+            conversation = context.user_data.get('conversation')
+            if conversation is None:
+                conversation = history_manager.new_conversation(context.user_data.pop('chat_history', None))
+                context.user_data['conversation'] = conversation
             
-            chat_history = context.user_data['chat_history']
-            
-            # Ограничиваем историю последними 10 сообщениями
-            if len(chat_history) > 10:
-                chat_history = chat_history[-10:]
+            chat_history = history_manager.build_context(conversation)
             
             print(f"🔄 [{self.tenant_id}] Обработка запроса...")
             
             # Генерируем ответ через RAG Pipeline
             response = await pipeline.process_query(
                 query=user_message,
-                chat_history=chat_history
+                chat_history=chat_history,
+                conversation=conversation
             )
             
             # Отправляем ответ пользователю
             await update.message.reply_text(response)
             
-            # Обновляем историю
-            chat_history.append({
-                "role": "user",
-                "content": user_message
-            })
-            chat_history.append({
-                "role": "assistant",
-                "content": response
-            })
-            
-            context.user_data['chat_history'] = chat_history
+            # Обновляем историю; старые сообщения сворачиваются в фоне
+            history_manager.record(conversation, user_message, response)
             
             print(f"✅ [{self.tenant_id}] Ответ отправлен пользователю {username}")
         
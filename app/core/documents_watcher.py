@@ -0,0 +1,150 @@
+"""
+Наблюдение за директорией документов клиента.
+
+События файловой системы (inotify и аналоги через watchfiles, без него -
+периодический опрос) сглаживаются задержкой: синхронизация запускается,
+когда файлы перестали меняться. Синхронизация инкрементальная - в живой
+индекс попадают только изменённые файлы, перезагрузка клиента не нужна.
+"""
+import os
+import time
+import asyncio
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+
+def _snapshot(documents_path: Path, extensions: List[str]) -> Dict[str, Tuple[int, float]]:
+    """Размер и mtime файлов директории"""
+    snapshot = {}
+    if not documents_path.exists():
+        return snapshot
+    for file_path in documents_path.rglob('*'):
+        if file_path.suffix.lower() in extensions:
+            try:
+                stat = file_path.stat()
+            except OSError:
+                continue
+            snapshot[str(file_path)] = (stat.st_size, stat.st_mtime)
+    return snapshot
+
+
+class DocumentsWatcher:
+    """Наблюдатель директории документов одного клиента"""
+
+    def __init__(
+        self,
+        rag_manager,
+        tenant_id: str,
+        documents_path: Path,
+        extensions: List[str],
+        debounce: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+        max_delay: float = 30.0
+    ):
+        """
+        Args:
+            rag_manager: RAGManager (синхронизация через sync_tenant)
+            tenant_id: ID клиента
+            documents_path: Директория документов
+            extensions: Отслеживаемые расширения
+            debounce: Тишина в секундах перед синхронизацией (DOCUMENTS_WATCH_DEBOUNCE)
+            poll_interval: Период опроса без watchfiles (DOCUMENTS_WATCH_POLL_INTERVAL)
+            max_delay: Максимальная задержка синхронизации при непрерывных изменениях
+        """
+        self.rag_manager = rag_manager
+        self.tenant_id = tenant_id
+        self.documents_path = Path(documents_path)
+        self.extensions = [extension.lower() for extension in extensions]
+        self.debounce = debounce if debounce is not None else float(os.getenv("DOCUMENTS_WATCH_DEBOUNCE", "2"))
+        self.poll_interval = poll_interval if poll_interval is not None else float(os.getenv("DOCUMENTS_WATCH_POLL_INTERVAL", "5"))
+        self.max_delay = max_delay
+        self.mode = "watchfiles" if watchfiles is not None else "polling"
+
+        self._changed = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.syncs = 0
+        self.last_sync_at: Optional[float] = None
+        self.last_sync: Optional[dict] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """Запустить наблюдение"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print(f"👀 [{self.tenant_id}] Наблюдение за {self.documents_path} ({self.mode})")
+
+    async def stop(self):
+        """Остановить наблюдение"""
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        watch = self._watch_native if self.mode == "watchfiles" else self._watch_polling
+        await asyncio.gather(watch(), self._sync_loop())
+
+    def _is_relevant(self, path: str) -> bool:
+        return Path(path).suffix.lower() in self.extensions
+
+    async def _watch_native(self):
+        """События ОС через watchfiles"""
+        async for changes in watchfiles.awatch(
+            self.documents_path,
+            watch_filter=lambda _, path: self._is_relevant(path),
+            stop_event=self._stop
+        ):
+            if changes:
+                self._changed.set()
+
+    async def _watch_polling(self):
+        """Опрос размера и mtime файлов"""
+        previous = await asyncio.to_thread(_snapshot, self.documents_path, self.extensions)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = await asyncio.to_thread(_snapshot, self.documents_path, self.extensions)
+            if current != previous:
+                previous = current
+                self._changed.set()
+
+    async def _sync_loop(self):
+        """Синхронизация после паузы в изменениях"""
+        while True:
+            await self._changed.wait()
+            first_change = time.monotonic()
+
+            # Ждём, пока файлы перестанут меняться (но не дольше max_delay)
+            while True:
+                self._changed.clear()
+                await asyncio.sleep(self.debounce)
+                if not self._changed.is_set() or time.monotonic() - first_change >= self.max_delay:
+                    break
+            self._changed.clear()
+
+            try:
+                self.last_sync = await self.rag_manager.sync_tenant(self.tenant_id)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"⚠️  [{self.tenant_id}] Ошибка синхронизации документов: {e}")
+            self.syncs += 1
+            self.last_sync_at = time.time()
+
+    def get_stats(self) -> dict:
+        """Состояние наблюдателя"""
+        return {
+            'mode': self.mode,
+            'syncs': self.syncs,
+            'last_sync_at': self.last_sync_at,
+            'last_sync': self.last_sync,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,461 @@
+"""
+Очередь заданий индексации документов.
+
+Задания хранятся в БД (таблица ingest_jobs), поэтому переживают перезапуск
+процесса. Задания выполняют несколько корутин-воркеров; число одновременных
+заданий одного клиента ограничено, чтобы крупные загрузки не забирали
+embeddings API у живого чата. Упавшие задания повторяются с паузой.
+"""
+import os
+import json
+import uuid
+import shutil
+import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+
+from app.db.database import SessionLocal
+from app.db.models import IngestJob
+from app.schemas import Document
+from app.rag.rag_extractors import ExtractionError
+
+
+# Обработчик задания: (задание, колбэк прогресса) -> результат
+JobHandler = Callable[[dict, Callable[[int, Optional[int]], Awaitable[None]]], Awaitable[dict]]
+
+
+def _job_to_dict(job: IngestJob) -> dict:
+    """Задание в виде словаря (без payload)"""
+    total = job.progress_total
+    return {
+        'id': job.id,
+        'tenant_id': job.tenant_id,
+        'kind': job.kind,
+        'title': job.title,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'progress': {
+            'done': job.progress_done,
+            'total': total,
+            'percent': round(100 * job.progress_done / total, 1) if total else None
+        },
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+class IngestQueue:
+    """Персистентная очередь индексации с воркерами"""
+
+    def __init__(
+        self,
+        rag_manager,
+        workers: Optional[int] = None,
+        tenant_concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        poll_interval: float = 2.0
+    ):
+        """
+        Args:
+            rag_manager: RAGManager с хранилищами клиентов
+            workers: Число воркеров (INGEST_QUEUE_WORKERS)
+            tenant_concurrency: Одновременных заданий на клиента (INGEST_TENANT_CONCURRENCY)
+            max_attempts: Попыток на задание (INGEST_JOB_MAX_ATTEMPTS)
+            poll_interval: Период опроса БД в секундах, если нет новых заданий
+        """
+        self.rag_manager = rag_manager
+        self.workers = workers or int(os.getenv("INGEST_QUEUE_WORKERS", "2"))
+        self.tenant_concurrency = tenant_concurrency or int(os.getenv("INGEST_TENANT_CONCURRENCY", "1"))
+        self.max_attempts = max_attempts or int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "3"))
+        # Батчей эмбеддингов одного задания в работе - меньше, чем у синхронизации
+        self.job_in_flight_batches = int(os.getenv("INGEST_JOB_IN_FLIGHT_BATCHES", "2"))
+        # Документов NDJSON в одной группе: их чанки эмбеддятся общими батчами
+        self.bulk_group_size = int(os.getenv("INGEST_BULK_GROUP_DOCS", "100"))
+        self.poll_interval = poll_interval
+
+        self._handlers: Dict[str, JobHandler] = {
+            'document': self._handle_document,
+            'bulk': self._handle_bulk
+        }
+        self._running: Dict[str, int] = {}
+        self._claim_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    # === Работа с БД (синхронная, выполняется в потоке) ===
+
+    def _db_create(self, fields: dict) -> dict:
+        with SessionLocal() as db:
+            job = IngestJob(**fields)
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            return _job_to_dict(job)
+
+    def _db_get(self, job_id: str) -> Optional[dict]:
+        with SessionLocal() as db:
+            job = db.get(IngestJob, job_id)
+            return _job_to_dict(job) if job else None
+
+    def _db_get_payload(self, job_id: str) -> Optional[str]:
+        with SessionLocal() as db:
+            job = db.get(IngestJob, job_id)
+            return job.payload if job else None
+
+    def _db_update(self, job_id: str, **fields):
+        with SessionLocal() as db:
+            db.execute(update(IngestJob).where(IngestJob.id == job_id).values(**fields))
+            db.commit()
+
+    def _db_claim(self, busy_tenants: List[str]) -> Optional[dict]:
+        """Взять первое готовое задание клиента, не упёршегося в лимит"""
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            query = db.query(IngestJob.id).filter(
+                IngestJob.status == "queued",
+                IngestJob.next_run_at <= now
+            )
+            if busy_tenants:
+                query = query.filter(IngestJob.tenant_id.notin_(busy_tenants))
+
+            for (job_id,) in query.order_by(IngestJob.created_at).limit(5):
+                # Условный UPDATE: задание не возьмут дважды
+                claimed = db.execute(
+                    update(IngestJob)
+                    .where(IngestJob.id == job_id, IngestJob.status == "queued")
+                    .values(status="running", started_at=now, attempts=IngestJob.attempts + 1)
+                ).rowcount
+                db.commit()
+                if claimed:
+                    return _job_to_dict(db.get(IngestJob, job_id))
+        return None
+
+    def _db_requeue_running(self) -> int:
+        """Вернуть в очередь задания, прерванные остановкой процесса"""
+        with SessionLocal() as db:
+            count = db.execute(
+                update(IngestJob)
+                .where(IngestJob.status == "running")
+                .values(status="queued", attempts=IngestJob.attempts - 1)
+            ).rowcount
+            db.commit()
+            return count
+
+    # === Публичный API ===
+
+    async def enqueue(
+        self,
+        tenant_id: str,
+        payload: dict,
+        kind: str = "document",
+        title: str = None,
+        job_id: str = None
+    ) -> dict:
+        """
+        Поставить задание в очередь
+
+        Args:
+            tenant_id: ID клиента
+            payload: Данные задания (для "document" - content и metadata,
+                для "bulk" - staging_dir, ndjson, files и documents)
+            kind: Тип задания
+            title: Название для отображения
+            job_id: ID задания (если файлы уже подготовлены в staging_dir(job_id))
+
+        Returns:
+            Созданное задание
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Неизвестный тип задания: {kind}")
+
+        job = await asyncio.to_thread(self._db_create, {
+            'id': job_id or str(uuid.uuid4()),
+            'tenant_id': tenant_id,
+            'kind': kind,
+            'title': title,
+            'payload': json.dumps(payload, ensure_ascii=False),
+            'status': "queued",
+            'max_attempts': self.max_attempts
+        })
+        self._wakeup.set()
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        """Состояние задания"""
+        return await asyncio.to_thread(self._db_get, job_id)
+
+    @staticmethod
+    def new_job_id() -> str:
+        """Новый ID задания"""
+        return str(uuid.uuid4())
+
+    @staticmethod
+    def staging_dir(tenant_id: str, job_id: str) -> Path:
+        """Директория для файлов задания (удаляется после завершения)"""
+        return Path(os.getenv("DATA_DIR", "./data")) / tenant_id / "uploads" / job_id
+
+    def register_handler(self, kind: str, handler: JobHandler):
+        """Зарегистрировать обработчик типа задания"""
+        self._handlers[kind] = handler
+
+    async def start(self):
+        """Запустить воркеры"""
+        if self._tasks:
+            return
+        requeued = await asyncio.to_thread(self._db_requeue_running)
+        if requeued:
+            print(f"♻️  Очередь индексации: возвращено незавершённых заданий: {requeued}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"📥 Очередь индексации запущена ({self.workers} воркеров, "
+              f"до {self.tenant_concurrency} заданий на клиента)")
+
+    async def stop(self):
+        """Остановить воркеры (прерванные задания вернутся в очередь при старте)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # === Воркеры ===
+
+    async def _claim(self) -> Optional[dict]:
+        async with self._claim_lock:
+            busy = [tenant for tenant, count in self._running.items() if count >= self.tenant_concurrency]
+            job = await asyncio.to_thread(self._db_claim, busy)
+            if job:
+                self._running[job['tenant_id']] = self._running.get(job['tenant_id'], 0) + 1
+            return job
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"⚠️  Очередь индексации: ошибка БД: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            try:
+                await self._run_job(job)
+            finally:
+                self._running[job['tenant_id']] -= 1
+                # Освободился слот клиента - другие воркеры могут взять его задания
+                self._wakeup.set()
+
+    async def _run_job(self, job: dict):
+        job_id = job['id']
+        last_update = 0.0
+
+        async def progress(done: int, total: Optional[int] = None):
+            # Прогресс пишется в БД не чаще раза в секунду
+            nonlocal last_update
+            now = asyncio.get_running_loop().time()
+            if now - last_update < 1.0 and (total is None or done < total):
+                return
+            last_update = now
+            fields = {'progress_done': done}
+            if total is not None:
+                fields['progress_total'] = total
+            await asyncio.to_thread(self._db_update, job_id, **fields)
+
+        print(f"📥 [{job['tenant_id']}] Задание {job_id} ({job['title'] or job['kind']}), попытка {job['attempts']}")
+        try:
+            job['payload'] = json.loads(await asyncio.to_thread(self._db_get_payload, job_id) or "{}")
+            result = await self._handlers[job['kind']](job, progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job['attempts'] < job['max_attempts']:
+                delay = 5 * 2 ** (job['attempts'] - 1)
+                print(f"⚠️  [{job['tenant_id']}] Задание {job_id} упало ({error}), повтор через {delay} с")
+                await asyncio.to_thread(
+                    self._db_update, job_id,
+                    status="queued", error=error,
+                    next_run_at=datetime.utcnow() + timedelta(seconds=delay)
+                )
+            else:
+                print(f"❌ [{job['tenant_id']}] Задание {job_id} не выполнено: {error}")
+                await asyncio.to_thread(
+                    self._db_update, job_id,
+                    status="failed", error=error, finished_at=datetime.utcnow()
+                )
+                self._cleanup(job)
+            return
+
+        await asyncio.to_thread(
+            self._db_update, job_id,
+            status="done", error=None, finished_at=datetime.utcnow(),
+            result=json.dumps(result, ensure_ascii=False)
+        )
+        self._cleanup(job)
+        summary = {key: value for key, value in result.items() if key != 'results'}
+        print(f"✅ [{job['tenant_id']}] Задание {job_id} выполнено: {summary}")
+
+    @staticmethod
+    def _cleanup(job: dict):
+        """Удалить файлы завершённого задания"""
+        payload = job.get('payload')
+        if isinstance(payload, dict) and payload.get('staging_dir'):
+            shutil.rmtree(payload['staging_dir'], ignore_errors=True)
+
+    # === Обработчики ===
+
+    async def _get_ingestor(self, tenant_id: str):
+        """DocumentIngestor клиента с ограниченной параллельностью эмбеддингов"""
+        if self.rag_manager.get_vectorstore(tenant_id) is None:
+            await self.rag_manager.initialize_tenant(tenant_id)
+        ingestor = self.rag_manager.create_ingestor(tenant_id)
+        ingestor.max_in_flight_batches = min(ingestor.max_in_flight_batches, self.job_in_flight_batches)
+        return ingestor
+
+    async def _handle_document(self, job: dict, progress) -> dict:
+        """Проиндексировать один документ из payload"""
+        payload = job['payload']
+        # По document_id находятся чанки документа: откат попытки и ссылки дубликатов
+        document = Document(
+            content=payload['content'],
+            metadata={**(payload.get('metadata') or {}), 'document_id': job['id']}
+        )
+
+        ingestor = await self._get_ingestor(job['tenant_id'])
+        async with self.rag_manager.index_lock(job['tenant_id']):
+            if job['attempts'] > 1:
+                # Повтор: чанки, записанные прошлой попыткой, удаляются по document_id
+                removed = await ingestor.remove_document(job['id'])
+                if removed:
+                    print(f"♻️  [{job['tenant_id']}] Задание {job['id']}: удалено чанков прошлой попытки: {removed}")
+            chunks = await ingestor.ingest_document(document, on_progress=progress)
+            await self.rag_manager.save_vectorstore(job['tenant_id'])
+
+        return {
+            'chunks': chunks,
+            'duplicate_chunks': ingestor.dedup_stats['duplicate_chunks'],
+            'tokens_saved': ingestor.dedup_stats['tokens_saved']
+        }
+
+    @staticmethod
+    def _parse_bulk_line(line: str, tenant_id: str) -> Document:
+        """Документ из строки NDJSON: {"title", "content", "metadata"}"""
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Некорректный JSON: {e}")
+
+        if not isinstance(data, dict) or not isinstance(data.get('content'), str) or not data['content'].strip():
+            raise ValueError("Ожидается объект с непустым полем content")
+        if not isinstance(data.get('metadata') or {}, dict):
+            raise ValueError("metadata должно быть объектом")
+
+        return Document(
+            content=data['content'],
+            metadata={
+                'title': data.get('title'),
+                'source': "api_bulk",
+                'tenant_id': tenant_id,
+                **(data.get('metadata') or {})
+            }
+        )
+
+    async def _handle_bulk(self, job: dict, progress) -> dict:
+        """
+        Проиндексировать пакет документов: строки NDJSON и/или файлы.
+        Результат содержит статус и число чанков по каждому документу.
+        """
+        ingestor = await self._get_ingestor(job['tenant_id'])
+        # Один пул разбора PDF/DOCX на всё задание
+        with ingestor:
+            async with self.rag_manager.index_lock(job['tenant_id']):
+                return await self._ingest_bulk(job, ingestor, progress)
+
+    async def _ingest_bulk(self, job: dict, ingestor, progress) -> dict:
+        """Индексация пакета (под блокировкой индекса клиента)"""
+        payload = job['payload']
+        tenant_id = job['tenant_id']
+        staging_dir = Path(payload['staging_dir'])
+        total = payload.get('documents') or None
+
+        results: List[dict] = []
+        done = 0
+        await progress(0, total)
+
+        if payload.get('ndjson'):
+            group: List[Tuple[dict, Document]] = []
+
+            async def flush_group():
+                counts = await ingestor.ingest_documents([document for _, document in group])
+                for (result, _), count in zip(group, counts):
+                    result.update(status="ok", chunks=count)
+                group.clear()
+
+            # Файл читается построчно - в памяти только текущая группа
+            with open(staging_dir / payload['ndjson'], 'r', encoding='utf-8', errors='replace') as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    result = {'index': line_number}
+                    results.append(result)
+                    try:
+                        document = self._parse_bulk_line(line, tenant_id)
+                    except ValueError as e:
+                        result.update(status="error", error=str(e))
+                    else:
+                        document.metadata.setdefault('document_id', f"{job['id']}:{line_number}")
+                        result['title'] = document.metadata.get('title')
+                        group.append((result, document))
+
+                    done += 1
+                    if len(group) >= self.bulk_group_size:
+                        await flush_group()
+                        await progress(done, total)
+
+            if group:
+                await flush_group()
+            await progress(done, total)
+
+        for entry in payload.get('files', []):
+            result = {'index': len(results) + 1, 'title': entry['name']}
+            results.append(result)
+            try:
+                ids = await ingestor.ingest_file_ids(
+                    entry['path'],
+                    metadata={
+                        'title': entry['name'],
+                        'source': entry['name'],
+                        'tenant_id': tenant_id,
+                        'document_id': f"{job['id']}:{entry['name']}"
+                    }
+                )
+                result.update(status="ok", chunks=len(ids))
+            except (ExtractionError, UnicodeDecodeError, ValueError) as e:
+                # Ошибка конкретного файла; сбои API прерывают задание для повтора
+                result.update(status="error", error=f"{type(e).__name__}: {e}")
+            done += 1
+            await progress(done, total)
+
+        await self.rag_manager.save_vectorstore(tenant_id)
+
+        succeeded = [result for result in results if result.get('status') == "ok"]
+        return {
+            'documents': len(results),
+            'succeeded': len(succeeded),
+            'failed': len(results) - len(succeeded),
+            'chunks': sum(result['chunks'] for result in succeeded),
+            'duplicate_chunks': ingestor.dedup_stats['duplicate_chunks'],
+            'tokens_saved': ingestor.dedup_stats['tokens_saved'],
+            'results': results
+        }
@@ -3,7 +3,9 @@
 Поддерживает мультитенантность - каждый клиент имеет свою базу знаний и настройки.
 """
 import os
-from typing import Dict, Optional
+import time
+import asyncio
+from typing import Dict, Optional, Tuple
 from pathlib import Path
 import yaml
 
@@ -11,11 +13,21 @@ from app.rag.rag_pipeline import RAGPipeline
 from app.rag.rag_retriever import Retriever
 from app.rag.rag_generator import Generator
 from app.rag.rag_ingest import DocumentIngestor
+from app.rag.rag_manifest import IngestManifest
+from app.rag.rag_answer_cache import SemanticAnswerCache
+from app.rag.rag_faq import FAQIndex
+from app.rag.rag_history import HistoryManager
+from app.rag.rag_gate import RetrievalGate
+from app.core.documents_watcher import DocumentsWatcher
 from app.vectorstore.vectorstore_faiss import FAISSVectorStore
+from app.embeddings.embeddings_service import get_embeddings_service, get_embeddings_stats
 from app.llm.llm_openrouter import OpenRouterLLM
 from app.llm.llm_openai import OpenAILLM
 # from app.llm.llm_llamacpp import LlamaCppLLM, SaigaLlamaCppLLM, MistralLlamaCppLLM  # Локальные модели не используются
 
+# Расширения файлов, которые индексируются из директории документов
+SUPPORTED_EXTENSIONS = ['.txt', '.md', '.pdf', '.docx']
+
 
 class RAGManager:
     """
@@ -40,6 +52,12 @@ class RAGManager:
         self._pipelines: Dict[str, RAGPipeline] = {}
         self._llms: Dict[str, any] = {}
         self._vectorstores: Dict[str, FAISSVectorStore] = {}
+        self._configs: Dict[str, dict] = {}
+        self._sync_locks: Dict[str, asyncio.Lock] = {}
+        self._watchers: Dict[str, DocumentsWatcher] = {}
+        # Фоновая индексация документов и её состояние по клиентам
+        self._index_tasks: Dict[str, asyncio.Task] = {}
+        self._index_status: Dict[str, dict] = {}
         self._initialized = True
         
         print("🔧 RAG Manager инициализирован")
@@ -48,15 +66,22 @@ class RAGManager:
         self,
         tenant_id: str,
         config: Optional[dict] = None,
-        force_reload: bool = False
+        force_reload: bool = False,
+        wait_for_index: bool = False
     ) -> RAGPipeline:
         """
         Инициализация RAG pipeline для конкретного клиента.
         
+        Pipeline публикуется сразу с уже сохранённым (или пустым) индексом,
+        новые и изменённые документы индексируются в фоне. Пока доля
+        проиндексированных файлов ниже min_index_coverage, ответы
+        генерируются без RAG. Состояние - get_tenant_status().
+        
         Args:
             tenant_id: ID клиента (client1, client2, default, etc.)
             config: Конфигурация клиента (если None, загружается из файла)
             force_reload: Принудительная перезагрузка
+            wait_for_index: Дождаться окончания индексации документов
         
         Returns:
             RAGPipeline для этого клиента
@@ -73,12 +98,11 @@ class RAGManager:
         # Загружаем конфигурацию
         if config is None:
             config = self._load_tenant_config(tenant_id)
+        self._configs[tenant_id] = config
         
         # Определяем пути к данным клиента
-        base_data_dir = Path(os.getenv("DATA_DIR", "./data"))
-        tenant_data_dir = base_data_dir / tenant_id
-        documents_path = tenant_data_dir / "documents"
-        vectorstore_path = tenant_data_dir / "vectorstore"
+        documents_path, vectorstore_path = self._tenant_paths(tenant_id)
+        tenant_data_dir = documents_path.parent
         
         # Создаём директории если не существуют
         documents_path.mkdir(parents=True, exist_ok=True)
@@ -92,10 +116,11 @@ class RAGManager:
         llm = await self._initialize_llm(tenant_id, config)
         self._llms[tenant_id] = llm
         
-        # 2. Инициализация векторного хранилища
+        # 2. Инициализация векторного хранилища (без индексации документов)
+        await self._stop_indexing(tenant_id)
         vectorstore = await self._initialize_vectorstore(
             tenant_id=tenant_id,
-            documents_path=documents_path,
+            config=config,
             vectorstore_path=vectorstore_path
         )
         self._vectorstores[tenant_id] = vectorstore
@@ -103,23 +128,60 @@ class RAGManager:
         # 3. Создание RAG Pipeline
         retriever = Retriever(
             vectorstore=vectorstore,
-            top_k=config.get('top_k', 3)
+            top_k=config.get('top_k', 3),
+            fallback=config.get('embedding_fallback', 'lexical'),
+            lexical_threshold=config.get('lexical_threshold')
         )
         
         generator = Generator(
             llm=llm,
-            system_prompt=config.get('system_prompt')
+            system_prompt=config.get('system_prompt'),
+            context_tokens=config.get('context_tokens')
         )
         
+        faq = await self._load_faq(tenant_data_dir, config, vectorstore)
+        
+        min_index_coverage = config.get('min_index_coverage')
+        if min_index_coverage is None:
+            min_index_coverage = float(os.getenv("RAG_MIN_INDEX_COVERAGE", "0.5"))
         pipeline = RAGPipeline(
             retriever=retriever,
             generator=generator,
-            use_rag_threshold=config.get('rag_threshold', 0.5)
+            use_rag_threshold=config.get('rag_threshold', 0.5),
+            min_index_coverage=min_index_coverage,
+            answer_cache=self._create_answer_cache(config),
+            faq=faq,
+            retrieval_gate=self._create_retrieval_gate(config, vectorstore, faq),
+            history_manager=HistoryManager(
+                llm,
+                keep_turns=config.get('history_keep_turns'),
+                summary_tokens=config.get('history_summary_tokens')
+            )
         )
+        # Сохранённый индекс считаем полным, пока синхронизация не покажет иное
+        pipeline.index_coverage = 1.0 if vectorstore.index.ntotal else 0.0
         
         # Сохраняем в кэш
         self._pipelines[tenant_id] = pipeline
         
+        # 4. Индексация новых и изменённых документов в фоне
+        self._index_status[tenant_id] = self._new_index_status()
+        task = asyncio.create_task(self._run_indexing(tenant_id))
+        self._index_tasks[tenant_id] = task
+        
+        # 5. Горячая индексация новых и изменённых файлов (опционально)
+        await self._stop_watcher(tenant_id)
+        watch_documents = config.get('watch_documents')
+        if watch_documents is None:
+            watch_documents = os.getenv("DOCUMENTS_WATCH", "false").lower() == "true"
+        if watch_documents:
+            watcher = DocumentsWatcher(self, tenant_id, documents_path, SUPPORTED_EXTENSIONS)
+            watcher.start()
+            self._watchers[tenant_id] = watcher
+        
+        if wait_for_index:
+            await asyncio.gather(task, return_exceptions=True)
+        
         print(f"{'='*60}")
         print(f"✅ RAG для '{tenant_id}' готов к работе")
         print(f"{'='*60}\n")
@@ -207,13 +269,19 @@ class RAGManager:
     async def _initialize_vectorstore(
         self,
         tenant_id: str,
-        documents_path: Path,
+        config: dict,
         vectorstore_path: Path
     ) -> FAISSVectorStore:
         """Инициализация векторного хранилища для клиента."""
         print(f"📊 Инициализация векторного хранилища...")
         
-        vectorstore = FAISSVectorStore()
+        # Сервис эмбеддингов общий для клиентов с одинаковой моделью
+        embeddings_service = get_embeddings_service(
+            provider=config.get('embedding_provider') or 'openai',
+            model=config.get('embedding_model') or 'text-embedding-3-small',
+            dimensions=config.get('embedding_dimensions')
+        )
+        vectorstore = FAISSVectorStore(embeddings_service=embeddings_service)
         
         # Проверяем существует ли уже хранилище
         index_path = vectorstore_path.with_suffix('.index')
@@ -227,39 +295,212 @@ class RAGManager:
                 print(f"✓ Загружено {count} векторов")
             except Exception as e:
                 print(f"⚠️  Не удалось получить количество векторов: {e}")
-        
         else:
             print(f"🆕 Создание нового векторного хранилища...")
-            
-            # Проверяем есть ли документы для индексации
-            if documents_path.exists():
-                doc_files = list(documents_path.glob("*"))
-                doc_files = [f for f in doc_files if f.suffix in ['.txt', '.md', '.pdf', '.docx']]
-                
-                if doc_files:
-                    print(f"📄 Найдено документов: {len(doc_files)}")
-                    
-                    # Индексируем документы
-                    ingestor = DocumentIngestor(vectorstore)
-                    total_chunks = await ingestor.ingest_directory(
-                        str(documents_path),
-                        extensions=[".txt", ".md", ".pdf", ".docx"]
-                    )
-                    
-                    print(f"✓ Проиндексировано {total_chunks} чанков")
-                    
-                    # Сохраняем хранилище
-                    await vectorstore.save(str(vectorstore_path))
-                    print(f"💾 Векторное хранилище сохранено")
-                else:
-                    print(f"⚠️  Документы не найдены в {documents_path}")
-                    print(f"   Создано пустое хранилище")
-            else:
-                print(f"⚠️  Директория документов не существует")
-                print(f"   Создано пустое хранилище")
         
         return vectorstore
     
+    @staticmethod
+    def _create_answer_cache(config: dict) -> Optional[SemanticAnswerCache]:
+        """Семантический кэш ответов клиента (если включён)."""
+        enabled = config.get('answer_cache')
+        if enabled is None:
+            enabled = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+        if not enabled:
+            return None
+        return SemanticAnswerCache(
+            threshold=config.get('answer_cache_threshold'),
+            ttl=config.get('answer_cache_ttl'),
+            max_entries=config.get('answer_cache_size')
+        )
+    
+    @staticmethod
+    def _create_retrieval_gate(
+        config: dict,
+        vectorstore: FAISSVectorStore,
+        faq: Optional[FAQIndex]
+    ) -> Optional[RetrievalGate]:
+        """Локальный фильтр retrieval клиента (если включён)."""
+        enabled = config.get('retrieval_gate')
+        if enabled is None:
+            enabled = os.getenv("RAG_GATE", "true").lower() == "true"
+        if not enabled:
+            return None
+        faq_texts = []
+        if faq is not None:
+            for entry in faq.entries:
+                faq_texts.extend(entry.questions)
+                faq_texts.append(entry.answer)
+        return RetrievalGate(
+            vectorstore,
+            extra_texts=faq_texts,
+            min_overlap=config.get('retrieval_gate_min_overlap')
+        )
+    
+    async def _load_faq(
+        self,
+        tenant_data_dir: Path,
+        config: dict,
+        vectorstore: FAISSVectorStore
+    ) -> Optional[FAQIndex]:
+        """Загрузить и проиндексировать FAQ клиента (DATA_DIR/<tenant>/faq.*)."""
+        faq_path = FAQIndex.find_file(tenant_data_dir)
+        if faq_path is None:
+            return None
+        
+        try:
+            faq = FAQIndex.load(str(faq_path), threshold=config.get('faq_threshold'))
+        except Exception as e:
+            print(f"⚠️  Ошибка загрузки FAQ {faq_path}: {e}")
+            return None
+        
+        await faq.build(vectorstore.embeddings_service)
+        print(f"📌 FAQ: {len(faq.entries)} записей из {faq_path.name}")
+        return faq
+    
+    async def _run_indexing(self, tenant_id: str):
+        """Фоновая доиндексация файлов, изменившихся с прошлого запуска."""
+        try:
+            await self.sync_tenant(tenant_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️  [{tenant_id}] Ошибка индексации документов: {e}")
+    
+    async def _stop_indexing(self, tenant_id: str):
+        """Прервать фоновую индексацию клиента."""
+        task = self._index_tasks.pop(tenant_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    
+    @staticmethod
+    def _new_index_status() -> dict:
+        """Состояние только что начатой индексации."""
+        return {
+            'status': 'indexing',
+            'progress': 0.0,
+            'files_indexed': 0,
+            'files_total': None,
+            'started_at': time.time(),
+            'finished_at': None,
+            'error': None
+        }
+    
+    def _update_index_progress(self, tenant_id: str, indexed: int, total: int):
+        """Обновить прогресс индексации и покрытие индекса pipeline."""
+        coverage = indexed / total if total else 1.0
+        status = self._index_status.get(tenant_id)
+        if status is not None:
+            status.update({
+                'files_indexed': indexed,
+                'files_total': total,
+                'progress': round(coverage * 100, 1)
+            })
+        pipeline = self._pipelines.get(tenant_id)
+        if pipeline is not None:
+            pipeline.index_coverage = coverage
+    
+    def get_tenant_status(self, tenant_id: str) -> Optional[dict]:
+        """
+        Состояние индексации клиента: status ("indexing", "ready", "error"),
+        progress (процент файлов в индексе), files_indexed, files_total.
+        """
+        pipeline = self._pipelines.get(tenant_id)
+        if pipeline is None:
+            return None
+        status = dict(self._index_status.get(tenant_id) or {'status': 'ready'})
+        status['rag_enabled'] = pipeline.index_coverage >= pipeline.min_index_coverage
+        return status
+    
+    async def _sync_vectorstore(
+        self,
+        tenant_id: str,
+        vectorstore: FAISSVectorStore,
+        documents_path: Path,
+        vectorstore_path: Path
+    ) -> dict:
+        """Синхронизировать хранилище с директорией документов по манифесту."""
+        manifest = IngestManifest(str(self._manifest_path(vectorstore_path)))
+        manifest.load()
+        
+        ingestor = self.create_ingestor(tenant_id, vectorstore)
+        stats = await ingestor.sync_directory(
+            str(documents_path),
+            manifest,
+            extensions=SUPPORTED_EXTENSIONS,
+            on_progress=lambda indexed, total: self._update_index_progress(tenant_id, indexed, total)
+        )
+        
+        changed = stats['added'] or stats['modified'] or stats['removed']
+        if changed or not manifest.exists():
+            # Сначала хранилище, потом манифест: при сбое между ними
+            # следующая синхронизация переиндексирует файлы заново
+            await vectorstore.save(str(vectorstore_path))
+            manifest.save()
+            print(f"💾 Векторное хранилище сохранено ({vectorstore.index.ntotal} векторов)")
+        
+        return stats
+    
+    async def sync_tenant(self, tenant_id: str) -> dict:
+        """
+        Инкрементально переиндексировать документы клиента без перезагрузки.
+        Индексируются только добавленные и изменённые файлы,
+        чанки удалённых файлов удаляются из индекса.
+        """
+        vectorstore = self._vectorstores.get(tenant_id)
+        if vectorstore is None:
+            raise ValueError(f"Клиент '{tenant_id}' не инициализирован")
+        
+        async with self.index_lock(tenant_id):
+            documents_path, vectorstore_path = self._tenant_paths(tenant_id)
+            status = self._index_status[tenant_id] = self._new_index_status()
+            try:
+                stats = await self._sync_vectorstore(tenant_id, vectorstore, documents_path, vectorstore_path)
+            except asyncio.CancelledError:
+                status['status'] = 'cancelled'
+                raise
+            except Exception as e:
+                status.update({'status': 'error', 'error': str(e), 'finished_at': time.time()})
+                raise
+            status.update({'status': 'ready', 'finished_at': time.time()})
+            if stats['failed']:
+                status['failed'] = stats['failed']
+            return stats
+    
+    def index_lock(self, tenant_id: str) -> asyncio.Lock:
+        """
+        Блокировка изменения индекса клиента: под ней идут синхронизация
+        документов и задания очереди индексации, чтобы они не меняли и не
+        сохраняли хранилище и манифест одновременно.
+        """
+        return self._sync_locks.setdefault(tenant_id, asyncio.Lock())
+    
+    async def _stop_watcher(self, tenant_id: str):
+        """Остановить наблюдение за документами клиента."""
+        watcher = self._watchers.pop(tenant_id, None)
+        if watcher is not None:
+            await watcher.stop()
+    
+    async def save_vectorstore(self, tenant_id: str):
+        """Сохранить векторное хранилище клиента на диск."""
+        vectorstore = self._vectorstores.get(tenant_id)
+        if vectorstore is None:
+            return
+        _, vectorstore_path = self._tenant_paths(tenant_id)
+        await vectorstore.save(str(vectorstore_path))
+    
+    @staticmethod
+    def _tenant_paths(tenant_id: str) -> Tuple[Path, Path]:
+        """Пути к документам и векторному хранилищу клиента."""
+        tenant_data_dir = Path(os.getenv("DATA_DIR", "./data")) / tenant_id
+        return tenant_data_dir / "documents", tenant_data_dir / "vectorstore"
+    
+    @staticmethod
+    def _manifest_path(vectorstore_path: Path) -> Path:
+        """Путь к манифесту проиндексированных файлов."""
+        return vectorstore_path.with_suffix('.manifest.json')
+    
     def _load_tenant_config(self, tenant_id: str) -> dict:
         """Загрузка конфигурации клиента из файла или переменных окружения."""
         # Пытаемся загрузить из YAML файла
@@ -310,6 +551,21 @@ class RAGManager:
         """Получить векторное хранилище для клиента."""
         return self._vectorstores.get(tenant_id)
     
+    def create_ingestor(
+        self,
+        tenant_id: str,
+        vectorstore: Optional[FAISSVectorStore] = None
+    ) -> DocumentIngestor:
+        """Создать DocumentIngestor с настройками нарезки клиента."""
+        config = self._configs.get(tenant_id, {})
+        return DocumentIngestor(
+            vectorstore or self._vectorstores.get(tenant_id),
+            chunk_tokens=config.get('chunk_tokens') or 256,
+            overlap_tokens=config.get('chunk_overlap_tokens') or 32,
+            dedup=config.get('dedup_chunks', True),
+            dedup_max_distance=config.get('dedup_max_distance', 0)
+        )
+    
     def list_tenants(self) -> list:
         """Список всех инициализированных клиентов."""
         return list(self._pipelines.keys())
@@ -322,12 +578,17 @@ class RAGManager:
         print(f"🔄 Перезагрузка RAG для '{tenant_id}'...")
         
         # Удаляем старые инстансы
+        await self._stop_watcher(tenant_id)
+        await self._stop_indexing(tenant_id)
         if tenant_id in self._pipelines:
             del self._pipelines[tenant_id]
         if tenant_id in self._llms:
             del self._llms[tenant_id]
         if tenant_id in self._vectorstores:
             del self._vectorstores[tenant_id]
+        if tenant_id in self._configs:
+            del self._configs[tenant_id]
+        self._index_status.pop(tenant_id, None)
         
         # Инициализируем заново
         return await self.initialize_tenant(tenant_id, force_reload=True)
@@ -336,6 +597,7 @@ class RAGManager:
         """Получить общую статистику всех клиентов."""
         stats = {
             'total_tenants': len(self._pipelines),
+            'embeddings': get_embeddings_stats(),
             'tenants': {}
         }
         
@@ -345,10 +607,26 @@ class RAGManager:
             except:
                 vectorstore_size = 0
             
+            try:
+                embedding_model = pipeline.retriever.vectorstore.embeddings_service.model
+            except AttributeError:
+                embedding_model = None
+
             stats['tenants'][tenant_id] = {
                 'vectorstore_size': vectorstore_size,
+                'embedding_model': embedding_model,
+                'embedding_fallbacks': getattr(pipeline.retriever, 'fallback_count', 0),
                 'llm_type': type(self._llms.get(tenant_id)).__name__,
-                'status': 'active'
+                'llm_usage': self._llms[tenant_id].get_usage_stats() if tenant_id in self._llms else None,
+                'documents_watcher': self._watchers[tenant_id].get_stats() if tenant_id in self._watchers else None,
+                'indexing': self.get_tenant_status(tenant_id),
+                'answer_cache': pipeline.answer_cache.get_stats() if pipeline.answer_cache else None,
+                'faq': pipeline.faq.get_stats() if pipeline.faq else None,
+                'retrieval_gate': pipeline.retrieval_gate.get_stats() if pipeline.retrieval_gate else None,
+                'single_flight': pipeline.single_flight.get_stats(),
+                'follow_up_reuses': pipeline.follow_up_reuses,
+                'history': pipeline.history_manager.get_stats() if pipeline.history_manager else None,
+                'status': 'indexing' if self._index_status.get(tenant_id, {}).get('status') == 'indexing' else 'active'
             }
         
         return stats
\ No newline at end of file
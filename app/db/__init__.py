@@ -2,12 +2,13 @@
 Модуль для работы с базой данных.
 """
 from app.db.database import get_db, engine, SessionLocal, Base
-from app.db.models import User
+from app.db.models import User, IngestJob
 
 __all__ = [
     'get_db',
     'engine',
     'SessionLocal',
     'Base',
-    'User'
+    'User',
+    'IngestJob'
 ]
\ No newline at end of file
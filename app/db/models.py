@@ -2,7 +2,7 @@
 SQLAlchemy модели для базы данных.
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text
 from app.db.database import Base
 
 
@@ -30,4 +30,38 @@ class User(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
     def __repr__(self):
-        return f"<User(username='{self.username}', email='{self.email}')>"
\ No newline at end of file
+        return f"<User(username='{self.username}', email='{self.email}')>"
+
+
+class IngestJob(Base):
+    """Задание индексации документов (очередь переживает перезапуск процесса)."""
+    __tablename__ = "ingest_jobs"
+
+    id = Column(String(36), primary_key=True)
+    tenant_id = Column(String(100), index=True, nullable=False)
+
+    # Что индексировать: JSON с документом в payload
+    kind = Column(String(20), default="document", nullable=False)
+    title = Column(String(255), nullable=True)
+    payload = Column(Text, nullable=True)
+
+    # queued -> running -> done | failed
+    status = Column(String(20), default="queued", index=True, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    error = Column(Text, nullable=True)
+
+    # Прогресс в чанках
+    progress_done = Column(Integer, default=0, nullable=False)
+    progress_total = Column(Integer, nullable=True)
+    result = Column(Text, nullable=True)
+
+    # Временные метки
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    next_run_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<IngestJob(id='{self.id}', tenant_id='{self.tenant_id}', status='{self.status}')>"
\ No newline at end of file
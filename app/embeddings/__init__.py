@@ -0,0 +1,23 @@
+"""Модуль эмбеддингов - кэширование и вызовы embeddings API"""
+
+try:
+    from .embeddings_cache import EmbeddingCache, get_embedding_cache
+    from .embeddings_batcher import QueryEmbeddingBatcher
+    from .embeddings_scheduler import IngestEmbeddingScheduler, AIMDLimiter
+    from .embeddings_resilience import EmbeddingsUnavailableError, CircuitBreaker
+    from .embeddings_service import EmbeddingsService, get_embeddings_service, get_embeddings_stats
+except ImportError as e:
+    print(f"⚠️  Ошибка импорта embeddings модулей: {e}")
+
+__all__ = [
+    'EmbeddingCache',
+    'get_embedding_cache',
+    'QueryEmbeddingBatcher',
+    'IngestEmbeddingScheduler',
+    'AIMDLimiter',
+    'EmbeddingsUnavailableError',
+    'CircuitBreaker',
+    'EmbeddingsService',
+    'get_embeddings_service',
+    'get_embeddings_stats',
+]
@@ -0,0 +1,130 @@
+"""
+Микробатчинг эмбеддингов запросов.
+
+Параллельные запросы /chat и Telegram собираются в течение короткого окна
+(несколько миллисекунд или до N запросов) и отправляются одним вызовом
+embeddings API, после чего результаты раздаются ожидающим корутинам.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+class QueryEmbeddingBatcher:
+    """Коалесцер эмбеддингов запросов"""
+
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0
+    ):
+        """
+        Args:
+            embed_many: Функция батчевого эмбеддинга (например, aembed_documents)
+            max_batch_size: Максимальный размер батча
+            max_wait_ms: Максимальное время ожидания батча в миллисекундах
+        """
+        self._embed_many = embed_many
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Метрики
+        self.total_requests = 0
+        self.total_batches = 0
+        self.max_observed_batch = 0
+        self.total_wait = 0.0
+        self.max_wait_observed = 0.0
+        self.batch_size_histogram: Dict[int, int] = {}
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Получить эмбеддинг запроса через общий батч
+
+        Args:
+            text: Текст запроса
+
+        Returns:
+            Вектор эмбеддинга
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Отправить накопленный батч"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+        # Держим ссылку на задачу, чтобы её не собрал GC
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        """Выполнить батчевый вызов и раздать результаты"""
+        now = time.perf_counter()
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            return
+
+        self._record(batch, now)
+
+        # Одинаковые запросы эмбеддим один раз
+        unique_texts = list(dict.fromkeys(text for text, _, _ in batch))
+
+        try:
+            vectors = await self._embed_many(unique_texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(unique_texts, vectors))
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def _record(self, batch: List[Tuple[str, asyncio.Future, float]], dispatched_at: float):
+        """Обновить метрики размера батча и добавленной задержки"""
+        size = len(batch)
+        self.total_requests += size
+        self.total_batches += 1
+        self.max_observed_batch = max(self.max_observed_batch, size)
+        self.batch_size_histogram[size] = self.batch_size_histogram.get(size, 0) + 1
+
+        for _, _, enqueued_at in batch:
+            waited = dispatched_at - enqueued_at
+            self.total_wait += waited
+            self.max_wait_observed = max(self.max_wait_observed, waited)
+
+    def get_stats(self) -> dict:
+        """Метрики батчинга"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'requests': self.total_requests,
+            'batches': self.total_batches,
+            'avg_batch_size': self.total_requests / self.total_batches if self.total_batches else 0.0,
+            'max_observed_batch': self.max_observed_batch,
+            'avg_added_latency_ms': (self.total_wait / self.total_requests * 1000) if self.total_requests else 0.0,
+            'max_added_latency_ms': self.max_wait_observed * 1000,
+            'batch_size_histogram': dict(sorted(self.batch_size_histogram.items()))
+        }
@@ -0,0 +1,226 @@
+"""
+Персистентный кэш эмбеддингов на диске.
+
+Кэш общий для всех клиентов: ключ строится из (модель эмбеддингов,
+размерность, SHA-256 текста чанка), поэтому одинаковые чанки
+(юридические футеры, FAQ) в разных базах знаний эмбеддятся один раз.
+"""
+import os
+import sqlite3
+import hashlib
+import threading
+import asyncio
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Кэш float32 векторов в SQLite с вытеснением по размеру (LRU)"""
+
+    def __init__(self, path: str, max_size_mb: int = 1024):
+        """
+        Args:
+            path: Путь к файлу SQLite
+            max_size_mb: Максимальный суммарный размер векторов в мегабайтах
+        """
+        self.path = path
+        self.max_bytes = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                dims INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, dims, text_hash)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        self._total_bytes = int(row[0])
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """SHA-256 текста чанка"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, dims: int, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Получить векторы из кэша
+
+        Args:
+            model: Модель эмбеддингов
+            dims: Размерность векторов
+            texts: Тексты чанков
+
+        Returns:
+            Список векторов (None для промахов) в порядке texts
+        """
+        if not texts:
+            return []
+
+        hashes = [self.text_hash(text) for text in texts]
+        found = {}
+
+        with self._lock:
+            unique = list(set(hashes))
+            # SQLite ограничивает число параметров в запросе
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND dims = ? AND text_hash IN ({placeholders})",
+                    [model, dims, *part]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND dims = ? AND text_hash = ?",
+                    [(now, model, dims, text_hash) for text_hash in found]
+                )
+                self._conn.commit()
+
+        results = [found.get(text_hash) for text_hash in hashes]
+        hits = sum(1 for vector in results if vector is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, dims: int, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Сохранить векторы в кэш"""
+        if not texts:
+            return
+
+        now = time.time()
+        # Повторяющийся текст в одном вызове записывается один раз
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            text_hash = self.text_hash(text)
+            rows[text_hash] = (model, dims, text_hash, blob, now)
+
+        with self._lock:
+            # Размер заменяемых строк: общий размер ведётся без полного SUM по таблице
+            replaced = 0
+            hashes = list(rows)
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                row = self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings "
+                    f"WHERE model = ? AND dims = ? AND text_hash IN ({placeholders})",
+                    [model, dims, *part]
+                ).fetchone()
+                replaced += int(row[0])
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, dims, text_hash, vector, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                list(rows.values())
+            )
+            self._conn.commit()
+            self._total_bytes += sum(len(row[3]) for row in rows.values()) - replaced
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Удалить давно не использованные векторы до 90% лимита (вызывается под блокировкой)"""
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+
+            to_delete = []
+            for rowid, size in rows:
+                to_delete.append((rowid,))
+                self._total_bytes -= size
+                if self._total_bytes <= target:
+                    break
+
+            self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", to_delete)
+            self.evictions += len(to_delete)
+
+        self._conn.commit()
+
+    async def aget_many(self, model: str, dims: int, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Асинхронная версия get_many (работа с диском в отдельном потоке)"""
+        return await asyncio.to_thread(self.get_many, model, dims, texts)
+
+    async def aput_many(self, model: str, dims: int, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Асинхронная версия put_many"""
+        await asyncio.to_thread(self.put_many, model, dims, texts, vectors)
+
+    def get_stats(self) -> dict:
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            'path': self.path,
+            'size_mb': round(self._total_bytes / (1024 * 1024), 2),
+            'max_size_mb': round(self.max_bytes / (1024 * 1024), 2),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions
+        }
+
+    def close(self):
+        """Закрыть соединение с базой"""
+        with self._lock:
+            self._conn.close()
+
+
+_shared_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Общий для всех клиентов кэш эмбеддингов.
+
+    Настраивается через переменные окружения:
+        EMBEDDING_CACHE_ENABLED - включить кэш (по умолчанию true)
+        EMBEDDING_CACHE_PATH - путь к файлу (по умолчанию DATA_DIR/_shared/embeddings_cache.sqlite3)
+        EMBEDDING_CACHE_MAX_MB - лимит размера (по умолчанию 1024)
+
+    Returns:
+        EmbeddingCache или None, если кэш отключён
+    """
+    global _shared_cache
+
+    if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "true":
+        return None
+
+    if _shared_cache is None:
+        default_path = Path(os.getenv("DATA_DIR", "./data")) / "_shared" / "embeddings_cache.sqlite3"
+        path = os.getenv("EMBEDDING_CACHE_PATH", str(default_path))
+        max_size_mb = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+        _shared_cache = EmbeddingCache(path, max_size_mb=max_size_mb)
+        print(f"🗄️  Кэш эмбеддингов: {path} (лимит {max_size_mb} MB)")
+
+    return _shared_cache
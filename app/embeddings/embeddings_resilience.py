@@ -0,0 +1,107 @@
+"""
+Устойчивость вызовов embeddings API: дедлайны, повторы и circuit breaker.
+"""
+import random
+import time
+
+
+# Минимальный остаток таймаута (сек), с которым ещё имеет смысл вызывать API:
+# с меньшим вызов заведомо упадёт по таймауту и будет засчитан breaker'у
+MIN_CALL_BUDGET = 0.25
+
+
+class EmbeddingsUnavailableError(Exception):
+    """Embeddings API недоступен (таймаут, ошибки или открыт circuit breaker)"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для embeddings API.
+
+    closed - вызовы проходят;
+    open - после failure_threshold ошибок подряд вызовы сразу отклоняются;
+    half_open - по истечении recovery_timeout пропускается один пробный вызов.
+    Если проба не завершилась ни успехом, ни ошибкой за recovery_timeout,
+    пропускается следующая - цепь не может застрять в half_open.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Число ошибок подряд для размыкания
+            recovery_timeout: Время в секундах до пробного вызова
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить вызов"""
+        if self.state == "closed":
+            return True
+
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.recovery_timeout:
+            # Пропускаем один пробный вызов
+            self.state = "half_open"
+            self.probe_started_at = now
+            return True
+
+        if self.state == "half_open" and now - self.probe_started_at >= self.recovery_timeout:
+            # Результат пробы так и не записан - пропускаем новую
+            self.probe_started_at = now
+            return True
+
+        return False
+
+    def record_success(self):
+        """Успешный вызов замыкает цепь"""
+        self.state = "closed"
+        self.failures = 0
+
+    def release_probe(self):
+        """Проба не дошла до API (нет слота лимита) - следующий вызов станет пробой"""
+        if self.state == "half_open":
+            self.probe_started_at = time.monotonic() - self.recovery_timeout
+
+    def record_failure(self):
+        """Ошибка вызова"""
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                print(f"⚡ Circuit breaker embeddings разомкнут ({self.failures} ошибок подряд)")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        """Цепь разомкнута и пробный вызов ещё не разрешён"""
+        return self.state == "open" and time.monotonic() - self.opened_at < self.recovery_timeout
+
+    def get_stats(self) -> dict:
+        """Состояние breaker"""
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened
+        }
+
+
+def is_client_error(error: Exception) -> bool:
+    """
+    Ошибка запроса, которую повтор не исправит (HTTP 4xx, кроме 408 и 429):
+    неверный запрос, ключ или модель. Провайдер при этом доступен.
+    """
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+
+def backoff_delay(attempt: int, base: float = 0.2, cap: float = 5.0) -> float:
+    """Экспоненциальная пауза с полным джиттером"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
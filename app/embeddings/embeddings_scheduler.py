@@ -0,0 +1,207 @@
+"""
+Планировщик эмбеддингов при индексации.
+
+Разбивает тексты на батчи, ограниченные по токенам, и выполняет их
+параллельно. Параллелизм подстраивается по AIMD: растёт на единицу за
+«раунд» успешных запросов и уменьшается вдвое при 429 (rate limit)
+или при превышении целевой задержки. Готовые батчи сразу передаются
+в колбэк, чтобы попадать в индекс по мере поступления.
+"""
+import asyncio
+import inspect
+import random
+import time
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+import numpy as np
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (~4 байта UTF-8 на токен)"""
+    return len(text.encode('utf-8')) // 4 + 1
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Проверить, что ошибка - превышение лимита запросов (HTTP 429)"""
+    if getattr(error, 'status_code', None) == 429 or getattr(error, 'status', None) == 429:
+        return True
+    return type(error).__name__ == 'RateLimitError'
+
+
+class AIMDLimiter:
+    """Адаптивный семафор: additive increase / multiplicative decrease"""
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 16,
+        latency_target: float = 10.0
+    ):
+        """
+        Args:
+            initial: Начальный лимит параллельных запросов
+            minimum: Минимальный лимит
+            maximum: Максимальный лимит
+            latency_target: Целевая задержка запроса в секундах
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.throttled = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """Занять слот"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        """Освободить слот"""
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        """Обратная связь по успешному запросу"""
+        if latency > self.latency_target:
+            self.limit = max(self.minimum, self.limit * 0.75)
+        else:
+            # +1 за раунд из limit запросов
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self):
+        """Обратная связь по 429"""
+        self.throttled += 1
+        self.limit = max(self.minimum, self.limit / 2)
+
+    def get_stats(self) -> dict:
+        """Текущее состояние лимитера"""
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'throttled': self.throttled
+        }
+
+
+class IngestEmbeddingScheduler:
+    """Параллельная батчевая генерация эмбеддингов для индексации"""
+
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], Awaitable[np.ndarray]],
+        limiter: Optional[AIMDLimiter] = None,
+        max_batch_tokens: int = 50000,
+        max_batch_size: int = 512,
+        max_retries: int = 5
+    ):
+        """
+        Args:
+            embed_many: Функция батчевого эмбеддинга
+            limiter: AIMD лимитер параллелизма
+            max_batch_tokens: Лимит токенов в одном запросе
+            max_batch_size: Лимит текстов в одном запросе
+            max_retries: Число повторов батча при 429
+        """
+        self._embed_many = embed_many
+        self.limiter = limiter or AIMDLimiter()
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+
+    def split_batches(
+        self,
+        texts: Sequence[str],
+        token_counts: Optional[Sequence[int]] = None
+    ) -> List[List[int]]:
+        """
+        Разбить тексты на батчи по лимиту токенов и количества
+
+        Returns:
+            Список батчей (индексы текстов)
+        """
+        batches = []
+        current: List[int] = []
+        current_tokens = 0
+
+        for i, text in enumerate(texts):
+            tokens = token_counts[i] if token_counts is not None else None
+            if tokens is None:
+                tokens = estimate_tokens(text)
+
+            if current and (
+                current_tokens + tokens > self.max_batch_tokens
+                or len(current) >= self.max_batch_size
+            ):
+                batches.append(current)
+                current, current_tokens = [], 0
+
+            current.append(i)
+            current_tokens += tokens
+
+        if current:
+            batches.append(current)
+
+        return batches
+
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Эмбеддинг одного батча с повтором при 429"""
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                vectors = await self._embed_many(texts)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                self.limiter.on_throttle()
+                attempt += 1
+            else:
+                self.limiter.on_success(time.perf_counter() - started)
+                return vectors
+            finally:
+                await self.limiter.release()
+
+            # Экспоненциальная пауза с джиттером перед повтором
+            await asyncio.sleep(random.uniform(0, min(30.0, 0.5 * 2 ** attempt)))
+
+    async def run(
+        self,
+        texts: Sequence[str],
+        on_batch: Callable[[List[int], np.ndarray], Optional[Awaitable[None]]],
+        token_counts: Optional[Sequence[int]] = None
+    ) -> int:
+        """
+        Сгенерировать эмбеддинги и передать готовые батчи в колбэк
+
+        Args:
+            texts: Тексты для эмбеддинга
+            on_batch: Колбэк (индексы текстов, векторы), вызывается по мере готовности;
+                может быть корутиной (например, для backpressure)
+            token_counts: Известные количества токенов текстов (опционально,
+                None для отдельных текстов - оценка)
+
+        Returns:
+            Количество обработанных текстов
+        """
+        batches = self.split_batches(texts, token_counts)
+
+        async def process(indices: List[int]):
+            vectors = await self._embed_batch([texts[i] for i in indices])
+            result = on_batch(indices, vectors)
+            if inspect.isawaitable(result):
+                await result
+
+        tasks = [asyncio.create_task(process(indices)) for indices in batches]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        return len(texts)
@@ -0,0 +1,397 @@
+"""
+Общий для процесса сервис эмбеддингов.
+
+Клиенты (tenants) с одинаковыми (провайдер, модель, размерность) используют
+один экземпляр сервиса. Все сервисы работают через общий пул HTTP
+соединений, общий лимит параллельных запросов к API и общий AIMD лимитер
+для индексации, поэтому бюджет запросов к провайдеру соблюдается
+глобально, а не на каждого клиента.
+
+Каждый вызов API ограничен таймаутом, повторяется с джиттером, а после
+серии ошибок circuit breaker сразу отклоняет вызовы с
+EmbeddingsUnavailableError, не дожидаясь таймаутов.
+"""
+import os
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from langchain_openai import OpenAIEmbeddings
+
+from .embeddings_cache import EmbeddingCache, get_embedding_cache
+from .embeddings_batcher import QueryEmbeddingBatcher
+from .embeddings_scheduler import IngestEmbeddingScheduler, AIMDLimiter, is_rate_limit_error
+from .embeddings_resilience import (
+    EmbeddingsUnavailableError,
+    CircuitBreaker,
+    MIN_CALL_BUDGET,
+    backoff_delay,
+    is_client_error
+)
+
+
+# Размерности моделей по умолчанию
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+_http_client: Optional[httpx.AsyncClient] = None
+_global_semaphore: Optional[asyncio.Semaphore] = None
+_ingest_limiter: Optional[AIMDLimiter] = None
+_services: Dict[Tuple[str, str, int], "EmbeddingsService"] = {}
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Общий пул HTTP соединений для всех сервисов эмбеддингов"""
+    global _http_client
+    if _http_client is None:
+        max_connections = int(os.getenv("EMBEDDINGS_MAX_CONNECTIONS", "32"))
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0)
+        )
+    return _http_client
+
+
+def _get_global_semaphore() -> asyncio.Semaphore:
+    """Глобальный лимит параллельных запросов к embeddings API"""
+    global _global_semaphore
+    if _global_semaphore is None:
+        _global_semaphore = asyncio.Semaphore(int(os.getenv("EMBEDDINGS_MAX_CONCURRENCY", "16")))
+    return _global_semaphore
+
+
+def _get_ingest_limiter() -> AIMDLimiter:
+    """Общий AIMD лимитер индексации для всех клиентов"""
+    global _ingest_limiter
+    if _ingest_limiter is None:
+        _ingest_limiter = AIMDLimiter(
+            initial=int(os.getenv("EMBED_INGEST_CONCURRENCY", "4")),
+            maximum=int(os.getenv("EMBED_INGEST_MAX_CONCURRENCY", "16"))
+        )
+    return _ingest_limiter
+
+
+class EmbeddingsService:
+    """Сервис эмбеддингов: кэш, батчинг запросов, планировщик индексации и метрики"""
+
+    def __init__(
+        self,
+        provider: str = "openai",
+        model: str = "text-embedding-3-small",
+        dimensions: Optional[int] = None,
+        cache: Optional[EmbeddingCache] = None,
+        query_batch_size: int = 16,
+        query_batch_wait_ms: float = 5.0,
+        ingest_batch_tokens: int = 50000,
+        query_timeout: float = 2.0,
+        query_deadline: float = 5.0,
+        query_retries: int = 2,
+        ingest_timeout: float = 60.0,
+        ingest_retries: int = 3,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        """
+        Args:
+            provider: Провайдер эмбеддингов (пока поддерживается только openai)
+            model: Модель эмбеддингов
+            dimensions: Размерность векторов (None - размерность модели по умолчанию)
+            cache: Кэш эмбеддингов чанков
+            query_batch_size: Максимальный размер батча эмбеддингов запросов
+            query_batch_wait_ms: Максимальное ожидание батча запросов (мс)
+            ingest_batch_tokens: Лимит токенов в одном батче индексации
+            query_timeout: Таймаут одного вызова для запросов (сек)
+            query_deadline: Общий дедлайн эмбеддинга запроса с повторами (сек)
+            query_retries: Число повторов для запросов
+            ingest_timeout: Таймаут одного вызова при индексации (сек)
+            ingest_retries: Число повторов при индексации
+            breaker: Circuit breaker (по умолчанию свой на сервис)
+        """
+        if provider != "openai":
+            raise ValueError(f"Неизвестный провайдер эмбеддингов: {provider}")
+
+        self.provider = provider
+        self.model = model
+        self.dimension = dimensions or MODEL_DIMENSIONS.get(model, 3072)
+        self.cache = cache
+        self.query_timeout = query_timeout
+        self.query_deadline = query_deadline
+        self.query_retries = query_retries
+        self.ingest_timeout = ingest_timeout
+        self.ingest_retries = ingest_retries
+        self.breaker = breaker or CircuitBreaker()
+
+        # Повторы и таймауты выполняются здесь, а не внутри клиента
+        self.client = OpenAIEmbeddings(
+            model=model,
+            dimensions=dimensions,
+            http_async_client=_get_http_client(),
+            max_retries=0
+        )
+
+        self.query_batcher = QueryEmbeddingBatcher(
+            self._embed_queries,
+            max_batch_size=query_batch_size,
+            max_wait_ms=query_batch_wait_ms
+        )
+        self.ingest_scheduler = IngestEmbeddingScheduler(
+            self.embed_documents,
+            limiter=_get_ingest_limiter(),
+            max_batch_tokens=ingest_batch_tokens
+        )
+
+        # Метрики вызовов API
+        self.api_calls = 0
+        self.api_texts = 0
+        self.api_errors = 0
+        self.api_latency_total = 0.0
+        self.api_latency_max = 0.0
+
+    async def _request(self, texts: List[str], timeout: float) -> List[List[float]]:
+        """
+        Один вызов embeddings API под глобальным лимитом и с таймаутом.
+        Таймаут включает ожидание слота лимита: запрос чата не ждёт
+        занятые индексацией слоты дольше своего дедлайна.
+
+        Raises:
+            EmbeddingsUnavailableError: Слот лимита не освободился, пока
+                от timeout оставалось хотя бы MIN_CALL_BUDGET
+        """
+        semaphore = _get_global_semaphore()
+        waited = time.monotonic()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise EmbeddingsUnavailableError("Нет свободного слота embeddings API до истечения таймаута")
+
+        try:
+            remaining = timeout - (time.monotonic() - waited)
+            if remaining < MIN_CALL_BUDGET:
+                # Слот достался слишком поздно: вызов не успел бы завершиться
+                raise EmbeddingsUnavailableError("Слот embeddings API освободился слишком поздно")
+            started = time.perf_counter()
+            try:
+                vectors = await asyncio.wait_for(self.client.aembed_documents(texts), timeout=remaining)
+            except Exception:
+                self.api_errors += 1
+                raise
+            finally:
+                latency = time.perf_counter() - started
+                self.api_latency_total += latency
+                self.api_latency_max = max(self.api_latency_max, latency)
+        finally:
+            semaphore.release()
+
+        self.api_calls += 1
+        self.api_texts += len(texts)
+        return vectors
+
+    async def _call_api(
+        self,
+        texts: List[str],
+        timeout: float,
+        max_retries: int,
+        deadline: Optional[float] = None,
+        raise_rate_limit: bool = False
+    ) -> List[List[float]]:
+        """
+        Вызов embeddings API с повторами и circuit breaker
+
+        Args:
+            texts: Тексты
+            timeout: Таймаут одной попытки (сек)
+            max_retries: Число повторов
+            deadline: Общий дедлайн всех попыток (сек, опционально)
+            raise_rate_limit: Пробрасывать 429 без повторов (для AIMD планировщика)
+
+        Returns:
+            Векторы эмбеддингов
+
+        Raises:
+            EmbeddingsUnavailableError: API недоступен
+        """
+        deadline_at = time.monotonic() + deadline if deadline else None
+        attempt = 0
+
+        while True:
+            call_timeout = timeout
+            if deadline_at is not None:
+                call_timeout = min(timeout, deadline_at - time.monotonic())
+                if call_timeout < MIN_CALL_BUDGET:
+                    raise EmbeddingsUnavailableError("Превышен дедлайн вызова embeddings API")
+
+            if not self.breaker.allow():
+                raise EmbeddingsUnavailableError("Embeddings API недоступен (circuit breaker разомкнут)")
+
+            # Пробный вызов half_open обязан закрыть цепь или снова разомкнуть
+            # её при любом исходе, иначе breaker останется в half_open
+            probe = self.breaker.state == "half_open"
+            try:
+                vectors = await self._request(texts, call_timeout)
+            except asyncio.CancelledError:
+                if probe:
+                    self.breaker.record_failure()
+                raise
+            except EmbeddingsUnavailableError:
+                # Не дождались слота глобального лимита (или он достался слишком
+                # поздно) - API тут ни при чём, breaker не трогаем
+                if probe:
+                    self.breaker.release_probe()
+                raise
+            except Exception as e:
+                if is_client_error(e):
+                    # 4xx: провайдер ответил - не сбой для breaker, повтор не поможет
+                    if probe:
+                        self.breaker.record_success()
+                    raise EmbeddingsUnavailableError(f"Ошибка запроса к embeddings API: {e!r}") from e
+
+                rate_limited = is_rate_limit_error(e)
+                if not rate_limited or probe:
+                    # 429 вне пробы: провайдер жив, но ограничивает частоту -
+                    # не ошибка для breaker
+                    self.breaker.record_failure()
+                if rate_limited and raise_rate_limit:
+                    raise
+
+                if attempt >= max_retries:
+                    raise EmbeddingsUnavailableError(f"Ошибка embeddings API: {e!r}") from e
+
+                delay = backoff_delay(attempt)
+                if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+                    raise EmbeddingsUnavailableError(f"Превышен дедлайн вызова embeddings API: {e!r}") from e
+
+                await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return vectors
+
+    async def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Батч запросов: короткие таймауты и общий дедлайн"""
+        return await self._call_api(
+            texts,
+            timeout=self.query_timeout,
+            max_retries=self.query_retries,
+            deadline=self.query_deadline
+        )
+
+    async def _embed_chunks(self, texts: List[str]) -> List[List[float]]:
+        """Батч индексации: 429 отдаётся AIMD планировщику"""
+        return await self._call_api(
+            texts,
+            timeout=self.ingest_timeout,
+            max_retries=self.ingest_retries,
+            raise_rate_limit=True
+        )
+
+    async def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Эмбеддинги чанков с учётом кэша.
+        В embeddings API уходят только промахи кэша (без повторов).
+        """
+        if self.cache is None:
+            return np.array(await self._embed_chunks(texts), dtype='float32')
+
+        cached = await self.cache.aget_many(self.model, self.dimension, texts)
+
+        # Уникальные тексты, которых нет в кэше
+        missing = list(dict.fromkeys(
+            text for text, vector in zip(texts, cached) if vector is None
+        ))
+
+        fresh = {}
+        if missing:
+            missing_embeddings = await self._embed_chunks(missing)
+            fresh = dict(zip(missing, missing_embeddings))
+            await self.cache.aput_many(self.model, self.dimension, missing, missing_embeddings)
+
+        return np.array(
+            [vector if vector is not None else fresh[text] for text, vector in zip(texts, cached)],
+            dtype='float32'
+        )
+
+    async def embed_query(self, text: str) -> List[float]:
+        """
+        Эмбеддинг запроса через общий батч
+
+        Raises:
+            EmbeddingsUnavailableError: API недоступен или превышен дедлайн
+        """
+        if self.breaker.is_open:
+            # Не ждём окно батча, если заранее известно, что API недоступен
+            raise EmbeddingsUnavailableError("Embeddings API недоступен (circuit breaker разомкнут)")
+        return await self.query_batcher.embed(text)
+
+    def get_stats(self) -> dict:
+        """Метрики сервиса"""
+        return {
+            'provider': self.provider,
+            'model': self.model,
+            'dimension': self.dimension,
+            'api_calls': self.api_calls,
+            'api_texts': self.api_texts,
+            'api_errors': self.api_errors,
+            'avg_latency_ms': (self.api_latency_total / self.api_calls * 1000) if self.api_calls else 0.0,
+            'max_latency_ms': self.api_latency_max * 1000,
+            'circuit_breaker': self.breaker.get_stats(),
+            'query_batching': self.query_batcher.get_stats()
+        }
+
+
+def get_embeddings_service(
+    provider: str = "openai",
+    model: str = "text-embedding-3-small",
+    dimensions: Optional[int] = None
+) -> EmbeddingsService:
+    """
+    Получить общий сервис эмбеддингов для (провайдер, модель, размерность).
+
+    Args:
+        provider: Провайдер эмбеддингов
+        model: Модель эмбеддингов
+        dimensions: Размерность векторов (None - по умолчанию для модели)
+
+    Returns:
+        EmbeddingsService, общий для всех клиентов с такими параметрами
+    """
+    key = (provider, model, dimensions or MODEL_DIMENSIONS.get(model, 3072))
+
+    if key not in _services:
+        _services[key] = EmbeddingsService(
+            provider=provider,
+            model=model,
+            dimensions=dimensions,
+            cache=get_embedding_cache(),
+            query_batch_size=int(os.getenv('EMBED_QUERY_BATCH_SIZE', '16')),
+            query_batch_wait_ms=float(os.getenv('EMBED_QUERY_BATCH_WAIT_MS', '5')),
+            ingest_batch_tokens=int(os.getenv('EMBED_INGEST_BATCH_TOKENS', '50000')),
+            query_timeout=float(os.getenv('EMBED_QUERY_TIMEOUT', '2')),
+            query_deadline=float(os.getenv('EMBED_QUERY_DEADLINE', '5')),
+            query_retries=int(os.getenv('EMBED_QUERY_RETRIES', '2')),
+            ingest_timeout=float(os.getenv('EMBED_INGEST_TIMEOUT', '60')),
+            ingest_retries=int(os.getenv('EMBED_INGEST_RETRIES', '3')),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv('EMBED_BREAKER_THRESHOLD', '5')),
+                recovery_timeout=float(os.getenv('EMBED_BREAKER_RECOVERY', '30'))
+            )
+        )
+        print(f"🧬 Сервис эмбеддингов: {provider}/{model} ({key[2]} dims)")
+
+    return _services[key]
+
+
+def get_embeddings_stats() -> dict:
+    """Метрики всех сервисов эмбеддингов процесса"""
+    cache = get_embedding_cache()
+    return {
+        'services': [service.get_stats() for service in _services.values()],
+        'ingest_limiter': _get_ingest_limiter().get_stats(),
+        'cache': cache.get_stats() if cache else None
+    }
@@ -2,39 +2,70 @@ from abc import ABC, abstractmethod
 from typing import List, Dict, Optional
 
 
+# Системный промпт по умолчанию (если вызывающий код не передал свой)
+DEFAULT_SYSTEM_PROMPT = "Ты полезный AI ассистент. Отвечай на русском языке кратко и по существу."
+
+
 class BaseLLM(ABC):
     """Базовый класс для LLM"""
-    
+
     def __init__(self, model_name: str, temperature: float = 0.7):
         self.model_name = model_name
         self.temperature = temperature
-    
+
+        # Учёт токенов по ответам провайдера (cached - из кэша префикса промпта)
+        self.usage_requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
     @abstractmethod
     async def generate(
-        self, 
-        prompt: str, 
+        self,
+        prompt: str,
         context: Optional[List[Dict[str, str]]] = None,
-        max_tokens: int = 1000
+        max_tokens: int = 1000,
+        system_prompt: Optional[str] = None
     ) -> str:
         """
         Генерация ответа
-        
+
         Args:
             prompt: Текст запроса
             context: История сообщений
             max_tokens: Максимальное количество токенов
-        
+            system_prompt: Системный промпт (None - DEFAULT_SYSTEM_PROMPT).
+                Идёт первым сообщением: неизменный префикс кэшируется провайдером
+
         Returns:
             Сгенерированный текст
         """
         pass
-    
+
     @abstractmethod
     async def generate_stream(
         self,
         prompt: str,
         context: Optional[List[Dict[str, str]]] = None,
-        max_tokens: int = 1000
+        max_tokens: int = 1000,
+        system_prompt: Optional[str] = None
     ):
         """Генерация ответа с потоковой передачей"""
         pass
+
+    def _record_usage(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+        """Учесть токены одного запроса"""
+        self.usage_requests += 1
+        self.prompt_tokens += prompt_tokens or 0
+        self.completion_tokens += completion_tokens or 0
+        self.cached_tokens += cached_tokens or 0
+
+    def get_usage_stats(self) -> dict:
+        """Токены запросов и доля промпта, прочитанная из кэша провайдера"""
+        return {
+            'requests': self.usage_requests,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cached_rate': self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        }
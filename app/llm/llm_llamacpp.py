@@ -1,6 +1,6 @@
 from typing import List, Dict, Optional
 from llama_cpp import Llama
-from .llm_base import BaseLLM
+from .llm_base import BaseLLM, DEFAULT_SYSTEM_PROMPT
 import os
 import asyncio
 import time
@@ -47,9 +47,10 @@ class LlamaCppLLM(BaseLLM):
         self,
         message: str,
         context: Optional[List[Dict[str, str]]] = None,
-        system_prompt: str = "Ты полезный AI ассистент. Отвечай на русском языке кратко и по существу."
+        system_prompt: Optional[str] = None
     ) -> str:
         """Создать промпт в формате Llama"""
+        system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
         
         # Для Llama 3 / Saiga формат
         prompt = f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{system_prompt}<|eot_id|>"
@@ -64,6 +65,9 @@ class LlamaCppLLM(BaseLLM):
                     prompt += f"<|start_header_id|>user<|end_header_id|>\n\n{content}<|eot_id|>"
                 elif role == "assistant":
                     prompt += f"<|start_header_id|>assistant<|end_header_id|>\n\n{content}<|eot_id|>"
+                elif role == "system":
+                    # Например, краткое содержание старой части диалога
+                    prompt += f"<|start_header_id|>system<|end_header_id|>\n\n{content}<|eot_id|>"
         
         # Добавляем текущее сообщение
         prompt += f"<|start_header_id|>user<|end_header_id|>\n\n{message}<|eot_id|>"
@@ -115,13 +119,14 @@ class LlamaCppLLM(BaseLLM):
         self,
         prompt: str,
         context: Optional[List[Dict[str, str]]] = None,
-        max_tokens: int = 1000
+        max_tokens: int = 1000,
+        system_prompt: Optional[str] = None
     ) -> str:
         """Генерация ответа"""
 
         print(f"🧠 LLM: создание промпта...")
         # Создаем полный промпт с контекстом
-        full_prompt = self._create_prompt(prompt, context)
+        full_prompt = self._create_prompt(prompt, context, system_prompt)
 
         print(f"🧠 LLM: промпт создан ({len(full_prompt)} символов)")
         print(f"🧠 LLM: начало генерации (max_tokens={max_tokens})...")
@@ -146,11 +151,12 @@ class LlamaCppLLM(BaseLLM):
         self,
         prompt: str,
         context: Optional[List[Dict[str, str]]] = None,
-        max_tokens: int = 1000
+        max_tokens: int = 1000,
+        system_prompt: Optional[str] = None
     ):
         """Генерация с потоковой передачей"""
         
-        full_prompt = self._create_prompt(prompt, context)
+        full_prompt = self._create_prompt(prompt, context, system_prompt)
         
         try:
             stream = self.llm(
@@ -182,9 +188,10 @@ class MistralLlamaCppLLM(LlamaCppLLM):
         self,
         message: str,
         context: Optional[List[Dict[str, str]]] = None,
-        system_prompt: str = "Ты полезный AI ассистент. Отвечай на русском языке кратко и по существу."
+        system_prompt: Optional[str] = None
     ) -> str:
         """Промпт в формате Mistral/Mixtral"""
+        system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
         
         prompt = f"<s>[INST] {system_prompt}\n\n"
         
@@ -198,6 +205,9 @@ class MistralLlamaCppLLM(LlamaCppLLM):
                     prompt += f"{content} [/INST]"
                 elif role == "assistant":
                     prompt += f"{content}</s>[INST] "
+                elif role == "system":
+                    # У Mistral нет роли system - передаём как пометку в реплике
+                    prompt += f"{content}\n\n"
         
         # Текущее сообщение
         prompt += f"{message} [/INST]"
@@ -208,13 +218,16 @@ class MistralLlamaCppLLM(LlamaCppLLM):
 class SaigaLlamaCppLLM(LlamaCppLLM):
     """Специализированный класс для русскоязычных моделей Saiga"""
     
+    SAIGA_SYSTEM_PROMPT = "Ты — Сайга, русскоязычный автоматический ассистент. Ты разговариваешь с людьми и помогаешь им."
+    
     def _create_prompt(
         self,
         message: str,
         context: Optional[List[Dict[str, str]]] = None,
-        system_prompt: str = "Ты — Сайга, русскоязычный автоматический ассистент. Ты разговариваешь с людьми и помогаешь им."
+        system_prompt: Optional[str] = None
     ) -> str:
         """Промпт для Saiga моделей"""
+        system_prompt = system_prompt or self.SAIGA_SYSTEM_PROMPT
         
         # Формат для Saiga Llama 3
         prompt = f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{system_prompt}<|eot_id|>"
@@ -228,6 +241,9 @@ class SaigaLlamaCppLLM(LlamaCppLLM):
                     prompt += f"<|start_header_id|>user<|end_header_id|>\n\n{content}<|eot_id|>"
                 elif role == "assistant":
                     prompt += f"<|start_header_id|>assistant<|end_header_id|>\n\n{content}<|eot_id|>"
+                elif role == "system":
+                    # Например, краткое содержание старой части диалога
+                    prompt += f"<|start_header_id|>system<|end_header_id|>\n\n{content}<|eot_id|>"
         
         prompt += f"<|start_header_id|>user<|end_header_id|>\n\n{message}<|eot_id|>"
         prompt += "<|start_header_id|>assistant<|end_header_id|>\n\n"
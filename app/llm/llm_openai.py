@@ -1,7 +1,7 @@
 from typing import List, Dict, Optional, AsyncGenerator
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from .llm_base import BaseLLM
+from .llm_base import BaseLLM, DEFAULT_SYSTEM_PROMPT
 import os
 
 
@@ -21,21 +21,25 @@ class OpenAILLM(BaseLLM):
             model=model_name,
             temperature=temperature,
             api_key=api_key or os.getenv("OPENAI_API_KEY"),
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            # Usage (в т.ч. cached_tokens) в последнем чанке стрима
+            stream_usage=True
         )
 
     def _prepare_messages(
         self,
         prompt: str,
-        context: Optional[List[Dict[str, str]]] = None
+        context: Optional[List[Dict[str, str]]] = None,
+        system_prompt: Optional[str] = None
     ) -> List:
-        """Подготовка сообщений для LangChain"""
+        """
+        Подготовка сообщений для LangChain: системный промпт, история, запрос.
+        Неизменное начало списка OpenAI кэширует между запросами.
+        """
         messages = []
 
         # Системное сообщение
-        messages.append(SystemMessage(
-            content="Ты полезный AI ассистент. Отвечай на русском языке кратко и по существу."
-        ))
+        messages.append(SystemMessage(content=system_prompt or DEFAULT_SYSTEM_PROMPT))
 
         # Добавляем контекст
         if context:
@@ -47,21 +51,37 @@ class OpenAILLM(BaseLLM):
                     messages.append(HumanMessage(content=content))
                 elif role == "assistant":
                     messages.append(AIMessage(content=content))
+                elif role == "system":
+                    # Например, краткое содержание старой части диалога
+                    messages.append(SystemMessage(content=content))
 
         # Добавляем текущий промпт
         messages.append(HumanMessage(content=prompt))
 
         return messages
 
+    def _record_message_usage(self, message):
+        """Учесть токены из usage_metadata ответа LangChain"""
+        usage = getattr(message, 'usage_metadata', None)
+        if not usage:
+            return
+        details = usage.get('input_token_details') or {}
+        self._record_usage(
+            prompt_tokens=usage.get('input_tokens', 0),
+            completion_tokens=usage.get('output_tokens', 0),
+            cached_tokens=details.get('cache_read', 0)
+        )
+
     async def generate(
         self,
         prompt: str,
         context: Optional[List[Dict[str, str]]] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        system_prompt: Optional[str] = None
     ) -> str:
         """Генерация ответа через OpenAI API (LangChain)"""
         try:
-            messages = self._prepare_messages(prompt, context)
+            messages = self._prepare_messages(prompt, context, system_prompt)
 
             # Используем переданный max_tokens или значение по умолчанию
             if max_tokens is not None:
@@ -73,6 +93,7 @@ class OpenAILLM(BaseLLM):
             else:
                 response = await self.client.ainvoke(messages)
 
+            self._record_message_usage(response)
             return response.content
         except Exception as e:
             return f"Ошибка при генерации ответа: {str(e)}"
@@ -81,11 +102,12 @@ class OpenAILLM(BaseLLM):
         self,
         prompt: str,
         context: Optional[List[Dict[str, str]]] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        system_prompt: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
         """Генерация ответа с потоковой передачей через LangChain"""
         try:
-            messages = self._prepare_messages(prompt, context)
+            messages = self._prepare_messages(prompt, context, system_prompt)
 
             # Используем переданный max_tokens или значение по умолчанию
             if max_tokens is not None:
@@ -93,12 +115,14 @@ class OpenAILLM(BaseLLM):
                 self.client.max_tokens = max_tokens
 
                 async for chunk in self.client.astream(messages):
+                    self._record_message_usage(chunk)
                     if chunk.content:
                         yield chunk.content
 
                 self.client.max_tokens = original_max_tokens
             else:
                 async for chunk in self.client.astream(messages):
+                    self._record_message_usage(chunk)
                     if chunk.content:
                         yield chunk.content
         except Exception as e:
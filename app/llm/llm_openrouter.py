@@ -4,7 +4,7 @@ import json
 from typing import List, Dict, Optional, AsyncGenerator
 import aiohttp
 
-from .llm_base import BaseLLM
+from .llm_base import BaseLLM, DEFAULT_SYSTEM_PROMPT
 
 
 class OpenRouterLLM(BaseLLM):
@@ -41,30 +41,53 @@ class OpenRouterLLM(BaseLLM):
         }
         return headers
 
+    def _build_messages(
+        self,
+        prompt: str,
+        context: Optional[List[Dict[str, str]]] = None,
+        system_prompt: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Системный промпт, история, запрос. Неизменное начало списка
+        провайдеры за OpenRouter кэшируют между запросами.
+        """
+        messages = [{"role": "system", "content": system_prompt or DEFAULT_SYSTEM_PROMPT}]
+        if context:
+            messages.extend(context)
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def _record_response_usage(self, usage: Optional[dict]):
+        """Учесть токены из поля usage ответа (формат OpenAI)"""
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        self._record_usage(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            cached_tokens=details.get("cached_tokens", 0)
+        )
+
     async def generate(
         self,
         prompt: str,
         context: Optional[List[Dict[str, str]]] = None,
-        max_tokens: Optional[int] = None  # ← Делаем опциональным
+        max_tokens: Optional[int] = None,  # ← Делаем опциональным
+        system_prompt: Optional[str] = None
     ) -> str:
         # Используем переданный max_tokens или значение по умолчанию из __init__
         tokens_to_use = max_tokens if max_tokens is not None else self.max_tokens
         
-        messages = []
-        messages.append({
-            "role": "system",
-            "content": "Ты полезный AI ассистент. Отвечай на русском языке кратко и по существу."
-        })
-        if context:
-            messages.extend(context)
-        messages.append({"role": "user", "content": prompt})
+        messages = self._build_messages(prompt, context, system_prompt)
 
         payload = {
             "model": self.model_name,
             "messages": messages,
             "temperature": float(self.temperature),
             "max_tokens": int(tokens_to_use),
-            "stream": False
+            "stream": False,
+            # Учёт токенов, в т.ч. prompt_tokens_details.cached_tokens
+            "usage": {"include": True}
         }
 
         headers = await self._build_headers()
@@ -79,6 +102,8 @@ class OpenRouterLLM(BaseLLM):
                 except Exception:
                     return f"Неправильный JSON в ответе OpenRouter: {text}"
 
+        self._record_response_usage(data.get("usage"))
+
         # Поддерживаем формат, похожий на OpenAI
         try:
             return data["choices"][0]["message"]["content"]
@@ -89,7 +114,8 @@ class OpenRouterLLM(BaseLLM):
         self,
         prompt: str,
         context: Optional[List[Dict[str, str]]] = None,
-        max_tokens: Optional[int] = None  # ← Делаем опциональным
+        max_tokens: Optional[int] = None,  # ← Делаем опциональным
+        system_prompt: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
         """
         Возвращает асинхронный генератор токенов / чанков.
@@ -98,21 +124,16 @@ class OpenRouterLLM(BaseLLM):
         # Используем переданный max_tokens или значение по умолчанию из __init__
         tokens_to_use = max_tokens if max_tokens is not None else self.max_tokens
         
-        messages = []
-        messages.append({
-            "role": "system",
-            "content": "Ты полезный AI ассистент. Отвечай на русском языке кратко и по существу."
-        })
-        if context:
-            messages.extend(context)
-        messages.append({"role": "user", "content": prompt})
+        messages = self._build_messages(prompt, context, system_prompt)
 
         payload = {
             "model": self.model_name,
             "messages": messages,
             "temperature": float(self.temperature),
             "max_tokens": int(tokens_to_use),
-            "stream": True
+            "stream": True,
+            # Учёт токенов, в т.ч. prompt_tokens_details.cached_tokens
+            "usage": {"include": True}
         }
 
         headers = await self._build_headers()
@@ -141,6 +162,10 @@ class OpenRouterLLM(BaseLLM):
                     # Попробуем распарсить JSON
                     try:
                         chunk = json.loads(line)
+                        # Последний чанк несёт usage (choices может быть пустым)
+                        self._record_response_usage(chunk.get("usage"))
+                        if not chunk.get("choices"):
+                            continue
                         # Ожидаем структуру: choices[0].delta.content
                         content = chunk.get("choices", [{}])[0].get("delta", {}).get("content")
                         if content:
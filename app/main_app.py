@@ -138,7 +138,7 @@ async def initialize_system():
                 tenant_id = tenant_dir.name
                 
                 # Пропускаем служебные директории
-                if tenant_id in ['vectorstore', 'documents', '__pycache__']:
+                if tenant_id in ['vectorstore', 'documents', '__pycache__', '_shared']:
                     continue
                 
                 print(f"📦 Обнаружена директория клиента: {tenant_id}")
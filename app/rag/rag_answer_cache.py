@@ -0,0 +1,183 @@
+"""
+Семантический кэш ответов клиента.
+
+Вопросы в поддержке часто повторяются разными словами. Кэш хранит
+эмбеддинг вопроса и готовый ответ; новый вопрос без истории чата, близкий
+к сохранённому (косинусная близость не ниже порога), получает ответ из
+кэша без retrieval и генерации LLM.
+
+Повтор дословно того же вопроса находится по тексту, без эмбеддинга.
+Записи живут ttl секунд, при переполнении вытесняется давно не
+использованная. Ответы зависят от базы знаний, поэтому при смене
+поколения индекса (добавление или удаление чанков) кэш очищается.
+"""
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ..schemas import RAGResponse
+
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+class SemanticAnswerCache:
+    """Кэш ответов по близости эмбеддингов вопросов (LRU + TTL)"""
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None
+    ):
+        """
+        Args:
+            threshold: Минимальная косинусная близость вопросов (ANSWER_CACHE_THRESHOLD)
+            ttl: Время жизни записи в секундах (ANSWER_CACHE_TTL, 0 - без ограничения)
+            max_entries: Максимум записей (ANSWER_CACHE_SIZE)
+        """
+        self.threshold = threshold if threshold is not None else float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+        # Векторы вопросов - строки матрицы, записи ссылаются на номер строки
+        self._vectors: Optional[np.ndarray] = None
+        self._created = np.zeros(self.max_entries, dtype='float64')
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._by_question: Dict[str, int] = {}
+        self._free: List[int] = list(range(self.max_entries - 1, -1, -1))
+        self.generation: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _question_key(question: str) -> str:
+        return _SPACE_RE.sub(" ", question.strip().lower())
+
+    def _check_generation(self, generation: int):
+        """Очистить кэш, если индекс изменился"""
+        if generation == self.generation:
+            return
+        if self._entries:
+            self.invalidations += 1
+            self.clear()
+        self.generation = generation
+
+    def _remove(self, slot: int):
+        entry = self._entries.pop(slot)
+        if self._by_question.get(entry['key']) == slot:
+            del self._by_question[entry['key']]
+        self._valid[slot] = False
+        self._free.append(slot)
+
+    def _is_expired(self, slot: int) -> bool:
+        return bool(self.ttl) and self._created[slot] < time.time() - self.ttl
+
+    def _hit(self, slot: int) -> RAGResponse:
+        self.hits += 1
+        self._entries.move_to_end(slot)
+        return self._entries[slot]['response']
+
+    def clear(self):
+        """Удалить все записи"""
+        for slot in list(self._entries):
+            self._remove(slot)
+
+    def get_exact(self, question: str, generation: int) -> Optional[RAGResponse]:
+        """
+        Найти ответ на тот же вопрос (без учёта регистра и пробелов).
+        Промах не считается: за ним следует поиск по эмбеддингу (get).
+        """
+        self._check_generation(generation)
+        slot = self._by_question.get(self._question_key(question))
+        if slot is None:
+            return None
+        if self._is_expired(slot):
+            self._remove(slot)
+            self.expirations += 1
+            return None
+        return self._hit(slot)
+
+    def get(self, vector, generation: int) -> Optional[RAGResponse]:
+        """
+        Найти ответ на близкий вопрос
+
+        Args:
+            vector: Эмбеддинг вопроса
+            generation: Текущее поколение индекса клиента
+
+        Returns:
+            Сохранённый ответ или None
+        """
+        self._check_generation(generation)
+        if not self._entries:
+            self.misses += 1
+            return None
+
+        if self.ttl:
+            expired = np.flatnonzero(self._valid & (self._created < time.time() - self.ttl))
+            for slot in expired:
+                self._remove(int(slot))
+            self.expirations += len(expired)
+
+        similarities = self._vectors @ self._normalize(vector)
+        similarities[~self._valid] = -1.0
+        slot = int(np.argmax(similarities))
+        if similarities[slot] < self.threshold:
+            self.misses += 1
+            return None
+
+        return self._hit(slot)
+
+    def put(self, question: str, vector, response: RAGResponse, generation: int):
+        """Сохранить ответ на вопрос"""
+        if self.max_entries <= 0:
+            return
+        self._check_generation(generation)
+
+        vector = self._normalize(vector)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, len(vector)), dtype='float32')
+
+        if not self._free:
+            # Вытесняем давно не использованную запись
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+        slot = self._free.pop()
+        self._vectors[slot] = vector
+        self._created[slot] = time.time()
+        self._valid[slot] = True
+        key = self._question_key(question)
+        self._entries[slot] = {'key': key, 'response': response}
+        self._by_question[key] = slot
+
+    def get_stats(self) -> dict:
+        """Метрики кэша"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations
+        }
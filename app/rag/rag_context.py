@@ -0,0 +1,157 @@
+"""
+Упаковка найденных чанков в контекст промпта по бюджету токенов.
+
+Соседние чанки одного документа (chunk_id подряд) склеиваются в один
+фрагмент, повторяющееся перекрытие между ними (хвост предыдущего чанка
+в начале следующего) вырезается. Затем фрагменты добавляются в порядке
+релевантности, пока не исчерпан бюджет токенов - размер промпта
+предсказуем независимо от top_k и длины чанков.
+
+Документ определяется по metadata['document_id'] (задаётся очередью
+индексации), затем по file_path. source для этого не годится: у всех
+загрузок через API он одинаковый, а chunk_id каждой начинается с 0.
+Чанки без такого ключа не склеиваются.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from ..schemas import Document
+from .rag_tokens import count_tokens, split_by_tokens, stored_token_count
+
+
+# Максимальная длина искомого перекрытия в символах
+_MAX_OVERLAP_CHARS = 4000
+# Длина начала следующего чанка, по которой ищутся кандидаты перекрытия
+_PROBE_CHARS = 16
+
+
+class ContextBlock:
+    """Фрагмент контекста: склеенные соседние чанки одного документа"""
+
+    def __init__(self, text: str, score: float, documents: List[Document], tokens: int):
+        self.text = text
+        self.score = score
+        self.documents = documents
+        self.tokens = tokens
+
+    @property
+    def source(self) -> str:
+        return self.documents[0].metadata.get('source', 'Unknown')
+
+
+def overlap_length(previous: str, following: str) -> int:
+    """Длина самого длинного суффикса previous, совпадающего с началом following"""
+    tail = previous[-_MAX_OVERLAP_CHARS:]
+    probe = following[:_PROBE_CHARS]
+    if not probe:
+        return 0
+
+    position = tail.find(probe)
+    while position != -1:
+        # Первое вхождение даёт самое длинное перекрытие
+        if following.startswith(tail[position:]):
+            return len(tail) - position
+        position = tail.find(probe, position + 1)
+    return 0
+
+
+def _merge_run(run: List[Tuple[Document, float]]) -> ContextBlock:
+    """Склеить подряд идущие чанки, вырезав перекрытия"""
+    text = run[0][0].content
+    for document, _ in run[1:]:
+        overlap = overlap_length(text, document.content)
+        rest = document.content[overlap:]
+        if overlap == 0:
+            text += "\n"
+        text += rest
+
+    documents = [document for document, _ in run]
+    score = max(score for _, score in run)
+    if len(run) == 1:
+        tokens = stored_token_count(documents[0].metadata, text)
+    else:
+        tokens = count_tokens(text)
+    return ContextBlock(text, score, documents, tokens)
+
+
+def _document_key(metadata: dict) -> Optional[str]:
+    """Ключ документа чанка (None - документ однозначно не определить)"""
+    if metadata.get('document_id'):
+        return f"document:{metadata['document_id']}"
+    if metadata.get('file_path'):
+        return f"file:{metadata['file_path']}"
+    return None
+
+
+def merge_chunks(documents: List[Tuple[Document, float]]) -> List[ContextBlock]:
+    """
+    Склеить соседние и повторяющиеся чанки одного документа
+
+    Args:
+        documents: Найденные чанки с score
+
+    Returns:
+        Фрагменты в порядке убывания score
+    """
+    groups: Dict[str, Dict[int, Tuple[Document, float]]] = {}
+    standalone: List[Tuple[Document, float]] = []
+
+    for document, score in documents:
+        document_key = _document_key(document.metadata)
+        chunk_id = document.metadata.get('chunk_id')
+        if document_key is None or chunk_id is None:
+            standalone.append((document, score))
+            continue
+        chunks = groups.setdefault(document_key, {})
+        # Один и тот же чанк дважды - оставляем лучший score
+        if chunk_id not in chunks or chunks[chunk_id][1] < score:
+            chunks[chunk_id] = (document, score)
+
+    blocks = [_merge_run([item]) for item in standalone]
+    for chunks in groups.values():
+        run: List[Tuple[Document, float]] = []
+        previous_id: Optional[int] = None
+        for chunk_id in sorted(chunks):
+            if run and chunk_id != previous_id + 1:
+                blocks.append(_merge_run(run))
+                run = []
+            run.append(chunks[chunk_id])
+            previous_id = chunk_id
+        if run:
+            blocks.append(_merge_run(run))
+
+    blocks.sort(key=lambda block: block.score, reverse=True)
+    return blocks
+
+
+def pack_context(
+    documents: List[Tuple[Document, float]],
+    max_tokens: int
+) -> List[ContextBlock]:
+    """
+    Отобрать фрагменты контекста в пределах бюджета токенов
+
+    Args:
+        documents: Найденные чанки с score
+        max_tokens: Бюджет токенов контекста (0 - без ограничения)
+
+    Returns:
+        Фрагменты в порядке убывания score
+    """
+    blocks = merge_chunks(documents)
+    if max_tokens <= 0:
+        return blocks
+
+    packed: List[ContextBlock] = []
+    used = 0
+    for block in blocks:
+        if used + block.tokens <= max_tokens:
+            packed.append(block)
+            used += block.tokens
+        elif not packed:
+            # Самый релевантный фрагмент не влезает целиком - обрезаем
+            text = split_by_tokens(block.text, max_tokens)[0]
+            packed.append(ContextBlock(text, block.score, block.documents, count_tokens(text)))
+            used += packed[-1].tokens
+        # Менее релевантные, но короткие фрагменты ещё могут поместиться
+
+    return packed
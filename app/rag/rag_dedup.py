@@ -0,0 +1,110 @@
+"""
+Поиск почти дублирующихся чанков при индексации.
+
+Отпечаток чанка - 64-битный SimHash по шинглам из трёх слов: тексты,
+отличающиеся несколькими словами, дают отпечатки с малым расстоянием
+Хэмминга. Кандидаты ищутся через LSH: отпечаток делится на
+max_distance + 1 полос, и по принципу Дирихле у отпечатков с расстоянием
+не больше max_distance хотя бы одна полоса совпадает целиком.
+"""
+import re
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..schemas import Document
+
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+FINGERPRINT_BITS = 64
+_BIT_WEIGHTS = np.array([1 << bit for bit in range(FINGERPRINT_BITS)], dtype=object)
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """
+    64-битный SimHash текста
+
+    Args:
+        text: Текст чанка
+        shingle_size: Число слов в шингле
+
+    Returns:
+        Отпечаток (целое без знака)
+    """
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return 0
+
+    if len(words) <= shingle_size:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [
+            " ".join(words[i:i + shingle_size])
+            for i in range(len(words) - shingle_size + 1)
+        ]
+
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest() for s in shingles),
+        dtype='<u8'
+    )
+    # Матрица битов (шинглы x 64), младший бит - первый столбец
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    return int((_BIT_WEIGHTS * (votes > 0)).sum())
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Расстояние Хэмминга между отпечатками"""
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """LSH индекс отпечатков SimHash"""
+
+    def __init__(self, max_distance: int = 3):
+        """
+        Args:
+            max_distance: Максимальное расстояние Хэмминга, при котором
+                чанки считаются дубликатами (0 - только точные совпадения)
+        """
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = FINGERPRINT_BITS // bands
+        # Последняя полоса забирает остаток битов
+        self._bands: List[Tuple[int, int]] = [
+            (i * width, FINGERPRINT_BITS - i * width if i == bands - 1 else width)
+            for i in range(bands)
+        ]
+        self._buckets: List[Dict[int, List[Tuple[int, Document]]]] = [{} for _ in self._bands]
+        self.size = 0
+
+    def _keys(self, fingerprint: int):
+        for shift, width in self._bands:
+            yield (fingerprint >> shift) & ((1 << width) - 1)
+
+    def add(self, fingerprint: int, document: Document):
+        """Добавить чанк в индекс"""
+        for buckets, key in zip(self._buckets, self._keys(fingerprint)):
+            buckets.setdefault(key, []).append((fingerprint, document))
+        self.size += 1
+
+    def find(self, fingerprint: int, content: Optional[str] = None) -> Optional[Document]:
+        """
+        Найти ранее добавленный почти дублирующийся чанк
+
+        Args:
+            fingerprint: Отпечаток чанка
+            content: Текст чанка; при max_distance 0 дубликатом считается
+                только точная копия (совпадение отпечатков не гарантирует
+                совпадения текста: замена одного числа может его не изменить)
+        """
+        for buckets, key in zip(self._buckets, self._keys(fingerprint)):
+            for candidate, document in buckets.get(key, ()):
+                if hamming_distance(fingerprint, candidate) > self.max_distance:
+                    continue
+                if self.max_distance == 0 and content is not None and document.content != content:
+                    continue
+                return document
+        return None
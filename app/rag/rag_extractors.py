@@ -0,0 +1,244 @@
+"""
+Извлечение текста из файлов документов.
+
+PDF читается постранично (pypdf), DOCX - по абзацам и таблицам
+(python-docx), остальные форматы - как UTF-8 текст блоками. Текст
+отдаётся потоком, чтобы нарезка начиналась до конца разбора файла.
+
+Разбор бинарных форматов выполняется в изолированном пуле процессов
+(ExtractorPool) с таймаутом на файл и лимитом памяти на процесс:
+зависший или огромный файл не блокирует и не роняет основной процесс.
+"""
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import docx
+except ImportError:
+    docx = None
+
+
+# Форматы, которые разбираются только в пуле процессов
+BINARY_EXTENSIONS = {'.pdf', '.docx'}
+
+
+class ExtractionError(Exception):
+    """Не удалось извлечь текст из файла"""
+    pass
+
+
+def iter_text_blocks(file_path: str, block_size: int = 1 << 16) -> Iterator[str]:
+    """Читать текстовый файл буферизованными блоками"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+
+def iter_pdf_blocks(file_path: str) -> Iterator[str]:
+    """Текст PDF постранично"""
+    if PdfReader is None:
+        raise ExtractionError("pypdf не установлен: pip install pypdf")
+
+    try:
+        reader = PdfReader(file_path)
+        if reader.is_encrypted:
+            reader.decrypt("")
+        for page in reader.pages:
+            text = page.extract_text() or ""
+            if text.strip():
+                # Пустая строка - граница абзаца для нарезки
+                yield text + "\n\n"
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"Ошибка разбора PDF {Path(file_path).name}: {e}") from e
+
+
+def iter_docx_blocks(file_path: str) -> Iterator[str]:
+    """Текст DOCX по абзацам, затем таблицы построчно"""
+    if docx is None:
+        raise ExtractionError("python-docx не установлен: pip install python-docx")
+
+    try:
+        document = docx.Document(file_path)
+        for paragraph in document.paragraphs:
+            if paragraph.text.strip():
+                yield paragraph.text + "\n"
+        for table in document.tables:
+            for row in table.rows:
+                cells = [cell.text.strip() for cell in row.cells]
+                if any(cells):
+                    yield " | ".join(cells) + "\n"
+    except Exception as e:
+        raise ExtractionError(f"Ошибка разбора DOCX {Path(file_path).name}: {e}") from e
+
+
+def iter_document_blocks(file_path: str, block_size: int = 1 << 16) -> Iterator[str]:
+    """
+    Текст файла потоком блоков в зависимости от формата
+
+    Args:
+        file_path: Путь к файлу
+        block_size: Размер блока для текстовых файлов
+
+    Returns:
+        Итератор блоков текста
+    """
+    suffix = Path(file_path).suffix.lower()
+    if suffix == '.pdf':
+        return iter_pdf_blocks(file_path)
+    if suffix == '.docx':
+        return iter_docx_blocks(file_path)
+    return iter_text_blocks(file_path, block_size)
+
+
+def _address_space_bytes() -> int:
+    """Текущий объём виртуальной памяти процесса"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _limit_worker_memory(max_memory_mb: int):
+    """
+    Инициализатор процесса пула: ограничить рост виртуальной памяти.
+    Лимит отсчитывается от текущего размера (процесс наследует память
+    родителя), при превышении разбор падает с MemoryError.
+    """
+    if resource is None or max_memory_mb <= 0:
+        return
+    limit = _address_space_bytes() + max_memory_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        print(f"⚠️  Не удалось ограничить память процесса разбора: {e}")
+
+
+class ExtractorPool:
+    """
+    Пул процессов для разбора файлов с таймаутом и лимитом памяти.
+
+    При таймауте процессы пула завершаются и пул пересоздаётся. Падение
+    процесса ломает весь пул, поэтому прерванные вызовы повторяются по
+    одному в отдельном процессе: виновник падения не роняет соседние файлы.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        timeout: Optional[float] = None,
+        max_memory_mb: Optional[int] = None
+    ):
+        """
+        Args:
+            workers: Число процессов
+            timeout: Таймаут разбора одного файла в секундах (EXTRACT_TIMEOUT)
+            max_memory_mb: Лимит прироста памяти процесса в МБ (EXTRACT_MAX_MEMORY_MB, 0 - без лимита)
+        """
+        self.workers = workers
+        self.timeout = timeout if timeout is not None else float(os.getenv("EXTRACT_TIMEOUT", "120"))
+        self.max_memory_mb = max_memory_mb if max_memory_mb is not None else int(os.getenv("EXTRACT_MAX_MEMORY_MB", "1024"))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+        self.timeouts = 0
+        self.crashes = 0
+
+    def _new_executor(self, workers: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_limit_worker_memory,
+            initargs=(self.max_memory_mb,)
+        )
+
+    @staticmethod
+    def _kill(executor: ProcessPoolExecutor):
+        """Завершить процессы (зависший разбор иначе не прервать)"""
+        for process in list((getattr(executor, '_processes', None) or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _recycle(self, generation: int):
+        """Пересоздать общий пул (один раз на поколение пула)"""
+        if generation != self._generation or self._executor is None:
+            return
+        executor = self._executor
+        self._executor = None
+        self._generation += 1
+        self._kill(executor)
+
+    async def _submit(self, executor: ProcessPoolExecutor, func, args):
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(executor, func, *args)
+            return await asyncio.wait_for(future, timeout=self.timeout or None)
+        except MemoryError:
+            raise ExtractionError(f"Превышен лимит памяти разбора ({self.max_memory_mb} МБ)")
+
+    def _timeout_error(self) -> ExtractionError:
+        self.timeouts += 1
+        return ExtractionError(f"Таймаут разбора ({self.timeout:.0f} с)")
+
+    async def run(self, func, *args):
+        """
+        Выполнить func(*args) в процессе пула
+
+        Raises:
+            ExtractionError: Таймаут, нехватка памяти или падение процесса разбора
+        """
+        if self._executor is None:
+            self._executor = self._new_executor(self.workers)
+
+        generation = self._generation
+        try:
+            return await self._submit(self._executor, func, args)
+        except asyncio.TimeoutError:
+            self._recycle(generation)
+            raise self._timeout_error()
+        except BrokenProcessPool:
+            self.crashes += 1
+            self._recycle(generation)
+
+        # Повтор в отдельном процессе
+        executor = self._new_executor(1)
+        try:
+            return await self._submit(executor, func, args)
+        except asyncio.TimeoutError:
+            raise self._timeout_error()
+        except BrokenProcessPool:
+            raise ExtractionError("Процесс разбора аварийно завершился")
+        finally:
+            self._kill(executor)
+
+    def shutdown(self):
+        """
+        Остановить пул, не дожидаясь выхода процессов: вызывается из
+        асинхронной индексации и не должен блокировать event loop
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
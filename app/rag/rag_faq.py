@@ -0,0 +1,204 @@
+"""
+Курируемый FAQ клиента: канонические ответы без вызова LLM.
+
+FAQ загружается из DATA_DIR/<tenant>/faq.yaml (faq.yml, faq.json или
+faq.csv). Каждая запись - варианты формулировки вопроса и канонический
+ответ:
+
+    - questions:
+        - Как оплатить заказ?
+        - Какие способы оплаты есть?
+      answer: Оплатить можно картой или по счёту.
+
+В CSV колонки question и answer, варианты вопроса разделяются " | ".
+
+Варианты вопросов индексируются эмбеддингами (косинусная близость) и
+термами (лексическое совпадение, если embeddings API недоступен).
+Дословный вопрос находится по тексту без эмбеддинга.
+"""
+import os
+import re
+import csv
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import yaml
+
+from ..vectorstore.vectorstore_terms import lexical_terms
+
+
+_SPACE_RE = re.compile(r"\s+")
+
+# Поддерживаемые файлы FAQ в порядке приоритета
+FAQ_FILENAMES = ['faq.yaml', 'faq.yml', 'faq.json', 'faq.csv']
+
+
+def _normalize(text: str) -> str:
+    return _SPACE_RE.sub(" ", text.strip().lower()).rstrip("?!. ")
+
+
+class FAQEntry:
+    """Запись FAQ: варианты вопроса и канонический ответ"""
+
+    def __init__(self, questions: List[str], answer: str, source: str = "FAQ"):
+        self.questions = questions
+        self.answer = answer
+        self.source = source
+        self.hits = 0
+
+
+class FAQIndex:
+    """Индекс вариантов вопросов FAQ для быстрого сопоставления"""
+
+    def __init__(self, entries: List[FAQEntry], threshold: Optional[float] = None):
+        """
+        Args:
+            entries: Записи FAQ
+            threshold: Минимальная уверенность совпадения 0-1 (FAQ_THRESHOLD):
+                косинусная близость эмбеддингов или лексическое сходство
+        """
+        self.entries = entries
+        self.threshold = threshold if threshold is not None else float(os.getenv("FAQ_THRESHOLD", "0.9"))
+
+        # Плоский список вариантов: (запись, текст варианта)
+        self._variants: List[Tuple[FAQEntry, str]] = [
+            (entry, question) for entry in entries for question in entry.questions
+        ]
+        self._exact: Dict[str, FAQEntry] = {
+            _normalize(question): entry for entry, question in self._variants
+        }
+        self._terms: List[Set[str]] = [lexical_terms(question) for _, question in self._variants]
+        self._vectors: Optional[np.ndarray] = None
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: str, threshold: Optional[float] = None) -> "FAQIndex":
+        """
+        Загрузить FAQ из YAML, JSON или CSV
+
+        Raises:
+            ValueError: Неверный формат файла
+        """
+        path = Path(path)
+        suffix = path.suffix.lower()
+
+        if suffix == '.csv':
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                items = [
+                    {'questions': (row.get('question') or '').split(' | '), 'answer': row.get('answer')}
+                    for row in csv.DictReader(f)
+                ]
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                items = json.load(f) if suffix == '.json' else yaml.safe_load(f)
+
+        if isinstance(items, dict):
+            items = items.get('faq', [])
+        if not isinstance(items, list):
+            raise ValueError(f"{path.name}: ожидается список записей FAQ")
+
+        entries = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise ValueError(f"{path.name}: запись {i} должна быть словарём")
+            questions = item.get('questions') or item.get('question') or []
+            if isinstance(questions, str):
+                questions = [questions]
+            questions = [str(question).strip() for question in questions if str(question).strip()]
+            answer = str(item.get('answer') or '').strip()
+            if not questions or not answer:
+                raise ValueError(f"{path.name}: у записи {i} нет вопроса или ответа")
+            entries.append(FAQEntry(questions=questions, answer=answer, source=path.name))
+
+        return cls(entries, threshold=threshold)
+
+    @staticmethod
+    def find_file(tenant_dir: Path) -> Optional[Path]:
+        """Файл FAQ в директории клиента"""
+        for filename in FAQ_FILENAMES:
+            path = Path(tenant_dir) / filename
+            if path.exists():
+                return path
+        return None
+
+    async def build(self, embeddings_service):
+        """
+        Посчитать эмбеддинги вариантов вопросов (через кэш эмбеддингов).
+        Без эмбеддингов FAQ сопоставляется только лексически.
+        """
+        if not self._variants:
+            return
+        try:
+            vectors = await embeddings_service.embed_documents([question for _, question in self._variants])
+        except Exception as e:
+            print(f"⚠️  FAQ: эмбеддинги не посчитаны, только лексическое сопоставление ({e})")
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self._vectors = vectors / np.where(norms == 0, 1, norms)
+
+    def match_exact(self, question: str) -> Optional[FAQEntry]:
+        """Запись с дословно таким же вариантом вопроса"""
+        return self._exact.get(_normalize(question))
+
+    def match(
+        self,
+        question: str,
+        query_embedding: Optional[List[float]] = None
+    ) -> Optional[Tuple[FAQEntry, float]]:
+        """
+        Найти запись FAQ для вопроса
+
+        Args:
+            question: Вопрос пользователя
+            query_embedding: Эмбеддинг вопроса (None - только лексическое сопоставление)
+
+        Returns:
+            (запись, уверенность) или None, если уверенность ниже порога
+        """
+        if not self._variants:
+            return None
+
+        entry = self.match_exact(question)
+        if entry is not None:
+            return self._hit(entry, 1.0)
+
+        if query_embedding is not None and self._vectors is not None:
+            query = np.asarray(query_embedding, dtype='float32')
+            norm = np.linalg.norm(query)
+            scores = self._vectors @ (query / norm if norm else query)
+        else:
+            # Коэффициент Дайса по термам вопроса и варианта
+            terms = lexical_terms(question)
+            if not terms:
+                self.misses += 1
+                return None
+            scores = np.array([
+                2 * len(terms & variant) / (len(terms) + len(variant)) if variant else 0.0
+                for variant in self._terms
+            ])
+
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        return self._hit(self._variants[best][0], float(scores[best]))
+
+    def _hit(self, entry: FAQEntry, score: float) -> Tuple[FAQEntry, float]:
+        self.hits += 1
+        entry.hits += 1
+        return entry, score
+
+    def get_stats(self) -> dict:
+        """Метрики FAQ"""
+        return {
+            'entries': len(self.entries),
+            'variants': len(self._variants),
+            'vector_index': self._vectors is not None,
+            'threshold': self.threshold,
+            'hits': self.hits,
+            'misses': self.misses
+        }
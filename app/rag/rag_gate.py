@@ -0,0 +1,168 @@
+"""
+Локальный фильтр retrieval: нужен ли поиск по базе знаний.
+
+Приветствия, благодарности и другие реплики без запроса информации, а
+также сообщения, слова которых почти не встречаются в документах клиента,
+обрабатываются без эмбеддинга и поиска в FAISS. Решение принимается до
+любых сетевых вызовов.
+
+Словарь клиента - нормализованные термы всех чанков индекса (берутся из
+инвертированного индекса хранилища, без распаковки текста) и FAQ. Он
+перестраивается в фоне, когда меняется поколение индекса (не чаще
+refresh_interval), до этого решения принимаются по прежнему словарю.
+Решения считаются по причинам, последние сохраняются для настройки
+порога клиента.
+"""
+import os
+import re
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from ..vectorstore.vectorstore_terms import lexical_terms
+
+
+# Реплика целиком из приветствий, благодарностей, прощаний и подтверждений
+_SMALLTALK_RE = re.compile(
+    r"^(?:(?:привет\w*|здравствуй\w*|добр\w* (?:утро|день|вечер|ночи)|хай|"
+    r"hi|hello|hey|спасибо(?: большое| огромное)?|благодарю|спс|thanks|thank you|пока|до свидания|bye|"
+    r"ок|окей|ok|okay|хорошо|понятно|ясно|ладно|отлично|супер|да|нет|ага|угу|"
+    r"yes|no)[\s!.,)]*)+$"
+)
+
+# Сколько термов скопировать между передачами управления циклу событий
+_REFRESH_BATCH = 20000
+# Сколько последних решений хранится для настройки
+_RECENT_DECISIONS = 100
+
+
+class RetrievalGate:
+    """Правила и лексическое пересечение со словарём клиента"""
+
+    def __init__(
+        self,
+        vectorstore,
+        extra_texts: Optional[List[str]] = None,
+        min_overlap: Optional[float] = None,
+        refresh_interval: Optional[float] = None
+    ):
+        """
+        Args:
+            vectorstore: Векторное хранилище клиента (источник словаря)
+            extra_texts: Дополнительные тексты словаря (вопросы и ответы FAQ)
+            min_overlap: Минимальная доля термов вопроса, известных словарю
+                (RAG_GATE_MIN_OVERLAP), ниже - ответ без retrieval
+            refresh_interval: Минимальный интервал перестроения словаря в секундах
+                (RAG_GATE_REFRESH_INTERVAL)
+        """
+        self.vectorstore = vectorstore
+        self.extra_texts = extra_texts or []
+        self.min_overlap = min_overlap if min_overlap is not None else float(os.getenv("RAG_GATE_MIN_OVERLAP", "0.2"))
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(os.getenv("RAG_GATE_REFRESH_INTERVAL", "60"))
+
+        self.vocabulary: Optional[Set[str]] = None
+        self.vocabulary_generation: Optional[int] = None
+        self._built_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # Метрики: решения по причинам и последние решения
+        self.decisions: Dict[str, int] = {}
+        self.skipped = 0
+        self.recent: Deque[dict] = deque(maxlen=_RECENT_DECISIONS)
+
+    def needs_retrieval(self, question: str) -> bool:
+        """
+        Нужен ли поиск по базе знаний для вопроса (без сетевых вызовов)
+
+        Returns:
+            False для реплик без запроса информации и вопросов не по теме документов
+        """
+        self._maybe_refresh()
+        retrieve, reason, overlap = self._decide(question)
+
+        self.decisions[reason] = self.decisions.get(reason, 0) + 1
+        if not retrieve:
+            self.skipped += 1
+            print(f"🚦 RetrievalGate: поиск не нужен ({reason})")
+        self.recent.append({
+            'question': question[:100],
+            'retrieve': retrieve,
+            'reason': reason,
+            'overlap': overlap,
+            'time': time.time()
+        })
+        return retrieve
+
+    def _decide(self, question: str) -> Tuple[bool, str, Optional[float]]:
+        """(нужен ли поиск, причина, доля известных термов)"""
+        text = question.strip().lower()
+        if _SMALLTALK_RE.match(text):
+            return False, 'smalltalk', None
+
+        terms = lexical_terms(text)
+        if not terms:
+            return False, 'no_terms', None
+
+        if not self.vocabulary:
+            # Словарь ещё не построен (или индекс пуст) - не фильтруем
+            return True, 'no_vocabulary', None
+
+        overlap = round(len(terms & self.vocabulary) / len(terms), 3)
+        if overlap < self.min_overlap:
+            return False, 'low_overlap', overlap
+        return True, 'overlap', overlap
+
+    def _maybe_refresh(self):
+        """Запустить фоновое перестроение словаря, если индекс изменился"""
+        if self.vectorstore.generation == self.vocabulary_generation:
+            return
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        if self.vocabulary is not None and time.time() - self._built_at < self.refresh_interval:
+            return
+        self._refresh_task = asyncio.ensure_future(self._refresh_safe())
+
+    async def _refresh_safe(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"⚠️  RetrievalGate: ошибка построения словаря: {e}")
+
+    async def refresh(self):
+        """Построить словарь по термам хранилища и дополнительным текстам"""
+        generation = self.vectorstore.generation
+        index_terms = self.vectorstore.lexical_vocabulary()
+        if index_terms is None:
+            # Хранилище не ведёт словарь - не фильтруем
+            self.vocabulary = None
+            self.vocabulary_generation = generation
+            self._built_at = time.time()
+            return
+
+        # Снимок: индекс может меняться, пока словарь строится
+        index_terms = list(index_terms)
+        vocabulary: Set[str] = set()
+        for text in self.extra_texts:
+            vocabulary |= lexical_terms(text)
+        for start in range(0, len(index_terms), _REFRESH_BATCH):
+            vocabulary.update(index_terms[start:start + _REFRESH_BATCH])
+            # Не блокируем обработку запросов на больших словарях
+            await asyncio.sleep(0)
+
+        self.vocabulary = vocabulary
+        self.vocabulary_generation = generation
+        self._built_at = time.time()
+        print(f"🚦 RetrievalGate: словарь {len(vocabulary)} термов")
+
+    def get_stats(self) -> dict:
+        """Метрики и последние решения фильтра"""
+        total = sum(self.decisions.values())
+        return {
+            'vocabulary_size': len(self.vocabulary) if self.vocabulary is not None else None,
+            'min_overlap': self.min_overlap,
+            'decisions': dict(self.decisions),
+            'skipped': self.skipped,
+            'skip_rate': self.skipped / total if total else 0.0,
+            'recent': list(self.recent)[-20:]
+        }
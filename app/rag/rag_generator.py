@@ -1,51 +1,74 @@
-from typing import List, Dict, Tuple, Optional
+import os
+from typing import AsyncGenerator, List, Dict, Tuple, Optional
 from ..llm.llm_base import BaseLLM
 from ..schemas import Document
+from .rag_context import pack_context
+
+
+# Постоянная часть инструкций RAG (после системного промпта клиента)
+_RAG_INSTRUCTIONS = """Перед вопросом пользователя может быть приведён контекст из документов.
+На основе контекста ответь на вопрос пользователя."""
 
 
 class Generator:
     """Generator для создания ответов на основе контекста"""
     
-    def __init__(self, llm: BaseLLM, system_prompt: Optional[str] = None):
+    def __init__(
+        self,
+        llm: BaseLLM,
+        system_prompt: Optional[str] = None,
+        context_tokens: Optional[int] = None
+    ):
         """
         Инициализация генератора.
         
         Args:
             llm: Экземпляр LLM
             system_prompt: Системный промпт (опционально)
+            context_tokens: Бюджет токенов контекста из документов
+                (RAG_CONTEXT_TOKENS, 0 - без ограничения)
         """
         self.llm = llm
+        self.context_tokens = context_tokens if context_tokens is not None else int(os.getenv("RAG_CONTEXT_TOKENS", "2000"))
         self.system_prompt = system_prompt or """Ты полезный AI ассистент. 
         Отвечай на русском языке кратко и по существу.
         Используй информацию из контекста для ответа на вопросы.
         Если в контексте нет информации для ответа, скажи об этом честно."""
+        # Системное сообщение не меняется между запросами клиента (с контекстом
+        # и без): провайдер кэширует этот префикс промпта (и историю за ним)
+        self.rag_system_prompt = f"{self.system_prompt}\n\n{_RAG_INSTRUCTIONS}"
     
     def _create_rag_prompt(
         self,
         query: str,
         documents: List[Tuple[Document, float]]
     ) -> str:
-        """Создать промпт для RAG с контекстом"""
+        """
+        Создать сообщение пользователя для RAG: контекст и вопрос.
+        Инструкции - в rag_system_prompt, чтобы переменная часть шла в конце.
+        """
         
         if not documents:
             return query
         
+        # Соседние чанки склеиваются без перекрытий, контекст - в пределах бюджета
+        blocks = pack_context(documents, self.context_tokens)
+        print(
+            f"📦 Generator: контекст {len(documents)} чанков -> {len(blocks)} фрагментов, "
+            f"{sum(block.tokens for block in blocks)} токенов"
+        )
+        
         context_parts = []
-        for i, (doc, score) in enumerate(documents, 1):
-            context_parts.append(f"[Источник {i}]\n{doc.content}\n")
+        for i, block in enumerate(blocks, 1):
+            context_parts.append(f"[Источник {i}]\n{block.text}\n")
         
         context = "\n".join(context_parts)
         
-        prompt = f"""На основе следующего контекста ответь на вопрос пользователя.
-
-Контекст:
+        prompt = f"""Контекст:
 {context}
 
 Вопрос: {query}
 
-Инструкции:
-{self.system_prompt}
-
 Ответ:"""
         
         return prompt
@@ -71,10 +94,27 @@ class Generator:
         response = await self.llm.generate(
             prompt=prompt,
             context=chat_history,
-            max_tokens=1000
+            max_tokens=1000,
+            system_prompt=self.rag_system_prompt
         )
         return response
     
+    async def generate_stream(
+        self,
+        query: str,
+        documents: List[Tuple[Document, float]],
+        chat_history: List[Dict[str, str]] = None
+    ) -> AsyncGenerator[str, None]:
+        """Сгенерировать ответ на основе документов с потоковой передачей"""
+        prompt = self._create_rag_prompt(query, documents)
+        async for token in self.llm.generate_stream(
+            prompt=prompt,
+            context=chat_history,
+            max_tokens=1000,
+            system_prompt=self.rag_system_prompt
+        ):
+            yield token
+    
     async def generate_without_context(
         self,
         query: str,
@@ -86,7 +126,22 @@ class Generator:
         response = await self.llm.generate(
             prompt=query,
             context=chat_history,
-            max_tokens=100  # Уменьшено для быстрой генерации
+            max_tokens=100,  # Уменьшено для быстрой генерации
+            system_prompt=self.rag_system_prompt
         )
         print(f"✅ Generator: ответ получен ({len(response)} символов)")
-        return response
\ No newline at end of file
+        return response
+    
+    async def generate_without_context_stream(
+        self,
+        query: str,
+        chat_history: List[Dict[str, str]] = None
+    ) -> AsyncGenerator[str, None]:
+        """Сгенерировать ответ без RAG контекста с потоковой передачей"""
+        async for token in self.llm.generate_stream(
+            prompt=query,
+            context=chat_history,
+            max_tokens=100,
+            system_prompt=self.rag_system_prompt
+        ):
+            yield token
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+Сжатие истории длинных диалогов.
+
+Последние keep_turns обменов (вопрос + ответ) передаются в LLM дословно,
+более старые сворачиваются в краткое содержание, которое хранится вместе
+с диалогом и передаётся первым сообщением истории. Содержание обновляется
+в фоне после отправки ответа, поэтому не добавляет задержки запросу.
+
+Диалог - обычный словарь {'summary': str, 'messages': [...]}, чтобы его
+можно было хранить в context.user_data Telegram или в БД. RAGPipeline
+добавляет в него 'retrieved' - чанки контекста последнего ответа, которые
+используются повторно для уточняющих вопросов (is_follow_up).
+"""
+import os
+import re
+import asyncio
+from typing import Dict, List, Optional, Set
+
+from ..llm.llm_base import BaseLLM
+
+
+# Сколько символов одного сообщения попадает в промпт сжатия
+_MESSAGE_CHARS = 1000
+# Предел дословных сообщений в истории для LLM, пока сжатие не догнало
+_MAX_CONTEXT_MESSAGES = 10
+# Предел хранимых сообщений, если сжатие раз за разом не удаётся
+_MAX_STORED_MESSAGES = 50
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Слова, отсылающие к предыдущей реплике
+_REFERRING_WORDS = {
+    "это", "этот", "эта", "эти", "этого", "этой", "этом", "этим", "этих", "эту",
+    "он", "она", "оно", "они", "его", "её", "ее", "их", "ему", "ей", "им",
+    "него", "неё", "нее", "них", "нему", "ней", "ним",
+    "там", "тут", "здесь", "туда", "тоже", "также", "ещё", "еще",
+    "подробнее", "поподробнее", "такой", "такая", "такое", "такие",
+    "it", "its", "this", "that", "these", "those", "them", "there", "more"
+}
+# Союзы в начале уточняющего вопроса ("а сколько...", "и как...")
+_LEADING_WORDS = {"а", "и", "но", "and", "but", "also"}
+
+
+def is_follow_up(question: str, max_words: Optional[int] = None) -> bool:
+    """
+    Короткий вопрос, отсылающий к предыдущему ответу ("а сколько это стоит?").
+    Проверка локальная, без эмбеддинга.
+
+    Args:
+        question: Вопрос пользователя
+        max_words: Максимум слов уточняющего вопроса (FOLLOWUP_MAX_WORDS)
+    """
+    if max_words is None:
+        max_words = int(os.getenv("FOLLOWUP_MAX_WORDS", "8"))
+    words = _WORD_RE.findall(question.lower())
+    if not words or len(words) > max_words:
+        return False
+    return words[0] in _LEADING_WORDS or any(word in _REFERRING_WORDS for word in words)
+
+
+class HistoryManager:
+    """Скользящее окно сообщений + фоновое краткое содержание"""
+
+    def __init__(
+        self,
+        llm: BaseLLM,
+        keep_turns: Optional[int] = None,
+        summary_tokens: Optional[int] = None
+    ):
+        """
+        Args:
+            llm: LLM для составления краткого содержания
+            keep_turns: Сколько последних обменов передаётся дословно (HISTORY_KEEP_TURNS)
+            summary_tokens: Лимит токенов краткого содержания (HISTORY_SUMMARY_TOKENS)
+        """
+        self.llm = llm
+        self.keep_turns = keep_turns if keep_turns is not None else int(os.getenv("HISTORY_KEEP_TURNS", "3"))
+        self.summary_tokens = summary_tokens if summary_tokens is not None else int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+
+        # Диалоги, которые сейчас сжимаются (по id объекта)
+        self._compacting: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.compactions = 0
+        self.compaction_errors = 0
+        self.folded_messages = 0
+
+    @staticmethod
+    def new_conversation(messages: Optional[List[Dict[str, str]]] = None) -> dict:
+        """Новый диалог (или из старой истории - списка сообщений)"""
+        return {'summary': "", 'messages': list(messages or [])}
+
+    @property
+    def keep_messages(self) -> int:
+        return self.keep_turns * 2
+
+    def build_context(self, conversation: dict) -> List[Dict[str, str]]:
+        """
+        История для LLM: краткое содержание и последние сообщения.
+        Сообщения, которые ещё сворачиваются в фоне, передаются дословно.
+        """
+        context = []
+        if conversation.get('summary'):
+            context.append({
+                "role": "system",
+                "content": f"Краткое содержание предыдущей части диалога:\n{conversation['summary']}"
+            })
+        context.extend(conversation['messages'][-max(_MAX_CONTEXT_MESSAGES, self.keep_messages):])
+        return context
+
+    def record(self, conversation: dict, question: str, answer: str):
+        """
+        Добавить обмен в диалог и, если окно переполнено, запустить
+        сжатие старых сообщений в фоне (вызывать после отправки ответа)
+        """
+        conversation['messages'].append({"role": "user", "content": question})
+        conversation['messages'].append({"role": "assistant", "content": answer})
+        if len(conversation['messages']) > _MAX_STORED_MESSAGES and id(conversation) not in self._compacting:
+            del conversation['messages'][:-_MAX_STORED_MESSAGES]
+
+        if len(conversation['messages']) > self.keep_messages and id(conversation) not in self._compacting:
+            self._compacting.add(id(conversation))
+            task = asyncio.create_task(self._compact_task(conversation))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _compact_task(self, conversation: dict):
+        try:
+            await self.compact(conversation)
+        except Exception as e:
+            self.compaction_errors += 1
+            print(f"⚠️  Ошибка сжатия истории диалога: {e}")
+        finally:
+            self._compacting.discard(id(conversation))
+
+    def _summary_prompt(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        lines = []
+        for message in messages:
+            role = "Пользователь" if message.get("role") == "user" else "Ассистент"
+            content = message.get("content", "")
+            if len(content) > _MESSAGE_CHARS:
+                content = content[:_MESSAGE_CHARS] + "…"
+            lines.append(f"{role}: {content}")
+
+        return f"""Обнови краткое содержание диалога пользователя с ассистентом.
+
+Текущее краткое содержание:
+{summary or "(пусто)"}
+
+Новые сообщения:
+{chr(10).join(lines)}
+
+Сохрани факты о пользователе, его вопросы, полученные ответы и договорённости.
+Пиши кратко, без вступлений, не длиннее {self.summary_tokens} токенов.
+
+Краткое содержание:"""
+
+    async def compact(self, conversation: dict) -> bool:
+        """
+        Свернуть сообщения старше окна в краткое содержание
+
+        Returns:
+            True, если краткое содержание обновлено
+        """
+        folded = len(conversation['messages']) - self.keep_messages
+        if folded <= 0:
+            return False
+
+        messages = conversation['messages'][:folded]
+        summary = await self.llm.generate(
+            prompt=self._summary_prompt(conversation.get('summary', ""), messages),
+            max_tokens=self.summary_tokens
+        )
+        summary = (summary or "").strip()
+        # Реализации LLM возвращают текст ошибки вместо исключения
+        if not summary or summary.startswith("Ошибка"):
+            raise RuntimeError(summary or "пустое краткое содержание")
+
+        # За время сжатия в конец могли добавиться новые сообщения
+        conversation['summary'] = summary
+        del conversation['messages'][:folded]
+        self.compactions += 1
+        self.folded_messages += folded
+        return True
+
+    def get_stats(self) -> dict:
+        """Метрики сжатия истории"""
+        return {
+            'keep_turns': self.keep_turns,
+            'compactions': self.compactions,
+            'compaction_errors': self.compaction_errors,
+            'folded_messages': self.folded_messages,
+            'in_progress': len(self._compacting)
+        }
@@ -1,50 +1,405 @@
 import os
-from typing import List
+import re
+import asyncio
+import inspect
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from pathlib import Path
 from ..schemas import Document
 from ..vectorstore.vectorstore_base import BaseVectorStore
+from .rag_tokens import count_tokens, split_by_tokens
+from .rag_manifest import IngestManifest
+from .rag_dedup import NearDuplicateIndex, simhash
+from .rag_extractors import BINARY_EXTENSIONS, ExtractorPool, iter_document_blocks
+
+
+# Граница предложения: знак конца предложения с пробелами или перевод строки
+_SENTENCE_END_RE = re.compile(r"[.!?…]+[\s]+|\n+")
 
 
 class DocumentIngestor:
     """Класс для загрузки и обработки документов"""
     
-    def __init__(self, vectorstore: BaseVectorStore):
+    def __init__(
+        self,
+        vectorstore: BaseVectorStore,
+        chunk_tokens: int = 256,
+        overlap_tokens: int = 32,
+        batch_size: int = 64,
+        max_in_flight_batches: int = 4,
+        read_block_size: int = 1 << 16,
+        dedup: bool = True,
+        dedup_max_distance: int = 0
+    ):
+        """
+        Args:
+            vectorstore: Векторное хранилище
+            chunk_tokens: Бюджет токенов на чанк
+            overlap_tokens: Перекрытие между чанками в токенах
+            batch_size: Сколько чанков передавать в хранилище за раз
+            max_in_flight_batches: Сколько батчей одного файла эмбеддятся параллельно
+            read_block_size: Размер блока чтения файла в символах
+            dedup: Не эмбеддить дублирующиеся чанки (SimHash + LSH),
+                а ссылаться на уже проиндексированный чанк
+            dedup_max_distance: Порог расстояния Хэмминга между отпечатками
+                (0 - только точные копии; больше 0 - почти дубликаты, которые
+                могут отличаться, например, ценой или датой)
+        """
         self.vectorstore = vectorstore
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.batch_size = batch_size
+        self.max_in_flight_batches = max_in_flight_batches
+        self.read_block_size = read_block_size
+        self.dedup = dedup
+        self.dedup_max_distance = dedup_max_distance
+        self._dedup_index: Optional[NearDuplicateIndex] = None
+        # Файл дубликата -> файлы, в которых лежат исходные чанки
+        self.duplicate_links: Dict[str, Set[str]] = {}
+        self.dedup_stats = {'chunks_checked': 0, 'duplicate_chunks': 0, 'tokens_saved': 0}
+        # Пул разбора PDF/DOCX: создаётся при первом таком файле и
+        # используется для всех следующих до close()
+        self._extractor_pool: Optional[ExtractorPool] = None
+    
+    def _get_extractor_pool(self) -> ExtractorPool:
+        """Общий пул разбора бинарных файлов этого ингестора"""
+        if self._extractor_pool is None:
+            self._extractor_pool = ExtractorPool(workers=1)
+        return self._extractor_pool
+    
+    def close(self):
+        """Остановить пул разбора файлов (после загрузки последнего файла)"""
+        if self._extractor_pool is not None:
+            self._extractor_pool.shutdown()
+            self._extractor_pool = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def _iter_segments(self, blocks: Iterable[str]) -> Iterator[str]:
+        """
+        Разбить поток блоков на предложения (с разделителями).
+        Незаконченное предложение переносится в следующий блок.
+        """
+        # Строка без разделителей не должна расти бесконечно
+        max_carry = self.chunk_tokens * 16
+        carry = ""
+        
+        for block in blocks:
+            carry += block
+            start = 0
+            for match in _SENTENCE_END_RE.finditer(carry):
+                yield carry[start:match.end()]
+                start = match.end()
+            carry = carry[start:]
+            
+            if len(carry) > max_carry:
+                yield carry
+                carry = ""
+        
+        if carry:
+            yield carry
     
-    def _chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
+    def _iter_chunks(self, blocks: Iterable[str]) -> Iterator[Tuple[str, int]]:
+        """
+        Разбить поток текстовых блоков на чанки по бюджету токенов.
+        Чанки собираются из целых предложений; предложения длиннее
+        бюджета режутся по токенам. В памяти держится только текущий
+        чанк, поэтому размер исходного файла не влияет на потребление памяти.
+        
+        Args:
+            blocks: Текст, поступающий блоками
+        
+        Yields:
+            Кортежи (текст чанка, количество токенов)
+        """
+        current: List[Tuple[str, int]] = []
+        current_tokens = 0
+        
+        def emit() -> Optional[Tuple[str, int]]:
+            text = "".join(segment for segment, _ in current).strip()
+            if not text:
+                return None
+            return text, count_tokens(text)
+        
+        for segment in self._iter_segments(blocks):
+            tokens = count_tokens(segment)
+            
+            if tokens > self.chunk_tokens:
+                # Длинный фрагмент без границ предложений
+                chunk = emit()
+                if chunk:
+                    yield chunk
+                current, current_tokens = [], 0
+                for piece in split_by_tokens(segment, self.chunk_tokens):
+                    piece = piece.strip()
+                    if piece:
+                        yield piece, count_tokens(piece)
+                continue
+            
+            if current and current_tokens + tokens > self.chunk_tokens:
+                chunk = emit()
+                if chunk:
+                    yield chunk
+                
+                # Перекрытие: последние предложения в пределах overlap_tokens
+                overlap: List[Tuple[str, int]] = []
+                overlap_size = 0
+                for item in reversed(current):
+                    if overlap_size + item[1] > self.overlap_tokens:
+                        break
+                    overlap.insert(0, item)
+                    overlap_size += item[1]
+                
+                # Перекрытие не должно вытеснять новое предложение из бюджета
+                while overlap and overlap_size + tokens > self.chunk_tokens:
+                    overlap_size -= overlap.pop(0)[1]
+                
+                current, current_tokens = overlap, overlap_size
+            
+            current.append((segment, tokens))
+            current_tokens += tokens
+        
+        chunk = emit()
+        if chunk:
+            yield chunk
+    
+    def _chunk_text(self, text: str) -> List[str]:
         """
         Разбить текст на чанки
         
         Args:
             text: Исходный текст
-            chunk_size: Размер чанка в символах
-            overlap: Перекрытие между чанками
         
         Returns:
             Список текстовых чанков
         """
-        chunks = []
-        start = 0
-        text_len = len(text)
+        return [chunk for chunk, _ in self._iter_chunks([text])]
+    
+    def _iter_file_blocks(self, file_path: str) -> Iterator[str]:
+        """Читать текст файла блоками (PDF - по страницам, DOCX - по абзацам)"""
+        return iter_document_blocks(file_path, self.read_block_size)
+    
+    def _get_dedup_index(self) -> NearDuplicateIndex:
+        """Индекс отпечатков, построенный по чанкам хранилища"""
+        if self._dedup_index is None:
+            self._dedup_index = NearDuplicateIndex(self.dedup_max_distance)
+            for document in getattr(self.vectorstore, 'documents', {}).values():
+                fingerprint = document.metadata.get('simhash')
+                if fingerprint is not None:
+                    self._dedup_index.add(fingerprint, document)
+        return self._dedup_index
+    
+    def _find_duplicate(self, document: Document) -> Optional[Document]:
+        """
+        Проверить чанк на почти дубликат.
+        Новый чанк добавляется в индекс; у найденного исходного чанка
+        в metadata['duplicates'] записывается ссылка на дубликат. Для чанков
+        загруженных документов (без file_path) ссылка хранит сам чанк и
+        document_id: переиндексировать их из файла нельзя, и при удалении
+        исходного чанка они записываются заново (см. sync_directory).
         
-        while start < text_len:
-            end = start + chunk_size
-            chunk = text[start:end]
-            
-            # Пытаемся разбить по предложениям
-            if end < text_len:
-                last_period = chunk.rfind('.')
-                last_newline = chunk.rfind('\n')
-                split_point = max(last_period, last_newline)
+        Returns:
+            Исходный чанк или None
+        """
+        if not self.dedup:
+            return None
+        
+        fingerprint = document.metadata.get('simhash')
+        if fingerprint is None:
+            fingerprint = document.metadata['simhash'] = simhash(document.content)
+        
+        index = self._get_dedup_index()
+        self.dedup_stats['chunks_checked'] += 1
+        original = index.find(fingerprint, document.content)
+        if original is None:
+            index.add(fingerprint, document)
+            return None
+        
+        self.dedup_stats['duplicate_chunks'] += 1
+        self.dedup_stats['tokens_saved'] += document.metadata.get('token_count') or count_tokens(document.content)
+        link = {key: document.metadata.get(key) for key in ('source', 'file_path', 'chunk_id')}
+        file_path = document.metadata.get('file_path')
+        if file_path:
+            self.duplicate_links.setdefault(file_path, set()).add(original.metadata.get('file_path'))
+        else:
+            link['document_id'] = document.metadata.get('document_id') or document.metadata.get('source')
+            link['content'] = document.content
+            link['metadata'] = document.metadata
+        original.metadata.setdefault('duplicates', []).append(link)
+        return original
+    
+    def _report_dedup(self):
+        """Вывести экономию от пропуска дубликатов"""
+        if self.dedup_stats['duplicate_chunks']:
+            print(
+                f"♻️  Пропущено почти дублирующихся чанков: {self.dedup_stats['duplicate_chunks']} "
+                f"из {self.dedup_stats['chunks_checked']} "
+                f"(сэкономлено ~{self.dedup_stats['tokens_saved']} токенов эмбеддингов)"
+            )
+    
+    async def ingest_chunks(self, chunks: Iterable[Tuple[str, int]], metadata: dict = None) -> int:
+        """
+        Загрузить поток чанков в векторное хранилище
+        
+        Args:
+            chunks: Кортежи (текст чанка, количество токенов)
+            metadata: Метаданные документа
+        
+        Returns:
+            Количество созданных чанков
+        """
+        return len(await self.ingest_chunks_ids(chunks, metadata))
+    
+    async def _add_chunk_documents(
+        self,
+        documents: Iterable[Document],
+        on_progress: Optional[Callable[[int], object]] = None
+    ) -> List[Tuple[Document, int]]:
+        """
+        Записать поток чанков в хранилище.
+        Чанки отправляются батчами сразу по мере поступления; одновременно
+        в работе не больше max_in_flight_batches батчей. Почти дубликаты
+        уже проиндексированных чанков пропускаются.
+        
+        Args:
+            documents: Чанки в виде документов
+            on_progress: Вызывается с числом обработанных чанков
+                (записанных и пропущенных как дубликаты) после каждого батча
+        
+        Returns:
+            Пары (чанк, id в хранилище) для записанных чанков
+        """
+        batch: List[Document] = []
+        stored: List[Tuple[Document, int]] = []
+        in_flight: Dict[asyncio.Task, List[Document]] = {}
+        skipped = 0
+        
+        async def report():
+            if on_progress is not None:
+                result = on_progress(len(stored) + skipped)
+                if inspect.isawaitable(result):
+                    await result
+        
+        def collect(task: asyncio.Task):
+            stored.extend(zip(in_flight.pop(task), task.result()))
+        
+        async def flush():
+            nonlocal batch
+            if not batch:
+                return
+            in_flight[asyncio.create_task(self.vectorstore.add_documents(batch))] = batch
+            batch = []
+            if len(in_flight) >= self.max_in_flight_batches:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    collect(task)
+                await report()
+        
+        try:
+            for document in documents:
+                if self._find_duplicate(document) is not None:
+                    skipped += 1
+                    continue
+                batch.append(document)
                 
-                if split_point > chunk_size // 2:
-                    chunk = chunk[:split_point + 1]
-                    end = start + split_point + 1
+                if len(batch) >= self.batch_size:
+                    await flush()
             
-            chunks.append(chunk.strip())
-            start = end - overlap
+            await flush()
+            if in_flight:
+                await asyncio.wait(in_flight)
+                for task in list(in_flight):
+                    collect(task)
+            await report()
+        except BaseException:
+            for task in in_flight:
+                task.cancel()
+            raise
+        
+        return stored
+    
+    async def ingest_chunks_ids(
+        self,
+        chunks: Iterable[Tuple[str, int]],
+        metadata: dict = None,
+        on_progress: Optional[Callable[[int], object]] = None
+    ) -> List[int]:
+        """
+        Загрузить поток чанков в векторное хранилище
+        (батчами по мере нарезки, см. _add_chunk_documents)
+        
+        Args:
+            chunks: Кортежи (текст чанка, количество токенов)
+            metadata: Метаданные документа
+            on_progress: Вызывается с числом обработанных чанков после каждого батча
+        
+        Returns:
+            id созданных (не пропущенных как дубликаты) чанков в хранилище
+        """
+        chunk_metadata: List[dict] = []
+        
+        def documents() -> Iterator[Document]:
+            for i, (chunk, token_count) in enumerate(chunks):
+                doc_metadata = metadata.copy() if metadata else {}
+                doc_metadata['chunk_id'] = i
+                # Токены считаются один раз при индексации
+                doc_metadata['token_count'] = token_count
+                
+                document = Document(
+                    content=chunk,
+                    metadata=doc_metadata
+                )
+                # Ссылка на метаданные самого документа (pydantic копирует dict)
+                chunk_metadata.append(document.metadata)
+                yield document
+        
+        stored = await self._add_chunk_documents(documents(), on_progress)
+        
+        # Общее число чанков известно только после нарезки всего потока
+        for doc_metadata in chunk_metadata:
+            doc_metadata['total_chunks'] = len(chunk_metadata)
+        
+        return [doc_id for _, doc_id in stored]
+    
+    async def ingest_documents(self, documents: Iterable[Document]) -> List[int]:
+        """
+        Загрузить несколько документов; чанки разных документов
+        эмбеддятся общими батчами
         
-        return chunks
+        Args:
+            documents: Документы (текст с метаданными)
+        
+        Returns:
+            Количество созданных чанков для каждого документа
+        """
+        counts: List[int] = []
+        # id() чанка -> номер документа (записанные чанки живут в хранилище,
+        # поэтому их id() не переиспользуются)
+        owners: Dict[int, int] = {}
+        
+        def chunk_documents() -> Iterator[Document]:
+            for index, source in enumerate(documents):
+                counts.append(0)
+                chunks = list(self._iter_chunks([source.content]))
+                for i, (chunk, token_count) in enumerate(chunks):
+                    document = Document(
+                        content=chunk,
+                        metadata={
+                            **source.metadata,
+                            'chunk_id': i,
+                            'total_chunks': len(chunks),
+                            'token_count': token_count
+                        }
+                    )
+                    owners[id(document)] = index
+                    yield document
+        
+        for document, _ in await self._add_chunk_documents(chunk_documents()):
+            counts[owners[id(document)]] += 1
+        return counts
     
     async def ingest_text(self, text: str, metadata: dict = None) -> int:
         """
@@ -57,21 +412,34 @@ class DocumentIngestor:
         Returns:
             Количество созданных чанков
         """
-        chunks = self._chunk_text(text)
-        documents = []
+        return await self.ingest_chunks(self._iter_chunks([text]), metadata)
+    
+    async def ingest_document(
+        self,
+        document: Document,
+        on_progress: Optional[Callable[[int, int], object]] = None
+    ) -> int:
+        """
+        Загрузить документ (текст с метаданными) в векторное хранилище
         
-        for i, chunk in enumerate(chunks):
-            doc_metadata = metadata.copy() if metadata else {}
-            doc_metadata['chunk_id'] = i
-            doc_metadata['total_chunks'] = len(chunks)
-            
-            documents.append(Document(
-                content=chunk,
-                metadata=doc_metadata
-            ))
+        Args:
+            document: Документ
+            on_progress: Вызывается с (обработано чанков, всего чанков)
         
-        await self.vectorstore.add_documents(documents)
-        return len(documents)
+        Returns:
+            Количество созданных чанков
+        """
+        chunks = list(self._iter_chunks([document.content]))
+        
+        progress = None
+        if on_progress is not None:
+            result = on_progress(0, len(chunks))
+            if inspect.isawaitable(result):
+                await result
+            progress = lambda done: on_progress(done, len(chunks))
+        
+        ids = await self.ingest_chunks_ids(chunks, document.metadata, on_progress=progress)
+        return len(ids)
     
     async def ingest_file(self, file_path: str) -> int:
         """
@@ -83,45 +451,339 @@ class DocumentIngestor:
         Returns:
             Количество созданных чанков
         """
+        return len(await self.ingest_file_ids(file_path))
+    
+    async def ingest_file_ids(self, file_path: str, metadata: dict = None) -> List[int]:
+        """
+        Загрузить файл в векторное хранилище
+        
+        Args:
+            file_path: Путь к файлу
+            metadata: Метаданные чанков (по умолчанию - имя и путь файла;
+                file_path связывает чанки с файлом при синхронизации директории)
+        
+        Returns:
+            id созданных чанков в хранилище
+        
+        PDF/DOCX разбираются в общем пуле ингестора: после загрузки файлов
+        его останавливает close() (или with DocumentIngestor(...)).
+        """
         path = Path(file_path)
         
         if not path.exists():
             raise FileNotFoundError(f"Файл не найден: {file_path}")
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
+        if metadata is None:
+            metadata = {
+                'source': str(path.name),
+                'file_path': str(path)
+            }
         
-        metadata = {
-            'source': str(path.name),
-            'file_path': str(path)
-        }
-        
-        return await self.ingest_text(text, metadata)
+        if path.suffix.lower() in BINARY_EXTENSIONS:
+            # PDF/DOCX разбираются в отдельном процессе с таймаутом и лимитом памяти
+            from .rag_ingest_pipeline import chunk_file_worker
+            
+            # Пул общий для всех файлов ингестора (процесс не создаётся на каждый файл)
+            chunk_rows = await self._get_extractor_pool().run(
+                chunk_file_worker,
+                str(path),
+                self.chunk_tokens,
+                self.overlap_tokens,
+                False
+            )
+            chunks = ((chunk, token_count) for chunk, token_count, _ in chunk_rows)
+        else:
+            # Текстовый файл читается блоками и нарезается потоково
+            chunks = self._iter_chunks(self._iter_file_blocks(file_path))
+        return await self.ingest_chunks_ids(chunks, metadata)
     
-    async def ingest_directory(self, directory_path: str, extensions: List[str] = None) -> int:
+    async def ingest_directory(
+        self,
+        directory_path: str,
+        extensions: List[str] = None,
+        workers: Optional[int] = None
+    ) -> int:
         """
-        Загрузить все файлы из директории
+        Загрузить все файлы из директории.
+        Файлы читаются и нарезаются параллельно в пуле процессов,
+        эмбеддинги и запись в индекс идут конвейером (см. IngestPipeline).
         
         Args:
             directory_path: Путь к директории
             extensions: Список расширений файлов (например, ['.txt', '.md'])
+            workers: Число процессов нарезки (по умолчанию INGEST_WORKERS или число ядер)
         
         Returns:
             Общее количество созданных чанков
         """
+        from .rag_ingest_pipeline import IngestPipeline
+        
         if extensions is None:
             extensions = ['.txt', '.md']
         
         path = Path(directory_path)
-        total_chunks = 0
-        
-        for file_path in path.rglob('*'):
-            if file_path.is_file() and file_path.suffix in extensions:
-                try:
-                    chunks = await self.ingest_file(str(file_path))
-                    total_chunks += chunks
-                    print(f"✓ Загружен: {file_path.name} ({chunks} чанков)")
-                except Exception as e:
-                    print(f"✗ Ошибка при загрузке {file_path.name}: {e}")
+        files = [
+            file_path for file_path in path.rglob('*')
+            if file_path.is_file() and file_path.suffix in extensions
+        ]
         
+        pipeline = IngestPipeline(self, workers=workers)
+        total_chunks = await pipeline.run(files)
+        self._report_dedup()
         return total_chunks
+
+    def _list_files(self, directory_path: str, extensions: List[str]) -> Dict[str, Path]:
+        """Файлы директории: путь относительно директории -> путь"""
+        root = Path(directory_path)
+        if not root.exists():
+            return {}
+        return {
+            file_path.relative_to(root).as_posix(): file_path
+            for file_path in sorted(root.rglob('*'))
+            if file_path.is_file() and file_path.suffix in extensions
+        }
+
+    def _bootstrap_manifest(self, manifest: IngestManifest, current: Dict[str, Path]):
+        """
+        Заполнить манифест по уже существующему хранилищу (первая
+        синхронизация после обновления). Файлы, чьих чанков нет в хранилище,
+        останутся добавленными, а чанки исчезнувших файлов - удалёнными.
+        """
+        stored = self.vectorstore.ids_by_file()
+        by_path = {str(file_path): rel_path for rel_path, file_path in current.items()}
+
+        for file_path, ids in stored.items():
+            rel_path = by_path.get(file_path)
+            if rel_path is not None:
+                current_path = current[rel_path]
+                manifest.set_entry(
+                    rel_path,
+                    current_path,
+                    IngestManifest.file_hash(str(current_path)),
+                    ids
+                )
+            else:
+                # Файла больше нет: запись без stat, чтобы diff отметил удаление
+                manifest.files[file_path] = {
+                    'size': -1,
+                    'mtime': 0,
+                    'sha256': '',
+                    'ids': IngestManifest.ids_to_ranges(ids)
+                }
+
+        if stored:
+            print(f"📋 Манифест восстановлен по хранилищу ({len(manifest.files)} файлов)")
+
+    def _dependent_files(
+        self,
+        manifest: IngestManifest,
+        current: Dict[str, Path],
+        changed: List[str],
+        added: List[str]
+    ) -> List[str]:
+        """
+        Файлы, чьи пропущенные чанки-дубликаты ссылаются на чанки
+        изменённых или удалённых файлов: без переиндексации их текст
+        пропал бы из хранилища вместе с исходными чанками.
+        """
+        documents = getattr(self.vectorstore, 'documents', {})
+        by_path = {str(file_path): rel_path for rel_path, file_path in current.items()}
+        seen = set(changed) | set(added)
+        pending = list(changed)
+        dependents = []
+        
+        while pending:
+            rel_path = pending.pop()
+            for doc_id in manifest.get_ids(rel_path):
+                document = documents.get(doc_id)
+                if document is None:
+                    continue
+                for link in document.metadata.get('duplicates', ()):
+                    dependent = by_path.get(link.get('file_path'))
+                    if dependent is not None and dependent not in seen:
+                        seen.add(dependent)
+                        dependents.append(dependent)
+                        pending.append(dependent)
+        
+        return dependents
+
+    def _upload_duplicates(self, ids: Iterable[int]) -> List[Document]:
+        """
+        Чанки загруженных документов, пропущенные как дубликаты указанных
+        чанков: при удалении исходных чанков их нужно записать заново
+        """
+        documents = getattr(self.vectorstore, 'documents', {})
+        orphans = []
+        for doc_id in ids:
+            document = documents.get(doc_id)
+            if document is None:
+                continue
+            for link in document.metadata.get('duplicates', ()):
+                if 'content' in link:
+                    orphans.append(Document(content=link['content'], metadata=link['metadata']))
+        return orphans
+
+    def _unlink_duplicates(self, file_paths: Set[str] = frozenset(), document_ids: Set[str] = frozenset()):
+        """Убрать ссылки на дубликаты из указанных файлов и загруженных документов"""
+        for document in getattr(self.vectorstore, 'documents', {}).values():
+            links = document.metadata.get('duplicates')
+            if not links:
+                continue
+            links = [
+                link for link in links
+                if link.get('file_path') not in file_paths
+                and ('content' not in link or link.get('document_id') not in document_ids)
+            ]
+            if links:
+                document.metadata['duplicates'] = links
+            else:
+                del document.metadata['duplicates']
+
+    async def remove_document(self, document_id: str) -> int:
+        """
+        Удалить чанки загруженного документа и ссылки на его дубликаты
+        (откат частично выполненной попытки индексации перед повтором).
+        Дубликаты других документов, ссылавшиеся на удалённые чанки,
+        записываются заново.
+        
+        Returns:
+            Количество удалённых чанков
+        """
+        documents = getattr(self.vectorstore, 'documents', {})
+        ids = [
+            doc_id for doc_id, document in documents.items()
+            if document.metadata.get('document_id') == document_id
+        ]
+        orphans = [
+            orphan for orphan in self._upload_duplicates(ids)
+            if orphan.metadata.get('document_id') != document_id
+        ]
+        deleted = self.vectorstore.delete(ids)
+        self._unlink_duplicates(document_ids={document_id})
+        self._dedup_index = None
+        if orphans:
+            await self._add_chunk_documents(orphans)
+        return deleted
+
+    async def sync_directory(
+        self,
+        directory_path: str,
+        manifest: IngestManifest,
+        extensions: List[str] = None,
+        workers: Optional[int] = None,
+        on_progress: Optional[Callable[[int, int], object]] = None
+    ) -> dict:
+        """
+        Инкрементально синхронизировать хранилище с директорией.
+        Индексируются только новые и изменённые файлы, чанки изменённых
+        и удалённых файлов удаляются из индекса. Манифест обновляется
+        в памяти - сохранять его нужно после сохранения хранилища.
+        
+        Args:
+            directory_path: Путь к директории
+            manifest: Манифест проиндексированных файлов
+            extensions: Список расширений файлов
+            workers: Число процессов нарезки
+            on_progress: Вызывается с (файлов в индексе, всего файлов):
+                сразу после сравнения с манифестом и по мере индексации
+        
+        Returns:
+            Статистика синхронизации
+        """
+        from .rag_ingest_pipeline import IngestPipeline
+        
+        if extensions is None:
+            extensions = ['.txt', '.md']
+        
+        current = self._list_files(directory_path, extensions)
+        
+        if not manifest.exists() and not manifest.files:
+            self._bootstrap_manifest(manifest, current)
+        
+        added, modified, removed, hashes = manifest.diff(current)
+        
+        if self.dedup:
+            modified += self._dependent_files(manifest, current, removed + modified, added)
+        
+        # Старые чанки изменённых и удалённых файлов
+        chunks_deleted = 0
+        # Дубликаты из загруженных документов, чьи исходные чанки удаляются
+        orphans: List[Document] = []
+        for rel_path in removed + modified:
+            orphans += self._upload_duplicates(manifest.get_ids(rel_path))
+            chunks_deleted += self.vectorstore.delete(manifest.get_ids(rel_path))
+            manifest.files.pop(rel_path, None)
+        
+        if removed or modified:
+            root = Path(directory_path)
+            self._unlink_duplicates({str(root / rel_path) for rel_path in removed + modified})
+        # Индекс отпечатков строится заново по оставшимся чанкам
+        self._dedup_index = None
+        
+        chunks_added = 0
+        failed = []
+        to_index = added + modified
+        unchanged = len(current) - len(to_index)
+        
+        async def report(done: int, _total: int = 0):
+            if on_progress is not None:
+                result = on_progress(unchanged + done, len(current))
+                if inspect.isawaitable(result):
+                    await result
+        
+        await report(0)
+        if to_index:
+            pipeline = IngestPipeline(self, workers=workers)
+            chunks_added = await pipeline.run([current[rel_path] for rel_path in to_index], report)
+            
+            # Дубликаты чанков неудавшихся файлов откатываются вместе с ними
+            failed_paths = set(pipeline.failed_files)
+            propagated = True
+            while propagated:
+                propagated = False
+                for rel_path in to_index:
+                    file_path = str(current[rel_path])
+                    if file_path not in failed_paths and self.duplicate_links.get(file_path, set()) & failed_paths:
+                        failed_paths.add(file_path)
+                        propagated = True
+            
+            for rel_path in to_index:
+                file_path = current[rel_path]
+                ids = pipeline.file_ids.get(str(file_path), [])
+                if str(file_path) in failed_paths:
+                    # Не оставляем частично проиндексированный файл - повторим в следующий раз
+                    orphans += self._upload_duplicates(ids)
+                    chunks_added -= self.vectorstore.delete(ids)
+                    failed.append(rel_path)
+                    continue
+                sha256 = hashes.get(rel_path) or IngestManifest.file_hash(str(file_path))
+                manifest.set_entry(rel_path, file_path, sha256, ids)
+            
+            if failed_paths:
+                self._unlink_duplicates(failed_paths)
+                self._dedup_index = None
+        
+        if orphans:
+            # Текст загруженных документов не должен пропасть вместе с файлом:
+            # такие чанки записываются заново (или снова ссылаются на копию в новых чанках)
+            restored = await self._add_chunk_documents(orphans)
+            chunks_added += len(restored)
+            print(f"♻️  Восстановлено чанков загруженных документов: {len(orphans)}")
+        
+        stats = {
+            'added': len(added),
+            'modified': len(modified),
+            'removed': len(removed),
+            'unchanged': unchanged,
+            'failed': failed,
+            'chunks_added': chunks_added,
+            'chunks_deleted': chunks_deleted,
+            'duplicate_chunks': self.dedup_stats['duplicate_chunks'],
+            'tokens_saved': self.dedup_stats['tokens_saved']
+        }
+        print(
+            f"🔄 Синхронизация: +{stats['added']} ~{stats['modified']} -{stats['removed']} "
+            f"файлов, чанков +{chunks_added} -{chunks_deleted}"
+        )
+        self._report_dedup()
+        return stats
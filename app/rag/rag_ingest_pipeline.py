@@ -0,0 +1,244 @@
+"""
+Конвейер массовой индексации директории.
+
+Три стадии, связанные ограниченными очередями (backpressure ограничивает память):
+    1. Изолированный пул процессов читает и нарезает файлы параллельно по ядрам
+       CPU (с таймаутом и лимитом памяти на файл, см. ExtractorPool).
+    2. Асинхронная стадия эмбеддингов: число батчей в работе задаёт AIMD
+       лимитер общего планировщика эмбеддингов.
+    3. Единственный писатель добавляет готовые векторы в индекс.
+"""
+import os
+import asyncio
+import inspect
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from ..schemas import Document
+from .rag_ingest import DocumentIngestor
+from .rag_dedup import simhash
+from .rag_extractors import BINARY_EXTENSIONS, ExtractorPool
+
+
+def chunk_file_worker(
+    file_path: str,
+    chunk_tokens: int,
+    overlap_tokens: int,
+    fingerprints: bool = True
+) -> List[Tuple[str, int, Optional[int]]]:
+    """
+    Прочитать и нарезать файл (выполняется в процессе пула)
+
+    Returns:
+        Список кортежей (текст чанка, количество токенов, SimHash или None)
+    """
+    ingestor = DocumentIngestor(None, chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens)
+    return [
+        (chunk, token_count, simhash(chunk) if fingerprints else None)
+        for chunk, token_count in ingestor._iter_chunks(ingestor._iter_file_blocks(file_path))
+    ]
+
+
+class IngestPipeline:
+    """Параллельная индексация файлов: пул процессов -> эмбеддинги -> писатель"""
+
+    # Сигнал завершения для очередей
+    _DONE = None
+
+    def __init__(
+        self,
+        ingestor: DocumentIngestor,
+        workers: Optional[int] = None,
+        max_queued_batches: int = 8,
+        large_file_mb: int = 64
+    ):
+        """
+        Args:
+            ingestor: DocumentIngestor с хранилищем и настройками нарезки
+            workers: Число процессов для чтения и нарезки (по умолчанию - число ядер)
+            max_queued_batches: Ёмкость очередей между стадиями (в батчах)
+            large_file_mb: Текстовые файлы больше этого размера нарезаются потоково
+                в основном процессе, чтобы не передавать их целиком между процессами
+                (PDF/DOCX всегда разбираются в пуле)
+        """
+        self.ingestor = ingestor
+        self.vectorstore = ingestor.vectorstore
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+        self.max_queued_batches = max_queued_batches
+        self.large_file_bytes = large_file_mb * 1024 * 1024
+        # id чанков по путям файлов после run()
+        self.file_ids: Dict[str, List[int]] = {}
+        # Файлы, которые не удалось проиндексировать целиком
+        self.failed_files: Set[str] = set()
+
+    def _build_documents(self, path: Path, chunks: List[Tuple[str, int, Optional[int]]]) -> List[Document]:
+        """Документы с метаданными файла (почти дубликаты отбрасываются)"""
+        documents = []
+        for i, (chunk, token_count, fingerprint) in enumerate(chunks):
+            metadata = {
+                'source': str(path.name),
+                'file_path': str(path),
+                'chunk_id': i,
+                'total_chunks': len(chunks),
+                'token_count': token_count
+            }
+            if fingerprint is not None:
+                metadata['simhash'] = fingerprint
+            document = Document(content=chunk, metadata=metadata)
+            if self.ingestor._find_duplicate(document) is None:
+                documents.append(document)
+        return documents
+
+    async def run(
+        self,
+        files: List[Path],
+        on_progress: Optional[Callable[[int, int], object]] = None
+    ) -> int:
+        """
+        Проиндексировать файлы
+
+        Args:
+            files: Пути к файлам
+            on_progress: Вызывается с (обработано файлов, всего файлов), когда
+                все чанки файла попали в индекс или файл не удалось разобрать
+
+        Returns:
+            Количество чанков, добавленных в индекс
+        """
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queued_batches)
+        write_queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queued_batches)
+        file_slots = asyncio.Semaphore(self.workers)
+        written_chunks = 0
+        # Чанков файла, ещё не записанных в индекс
+        pending_chunks: Dict[str, int] = {}
+        files_done = 0
+
+        async def file_done():
+            nonlocal files_done
+            files_done += 1
+            if on_progress is not None:
+                result = on_progress(files_done, len(files))
+                if inspect.isawaitable(result):
+                    await result
+
+        small_files = []
+        large_files = []
+        for path in files:
+            try:
+                size = path.stat().st_size
+            except OSError as e:
+                print(f"✗ Ошибка при загрузке {path.name}: {e}")
+                await file_done()
+                continue
+            is_large = size > self.large_file_bytes and path.suffix.lower() not in BINARY_EXTENSIONS
+            (large_files if is_large else small_files).append(path)
+
+        async def parse(pool: ExtractorPool, path: Path):
+            # Стадия 1: чтение и нарезка в пуле процессов (с таймаутом и лимитом памяти)
+            async with file_slots:
+                try:
+                    chunks = await pool.run(
+                        chunk_file_worker,
+                        str(path),
+                        self.ingestor.chunk_tokens,
+                        self.ingestor.overlap_tokens,
+                        self.ingestor.dedup
+                    )
+                except Exception as e:
+                    print(f"✗ Ошибка при загрузке {path.name}: {e}")
+                    self.failed_files.add(str(path))
+                    await file_done()
+                    return
+
+                documents = self._build_documents(path, chunks)
+                if documents:
+                    pending_chunks[str(path)] = len(documents)
+                else:
+                    await file_done()
+                for start in range(0, len(documents), self.ingestor.batch_size):
+                    # put блокируется, пока эмбеддинги не догонят нарезку
+                    await embed_queue.put(documents[start:start + self.ingestor.batch_size])
+
+                skipped = len(chunks) - len(documents)
+                print(f"✓ Нарезан: {path.name} ({len(documents)} чанков" + (f", {skipped} дубликатов)" if skipped else ")"))
+
+        async def embed():
+            # Стадия 2: эмбеддинги батчами через общий планировщик
+            scheduler = self.vectorstore.embeddings_service.ingest_scheduler
+            while True:
+                documents = await embed_queue.get()
+                if documents is self._DONE:
+                    return
+
+                async def to_writer(indices: List[int], vectors: np.ndarray):
+                    await write_queue.put(([documents[i] for i in indices], vectors))
+
+                try:
+                    await scheduler.run(
+                        [doc.content for doc in documents],
+                        to_writer,
+                        [doc.metadata.get('token_count') for doc in documents]
+                    )
+                except Exception as e:
+                    # Стадия не должна останавливаться, иначе нарезка заблокируется
+                    print(f"✗ Ошибка эмбеддингов ({documents[0].metadata.get('source')}): {e}")
+                    file_path = documents[0].metadata['file_path']
+                    self.failed_files.add(file_path)
+                    if pending_chunks.pop(file_path, None) is not None:
+                        await file_done()
+
+        async def write():
+            # Стадия 3: единственный писатель в индекс
+            nonlocal written_chunks
+            while True:
+                item = await write_queue.get()
+                if item is self._DONE:
+                    return
+                documents, vectors = item
+                ids = self.vectorstore.add_embeddings(documents, vectors)
+                for doc, doc_id in zip(documents, ids):
+                    file_path = doc.metadata['file_path']
+                    self.file_ids.setdefault(file_path, []).append(doc_id)
+                    if file_path in pending_chunks:
+                        pending_chunks[file_path] -= 1
+                        if pending_chunks[file_path] == 0:
+                            del pending_chunks[file_path]
+                            await file_done()
+                written_chunks += len(documents)
+
+        writer = asyncio.create_task(write())
+        # Задач эмбеддинга столько, сколько допускает максимум AIMD лимитера:
+        # реальный параллелизм ограничивает сам лимитер
+        limiter = self.vectorstore.embeddings_service.ingest_scheduler.limiter
+        embedders = [asyncio.create_task(embed()) for _ in range(limiter.maximum)]
+
+        try:
+            with ExtractorPool(workers=self.workers) as pool:
+                await asyncio.gather(*(parse(pool, path) for path in small_files))
+
+            for _ in embedders:
+                await embed_queue.put(self._DONE)
+            await asyncio.gather(*embedders)
+
+            await write_queue.put(self._DONE)
+            await writer
+        except BaseException:
+            for task in [writer, *embedders]:
+                task.cancel()
+            raise
+
+        # Очень большие файлы - потоковая нарезка в основном процессе
+        for path in large_files:
+            try:
+                ids = await self.ingestor.ingest_file_ids(str(path))
+                self.file_ids[str(path)] = ids
+                written_chunks += len(ids)
+                print(f"✓ Загружен: {path.name} ({len(ids)} чанков)")
+            except Exception as e:
+                print(f"✗ Ошибка при загрузке {path.name}: {e}")
+                self.failed_files.add(str(path))
+            await file_done()
+
+        return written_chunks
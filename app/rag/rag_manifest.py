@@ -0,0 +1,120 @@
+"""
+Манифест проиндексированных файлов клиента.
+
+Для каждого файла хранится размер, mtime, SHA-256 содержимого и диапазоны
+id его чанков в векторном хранилище. Синхронизация сравнивает манифест с
+директорией документов и обрабатывает только добавленные, изменённые и
+удалённые файлы.
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+
+class IngestManifest:
+    """Манифест файлов: путь -> (size, mtime, sha256, диапазоны id чанков)"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Путь к JSON файлу манифеста
+        """
+        self.path = path
+        self.files: Dict[str, dict] = {}
+
+    def exists(self) -> bool:
+        """Есть ли манифест на диске"""
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Загрузить манифест с диска"""
+        if not self.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.files = json.load(f).get('files', {})
+
+    def save(self):
+        """Атомарно сохранить манифест"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'files': self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        """SHA-256 содержимого файла (читается блоками)"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def ids_to_ranges(ids: Iterable[int]) -> List[List[int]]:
+        """Свернуть id в диапазоны [start, end] включительно"""
+        ranges: List[List[int]] = []
+        for doc_id in sorted(ids):
+            if ranges and doc_id == ranges[-1][1] + 1:
+                ranges[-1][1] = doc_id
+            else:
+                ranges.append([doc_id, doc_id])
+        return ranges
+
+    @staticmethod
+    def ranges_to_ids(ranges: Iterable[List[int]]) -> List[int]:
+        """Развернуть диапазоны в список id"""
+        return [doc_id for start, end in ranges for doc_id in range(start, end + 1)]
+
+    def get_ids(self, rel_path: str) -> List[int]:
+        """id чанков файла"""
+        entry = self.files.get(rel_path)
+        return self.ranges_to_ids(entry['ids']) if entry else []
+
+    def set_entry(self, rel_path: str, file_path: Path, sha256: str, ids: Iterable[int]):
+        """Записать состояние файла"""
+        stat = file_path.stat()
+        self.files[rel_path] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': sha256,
+            'ids': self.ids_to_ranges(ids)
+        }
+
+    def diff(self, current: Dict[str, Path]) -> Tuple[List[str], List[str], List[str], Dict[str, str]]:
+        """
+        Сравнить манифест с текущими файлами
+
+        Args:
+            current: Относительный путь -> путь к файлу
+
+        Returns:
+            (добавленные, изменённые, удалённые, хэши посчитанных файлов).
+            Файлы с изменившимся mtime, но тем же содержимым, не считаются
+            изменёнными - у них обновляется только stat в манифесте.
+        """
+        added, modified = [], []
+        hashes: Dict[str, str] = {}
+
+        for rel_path, file_path in current.items():
+            entry = self.files.get(rel_path)
+            if entry is None:
+                added.append(rel_path)
+                continue
+
+            stat = file_path.stat()
+            if stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']:
+                continue
+
+            sha256 = self.file_hash(str(file_path))
+            hashes[rel_path] = sha256
+            if sha256 == entry['sha256']:
+                entry['size'] = stat.st_size
+                entry['mtime'] = stat.st_mtime
+            else:
+                modified.append(rel_path)
+
+        removed = [rel_path for rel_path in self.files if rel_path not in current]
+        return added, modified, removed, hashes
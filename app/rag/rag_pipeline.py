@@ -1,7 +1,29 @@
-from typing import List, Dict, Optional
+import time
+from typing import AsyncGenerator, List, Dict, Optional, Tuple
 from .rag_retriever import Retriever
 from .rag_generator import Generator
-from ..schemas import RAGResponse
+from .rag_answer_cache import SemanticAnswerCache
+from .rag_faq import FAQIndex
+from .rag_single_flight import SingleFlight, history_fingerprint, question_key
+from .rag_history import HistoryManager, is_follow_up
+from .rag_gate import RetrievalGate
+from .rag_tokens import count_tokens
+from ..schemas import Document, RAGResponse
+
+
+class _QueryPlan:
+    """Результат шагов до генерации: готовый ответ или документы для LLM"""
+
+    def __init__(self):
+        # Готовый ответ из FAQ или кэша (генерация не нужна)
+        self.response: Optional[RAGResponse] = None
+        self.answer_source = "llm"
+        # Документы для контекста (пусто - ответ без RAG)
+        self.documents: List[Tuple[Document, float]] = []
+        # Сохранить ответ в семантический кэш
+        self.use_cache = False
+        self.query_embedding: Optional[List[float]] = None
+        self.generation = 0
 
 
 class RAGPipeline:
@@ -11,18 +33,47 @@ class RAGPipeline:
         self,
         retriever: Retriever,
         generator: Generator,
-        use_rag_threshold: float = 0.5
+        use_rag_threshold: float = 0.5,
+        min_index_coverage: float = 0.0,
+        answer_cache: Optional[SemanticAnswerCache] = None,
+        faq: Optional[FAQIndex] = None,
+        retrieval_gate: Optional[RetrievalGate] = None,
+        history_manager: Optional[HistoryManager] = None
     ):
+        """
+        Args:
+            retriever: Retriever
+            generator: Generator
+            use_rag_threshold: Минимальный score документа для контекста
+            min_index_coverage: Доля проиндексированных файлов (0-1), ниже которой
+                во время индексации ответы генерируются без RAG
+            answer_cache: Семантический кэш ответов на вопросы без истории чата
+            faq: Курируемый FAQ с каноническими ответами
+            retrieval_gate: Локальный фильтр вопросов, которым не нужен поиск
+            history_manager: Сжатие истории длинных диалогов (для ботов)
+        """
         self.retriever = retriever
         self.generator = generator
         self.use_rag_threshold = use_rag_threshold
+        self.min_index_coverage = min_index_coverage
+        self.answer_cache = answer_cache
+        self.faq = faq
+        self.retrieval_gate = retrieval_gate
+        self.history_manager = history_manager
+        # Одинаковые одновременные запросы обрабатываются один раз
+        self.single_flight = SingleFlight()
+        # Доля файлов клиента в индексе (обновляется RAGManager при индексации)
+        self.index_coverage = 1.0
+        # Уточняющие вопросы, ответы на которые использовали контекст прошлого хода
+        self.follow_up_reuses = 0
     
     async def query(
         self,
         question: str,
         chat_history: Optional[List[Dict[str, str]]] = None,
         use_rag: bool = True,
-        top_k: int = 3
+        top_k: int = 3,
+        conversation: Optional[dict] = None
     ) -> RAGResponse:
         """
         Обработать запрос через RAG pipeline
@@ -32,58 +83,261 @@ class RAGPipeline:
             chat_history: История чата
             use_rag: Использовать ли RAG
             top_k: Количество документов для retrieval
+            conversation: Диалог (HistoryManager): чанки контекста ответа
+                сохраняются в нём и используются для уточняющих вопросов
 
         Returns:
             RAGResponse с ответом и источниками
         """
+        previous = self._follow_up_context(question, conversation, use_rag)
+        key = (
+            question_key(question), use_rag, top_k, history_fingerprint(chat_history),
+            tuple(previous['chunk_ids']) if previous else ()
+        )
+        response = await self.single_flight.run(
+            key,
+            lambda: self._query(question, chat_history, use_rag, top_k, previous)
+        )
+        self._remember_context(conversation, response)
+        return response
 
-        print(f"🔍 RAG Pipeline: начало обработки запроса")
+    @staticmethod
+    def _follow_up_context(
+        question: str,
+        conversation: Optional[dict],
+        use_rag: bool
+    ) -> Optional[dict]:
+        """Контекст прошлого хода, если вопрос - уточнение к нему"""
+        if not use_rag or not conversation or not conversation.get('retrieved'):
+            return None
+        if not is_follow_up(question):
+            return None
+        return conversation['retrieved']
 
-        if not use_rag:
-            # Генерируем ответ без RAG
-            print(f"⚙️ RAG Pipeline: генерация без RAG")
-            answer = await self.generator.generate_without_context(
+    @staticmethod
+    def _remember_context(conversation: Optional[dict], response: RAGResponse):
+        """
+        Сохранить чанки контекста ответа в диалоге. Ответ без контекста
+        (фильтр, FAQ, нет документов) сбрасывает контекст прошлых ходов:
+        уточнение относится только к предыдущему ответу.
+        """
+        if conversation is None:
+            return
+        if response.chunk_ids:
+            conversation['retrieved'] = {
+                'chunk_ids': list(response.chunk_ids),
+                'confidence': response.confidence
+            }
+        else:
+            conversation.pop('retrieved', None)
+
+    async def _query(
+        self,
+        question: str,
+        chat_history: Optional[List[Dict[str, str]]],
+        use_rag: bool,
+        top_k: int,
+        previous: Optional[dict] = None
+    ) -> RAGResponse:
+        """Обработка запроса (вызывается один раз на группу одинаковых запросов)"""
+        plan = await self._prepare(question, chat_history, use_rag, top_k, previous)
+        if plan.response is not None:
+            return plan.response
+
+        if plan.documents:
+            # Generation: генерируем ответ на основе документов
+            answer = await self.generator.generate(
                 query=question,
+                documents=plan.documents,
                 chat_history=chat_history
             )
-            return RAGResponse(
-                answer=answer,
-                sources=[],
-                confidence=0.0
+        else:
+            answer = await self.generator.generate_without_context(
+                query=question,
+                chat_history=chat_history
             )
+            print(f"✅ RAG Pipeline: ответ сгенерирован")
+
+        return self._finish(question, plan, answer)
+
+    async def query_stream(
+        self,
+        question: str,
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        use_rag: bool = True,
+        top_k: int = 3,
+        conversation: Optional[dict] = None
+    ) -> AsyncGenerator[dict, None]:
+        """
+        Обработать запрос с потоковой передачей ответа.
+        Одинаковые одновременные запросы не объединяются: у каждого свой поток.
+
+        Args:
+            question: Вопрос пользователя
+            chat_history: История чата
+            use_rag: Использовать ли RAG
+            top_k: Количество документов для retrieval
+            conversation: Диалог (HistoryManager) для повторного использования контекста
+
+        Yields:
+            События по порядку:
+            {'type': 'sources', 'sources': [...], 'confidence': float} - до генерации;
+            {'type': 'token', 'content': str} - части ответа по мере генерации;
+            {'type': 'usage', 'answer_source': 'llm' | 'faq' | 'cache',
+             'answer_tokens', 'documents', 'time_to_first_token_ms', 'total_ms'}
+        """
+        started = time.perf_counter()
+        previous = self._follow_up_context(question, conversation, use_rag)
+        plan = await self._prepare(question, chat_history, use_rag, top_k, previous)
+
+        if plan.response is not None:
+            # Готовый ответ отдаётся одним фрагментом
+            sources, confidence = plan.response.sources, plan.response.confidence
+            stream = None
+        else:
+            sources, confidence = self._collect_sources(plan.documents)
+            if plan.documents:
+                stream = self.generator.generate_stream(
+                    query=question,
+                    documents=plan.documents,
+                    chat_history=chat_history
+                )
+            else:
+                stream = self.generator.generate_without_context_stream(
+                    query=question,
+                    chat_history=chat_history
+                )
+
+        yield {'type': 'sources', 'sources': sources, 'confidence': confidence}
+
+        first_token_at = None
+        if stream is None:
+            response = plan.response
+            answer = response.answer
+            first_token_at = time.perf_counter()
+            yield {'type': 'token', 'content': answer}
+        else:
+            parts = []
+            async for token in stream:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(token)
+                yield {'type': 'token', 'content': token}
+            answer = "".join(parts)
+            response = self._finish(question, plan, answer)
+        self._remember_context(conversation, response)
+
+        finished = time.perf_counter()
+        yield {
+            'type': 'usage',
+            'answer_source': plan.answer_source,
+            'answer_tokens': count_tokens(answer),
+            'documents': len(plan.documents),
+            'time_to_first_token_ms': round(((first_token_at or finished) - started) * 1000),
+            'total_ms': round((finished - started) * 1000)
+        }
+
+    async def _prepare(
+        self,
+        question: str,
+        chat_history: Optional[List[Dict[str, str]]],
+        use_rag: bool,
+        top_k: int,
+        previous: Optional[dict] = None
+    ) -> _QueryPlan:
+        """Шаги до генерации: контекст прошлого хода, FAQ, семантический кэш, retrieval"""
+        print(f"🔍 RAG Pipeline: начало обработки запроса")
+        plan = _QueryPlan()
+
+        # Уточняющий вопрос: контекст прошлого ответа без эмбеддинга и поиска
+        # (новый поиск по короткому вопросу обычно находит худший контекст)
+        if previous is not None:
+            documents = self.retriever.vectorstore.get_documents(previous['chunk_ids'])
+            if documents:
+                print(f"🔁 RAG Pipeline: уточняющий вопрос, контекст прошлого ответа ({len(documents)} чанков)")
+                self.follow_up_reuses += 1
+                plan.documents = [(document, previous.get('confidence', 0.0)) for document in documents]
+                return plan
+
+        # Эмбеддинг вопроса считается не больше одного раза на запрос
+        query_embedding = None
+        embedded = False
+
+        # Локальный фильтр до сетевых вызовов: приветствия и вопросы не по теме
+        # базы знаний отвечаются без эмбеддинга и поиска (дословный FAQ - в приоритете)
+        if use_rag and self.retrieval_gate is not None:
+            if self.faq is None or self.faq.match_exact(question) is None:
+                if not self.retrieval_gate.needs_retrieval(question):
+                    use_rag = False
+
+        # Курируемый FAQ: канонический ответ без retrieval и вызова LLM
+        if use_rag and self.faq is not None:
+            if self.faq.match_exact(question) is None:
+                query_embedding = await self.retriever.embed_query(question)
+                embedded = True
+            match = self.faq.match(question, query_embedding)
+            if match is not None:
+                entry, score = match
+                print(f"📌 RAG Pipeline: ответ из FAQ (уверенность {score:.2f})")
+                plan.answer_source = "faq"
+                plan.response = RAGResponse(
+                    answer=entry.answer,
+                    sources=[entry.source],
+                    confidence=score
+                )
+                return plan
+
+        if use_rag and self.index_coverage < self.min_index_coverage:
+            # Индекс ещё строится: по малой части документов ответ был бы неполным
+            print(f"⏳ RAG Pipeline: проиндексировано {self.index_coverage:.0%} документов, ответ без RAG")
+            use_rag = False
+
+        if not use_rag:
+            # Генерируем ответ без RAG
+            print(f"⚙️ RAG Pipeline: генерация без RAG")
+            return plan
+
+        # Семантический кэш: ответ зависит только от вопроса и базы знаний,
+        # поэтому используется только без истории чата
+        use_cache = self.answer_cache is not None and not chat_history
+        if use_cache:
+            generation = self.retriever.vectorstore.generation
+            cached = self.answer_cache.get_exact(question, generation)
+            if cached is None:
+                if not embedded:
+                    query_embedding = await self.retriever.embed_query(question)
+                    embedded = True
+                if query_embedding is not None:
+                    cached = self.answer_cache.get(query_embedding, generation)
+            if cached is not None:
+                print(f"⚡ RAG Pipeline: ответ из семантического кэша")
+                plan.answer_source = "cache"
+                plan.response = cached
+                return plan
+            plan.use_cache = query_embedding is not None
+            plan.query_embedding = query_embedding
+            plan.generation = generation
 
         # Retrieval: получаем релевантные документы
         print(f"🔍 RAG Pipeline: поиск релевантных документов...")
-        documents = await self.retriever.retrieve_with_threshold(
+        plan.documents = await self.retriever.retrieve_with_threshold(
             query=question,
             threshold=self.use_rag_threshold,
-            k=top_k
+            k=top_k,
+            query_embedding=query_embedding,
+            # embed_query вернул None (таймаут, разомкнутый breaker) - не повторяем
+            embedding_failed=embedded and query_embedding is None
         )
 
-        print(f"📚 RAG Pipeline: найдено документов: {len(documents)}")
-
-        if not documents:
+        print(f"📚 RAG Pipeline: найдено документов: {len(plan.documents)}")
+        if not plan.documents:
             # Если релевантных документов нет, отвечаем без RAG
             print(f"⚙️ RAG Pipeline: документов нет, генерация без контекста...")
-            answer = await self.generator.generate_without_context(
-                query=question,
-                chat_history=chat_history
-            )
-            print(f"✅ RAG Pipeline: ответ сгенерирован")
-            return RAGResponse(
-                answer=answer,
-                sources=[],
-                confidence=0.0
-            )
-        
-        # Generation: генерируем ответ на основе документов
-        answer = await self.generator.generate(
-            query=question,
-            documents=documents,
-            chat_history=chat_history
-        )
-        
-        # Собираем источники
+        return plan
+
+    @staticmethod
+    def _collect_sources(documents: List[Tuple[Document, float]]) -> Tuple[List[str], float]:
+        """Источники (без повторов) и средний score документов"""
         sources = []
         total_confidence = 0.0
         
@@ -94,17 +348,35 @@ class RAGPipeline:
             total_confidence += score
         
         avg_confidence = total_confidence / len(documents) if documents else 0.0
-        
-        return RAGResponse(
+        return sources, avg_confidence
+
+    def _finish(self, question: str, plan: _QueryPlan, answer: str) -> RAGResponse:
+        """Собрать ответ из сгенерированного текста и сохранить его в кэш"""
+        sources, confidence = self._collect_sources(plan.documents)
+        response = RAGResponse(
             answer=answer,
             sources=sources,
-            confidence=avg_confidence
+            confidence=confidence,
+            chunk_ids=[
+                document.metadata['vector_id'] for document, _ in plan.documents
+                if 'vector_id' in document.metadata
+            ]
         )
+        # LLM возвращают текст ошибки вместо исключения - такие ответы не кэшируем
+        if plan.use_cache and not answer.startswith("Ошибка"):
+            self._cache_answer(question, plan.query_embedding, response, plan.generation)
+        return response
+    
+    def _cache_answer(self, question: str, query_embedding: List[float], response: RAGResponse, generation: int):
+        """Сохранить ответ, если индекс не изменился за время генерации"""
+        if self.retriever.vectorstore.generation == generation:
+            self.answer_cache.put(question, query_embedding, response, generation)
     
     async def ask(
         self,
         question: str,
-        chat_history: Optional[List[Dict[str, str]]] = None
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        conversation: Optional[dict] = None
     ) -> str:
         """
         Упрощенный метод для получения ответа
@@ -112,17 +384,19 @@ class RAGPipeline:
         Args:
             question: Вопрос
             chat_history: История чата
+            conversation: Диалог (HistoryManager)
         
         Returns:
             Текст ответа
         """
-        response = await self.query(question, chat_history)
+        response = await self.query(question, chat_history, conversation=conversation)
         return response.answer
     
     async def process_query(
         self,
         query: str,
-        chat_history: Optional[List[Dict[str, str]]] = None
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        conversation: Optional[dict] = None
     ) -> str:
         """
         Алиас для совместимости со старым кодом.
@@ -131,8 +405,9 @@ class RAGPipeline:
         Args:
             query: Вопрос пользователя
             chat_history: История диалога
+            conversation: Диалог (HistoryManager)
             
         Returns:
             Текст ответа
         """
-        return await self.ask(query, chat_history)
\ No newline at end of file
+        return await self.ask(query, chat_history, conversation)
\ No newline at end of file
@@ -1,46 +1,113 @@
-from typing import List, Tuple
+import os
+from typing import List, Optional, Tuple
 from ..vectorstore.vectorstore_base import BaseVectorStore
+from ..embeddings.embeddings_resilience import EmbeddingsUnavailableError
 from ..schemas import Document
 
 
 class Retriever:
     """Retriever для поиска релевантных документов"""
     
-    def __init__(self, vectorstore: BaseVectorStore, top_k: int = 3):
+    def __init__(
+        self,
+        vectorstore: BaseVectorStore,
+        top_k: int = 3,
+        fallback: str = "lexical",
+        lexical_threshold: Optional[float] = None
+    ):
+        """
+        Args:
+            vectorstore: Векторное хранилище
+            top_k: Количество документов по умолчанию
+            fallback: Поведение при недоступности embeddings API:
+                "lexical" - лексический поиск по чанкам, "none" - ответ без RAG
+            lexical_threshold: Порог для результатов лексического fallback -
+                доли найденных термов запроса (RAG_LEXICAL_THRESHOLD); порог
+                similarity векторного поиска к этой шкале неприменим
+        """
         self.vectorstore = vectorstore
         self.top_k = top_k
+        self.fallback = fallback
+        self.lexical_threshold = lexical_threshold if lexical_threshold is not None else float(os.getenv("RAG_LEXICAL_THRESHOLD", "0.3"))
+        self.fallback_count = 0
     
-    async def retrieve(self, query: str, k: int = None) -> List[Tuple[Document, float]]:
+    async def embed_query(self, query: str) -> Optional[List[float]]:
+        """Эмбеддинг запроса (None, если embeddings API недоступен)"""
+        try:
+            return await self.vectorstore.embeddings_service.embed_query(query)
+        except EmbeddingsUnavailableError:
+            return None
+    
+    async def retrieve(
+        self,
+        query: str,
+        k: int = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Tuple[Document, float]]:
         """
         Получить релевантные документы
         
         Args:
             query: Поисковый запрос
             k: Количество документов (если None, используется self.top_k)
+            query_embedding: Уже посчитанный эмбеддинг запроса
         
         Returns:
             Список кортежей (документ, score)
         """
-        k = k or self.top_k
-        results = await self.vectorstore.similarity_search(query, k=k)
+        results, _ = await self._search(query, k, query_embedding)
         return results
     
+    async def _search(
+        self,
+        query: str,
+        k: Optional[int],
+        query_embedding: Optional[List[float]],
+        embedding_failed: bool = False
+    ) -> Tuple[List[Tuple[Document, float]], bool]:
+        """Результаты поиска и признак лексического fallback"""
+        k = k or self.top_k
+        if embedding_failed:
+            # Эмбеддинг запроса уже не удался - второй попытки не делаем
+            return await self._fallback(query, k, "эмбеддинг запроса не получен")
+        try:
+            results = await self.vectorstore.similarity_search(query, k=k, query_embedding=query_embedding)
+        except EmbeddingsUnavailableError as e:
+            return await self._fallback(query, k, str(e))
+        return results, False
+    
+    async def _fallback(self, query: str, k: int, reason: str) -> Tuple[List[Tuple[Document, float]], bool]:
+        """Деградация без векторного поиска (не ждём восстановления провайдера)"""
+        self.fallback_count += 1
+        print(f"⚠️  Retriever: embeddings недоступны ({reason}), fallback: {self.fallback}")
+        if self.fallback == "lexical":
+            return await self.vectorstore.lexical_search(query, k=k), True
+        return [], False
+    
     async def retrieve_with_threshold(
         self, 
         query: str, 
         threshold: float = 0.5,
-        k: int = None
+        k: int = None,
+        query_embedding: Optional[List[float]] = None,
+        embedding_failed: bool = False
     ) -> List[Tuple[Document, float]]:
         """
         Получить документы с порогом релевантности
         
         Args:
             query: Поисковый запрос
-            threshold: Минимальный порог similarity (0-1)
+            threshold: Минимальный порог similarity (0-1) векторного поиска
+                (для лексического fallback - lexical_threshold)
             k: Количество документов
+            query_embedding: Уже посчитанный эмбеддинг запроса
+            embedding_failed: Эмбеддинг запроса в этом запросе уже не удался -
+                сразу fallback, без повторного вызова embeddings API
         
         Returns:
             Отфильтрованный список документов
         """
-        results = await self.retrieve(query, k)
+        results, lexical = await self._search(query, k, query_embedding, embedding_failed)
+        if lexical:
+            threshold = self.lexical_threshold
         return [(doc, score) for doc, score in results if score >= threshold]
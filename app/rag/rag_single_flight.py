@@ -0,0 +1,88 @@
+"""
+Single-flight для одинаковых одновременных вопросов.
+
+При рассылке или новости множество пользователей за секунды присылают
+одно и то же сообщение. Запросы с одинаковым ключом (нормализованный
+вопрос, режим RAG, отпечаток истории чата), пришедшие, пока первый ещё
+обрабатывается, не запускают свои эмбеддинг, поиск и вызов LLM, а
+получают результат первого.
+"""
+import re
+import json
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def history_fingerprint(chat_history: Optional[List[Dict[str, str]]]) -> str:
+    """Отпечаток истории чата (пустая история - пустая строка)"""
+    if not chat_history:
+        return ""
+    data = json.dumps(chat_history, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def question_key(question: str) -> str:
+    """Нормализованный вопрос: регистр и пробелы не различаются"""
+    return _SPACE_RE.sub(" ", question.strip().lower())
+
+
+class SingleFlight:
+    """Объединение одновременных вызовов с одинаковым ключом"""
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+        # Метрики
+        self.total_requests = 0
+        self.coalesced_requests = 0
+        self.max_waiters = 0
+        self._waiters: Dict[Hashable, int] = {}
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполнить func() или дождаться уже идущего вызова с тем же ключом
+
+        Args:
+            key: Ключ запроса
+            func: Фабрика корутины вычисления
+
+        Returns:
+            Результат (общий для всех объединённых запросов)
+        """
+        self.total_requests += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            # Вычисление - отдельная задача: отмена одного из ожидающих
+            # не прерывает ответ остальным
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            self._waiters[key] = 1
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.coalesced_requests += 1
+            self._waiters[key] += 1
+            self.max_waiters = max(self.max_waiters, self._waiters[key])
+
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        self._waiters.pop(key, None)
+        # Ошибка уже передана ожидающим; помечаем её полученной, чтобы asyncio
+        # не предупреждал, если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> dict:
+        """Метрики объединения запросов"""
+        return {
+            'total_requests': self.total_requests,
+            'coalesced_requests': self.coalesced_requests,
+            'coalesced_rate': self.coalesced_requests / self.total_requests if self.total_requests else 0.0,
+            'max_waiters': self.max_waiters,
+            'in_flight': len(self._in_flight)
+        }
@@ -0,0 +1,101 @@
+"""
+Локальный подсчёт токенов.
+
+Используется tiktoken (cl100k_base - токенизатор моделей эмбеддингов OpenAI
+и GPT-4). Если tiktoken недоступен (нет пакета или словарь не удалось
+загрузить), используется оценка по байтам UTF-8: она одинаково пригодна
+для кириллицы и латиницы, в отличие от оценки по символам.
+"""
+from typing import List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """Ленивая загрузка токенизатора (None - работаем по оценке)"""
+    global _encoding, _encoding_failed
+
+    if _encoding is None and not _encoding_failed:
+        if tiktoken is None:
+            _encoding_failed = True
+            print("⚠️  tiktoken не установлен, токены считаются приблизительно")
+        else:
+            try:
+                _encoding = tiktoken.get_encoding(ENCODING_NAME)
+            except Exception as e:
+                _encoding_failed = True
+                print(f"⚠️  Не удалось загрузить токенизатор {ENCODING_NAME}: {e}")
+                print("   Токены считаются приблизительно")
+
+    return _encoding
+
+
+def _estimate(text: str) -> int:
+    """Оценка: ~4 байта UTF-8 на токен"""
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    Количество токенов в тексте
+
+    Args:
+        text: Текст
+
+    Returns:
+        Число токенов
+    """
+    if not text:
+        return 0
+
+    encoding = _get_encoding()
+    if encoding is None:
+        return _estimate(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """
+    Жёстко разрезать текст на части не длиннее max_tokens токенов
+    (для фрагментов без границ предложений)
+
+    Args:
+        text: Текст
+        max_tokens: Лимит токенов в части
+
+    Returns:
+        Список частей
+    """
+    encoding = _get_encoding()
+
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return [
+            encoding.decode(tokens[start:start + max_tokens])
+            for start in range(0, len(tokens), max_tokens)
+        ]
+
+    # Без токенизатора режем по символам пропорционально оценке
+    total = _estimate(text)
+    if total <= max_tokens:
+        return [text]
+    step = max(1, len(text) * max_tokens // total)
+    return [text[start:start + step] for start in range(0, len(text), step)]
+
+
+def stored_token_count(metadata: Optional[dict], text: str) -> int:
+    """Число токенов чанка из метаданных (посчитано при индексации) или пересчёт"""
+    if metadata:
+        token_count = metadata.get('token_count')
+        if token_count is not None:
+            return token_count
+    return count_tokens(text)
@@ -36,3 +36,4 @@ class RAGResponse(BaseModel):
     answer: str
     sources: List[str] = Field(default_factory=list)
     confidence: float = 0.0
+    chunk_ids: List[int] = Field(default_factory=list, description="id чанков контекста ответа")
@@ -1,21 +1,31 @@
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from typing import Iterable, List, Optional, Tuple
 from ..schemas import Document
 
 
 class BaseVectorStore(ABC):
     """Базовый класс для векторного хранилища"""
     
+    # Поколение индекса: меняется при каждом добавлении, удалении или загрузке
+    # чанков (по нему инвалидируются кэши ответов)
+    generation: int = 0
+    
+    @abstractmethod
+    async def add_documents(self, documents: List[Document]) -> List[int]:
+        """Добавить документы в хранилище, вернуть id чанков"""
+        pass
+    
     @abstractmethod
-    async def add_documents(self, documents: List[Document]):
-        """Добавить документы в хранилище"""
+    def delete(self, ids: List[int]) -> int:
+        """Удалить чанки по id, вернуть количество удалённых"""
         pass
     
     @abstractmethod
     async def similarity_search(
         self, 
         query: str, 
-        k: int = 3
+        k: int = 3,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Tuple[Document, float]]:
         """
         Поиск похожих документов
@@ -23,12 +33,38 @@ class BaseVectorStore(ABC):
         Args:
             query: Поисковый запрос
             k: Количество результатов
+            query_embedding: Уже посчитанный эмбеддинг запроса
         
         Returns:
             Список кортежей (документ, similarity_score)
         """
         pass
     
+    async def lexical_search(
+        self,
+        query: str,
+        k: int = 3
+    ) -> List[Tuple[Document, float]]:
+        """
+        Лексический поиск без эмбеддингов (деградированный режим,
+        когда embeddings API недоступен). По умолчанию не поддерживается.
+        """
+        return []
+    
+    def lexical_vocabulary(self) -> Optional[Iterable[str]]:
+        """
+        Термы чанков хранилища (см. lexical_terms) без распаковки текста.
+        По умолчанию не поддерживается (None).
+        """
+        return None
+    
+    def get_documents(self, ids: List[int]) -> List[Document]:
+        """
+        Чанки по id из metadata['vector_id'] результатов поиска
+        (повторное использование контекста). По умолчанию не поддерживается.
+        """
+        return []
+    
     @abstractmethod
     async def save(self, path: str):
         """Сохранить хранилище на диск"""
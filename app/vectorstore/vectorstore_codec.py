@@ -0,0 +1,201 @@
+"""
+Сжатое хранение текста чанков.
+
+Каждый чанк сжимается отдельно (zstd или zlib), чтобы при поиске
+распаковывались только найденные чанки. Короткие чанки плохо сжимаются
+по одному, поэтому после накопления выборки обучается общий словарь
+хранилища (у каждого клиента своё хранилище и свой словарь): повторяющиеся
+заголовки, шаблонные фразы и термины берутся из словаря.
+
+Первый байт блока - формат, так что чанки, сжатые до обучения словаря
+или другим методом, читаются и после смены настроек.
+"""
+import os
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ..schemas import Document
+
+
+_PLAIN = 0
+_ZLIB = 1
+_ZLIB_DICT = 2
+_ZSTD = 3
+_ZSTD_DICT = 4
+
+# Окно deflate - словарь zlib длиннее 32 КБ не используется
+_ZLIB_DICT_SIZE = 32 * 1024
+# Блоки короче этого не сжимаются
+_MIN_COMPRESS_BYTES = 64
+
+
+class ChunkCodec:
+    """Сжатие текста чанков с общим словарём"""
+
+    def __init__(self, method: Optional[str] = None, level: Optional[int] = None):
+        """
+        Args:
+            method: "zstd", "zlib" или "none" (CHUNK_COMPRESSION; по умолчанию
+                zstd, если установлен zstandard, иначе zlib)
+            level: Уровень сжатия (по умолчанию 3 для zstd, 6 для zlib)
+        """
+        method = (method or os.getenv("CHUNK_COMPRESSION") or ("zstd" if zstandard else "zlib")).lower()
+        if method == "zstd" and zstandard is None:
+            print("⚠️  zstandard не установлен, текст чанков сжимается zlib")
+            method = "zlib"
+        self.method = method
+        self.level = level if level is not None else (3 if method == "zstd" else 6)
+        self.dictionary: Optional[bytes] = None
+        self._zstd_dict = None
+        self._zstd_compressor = None
+        self._zstd_decompressor = None
+
+    def set_dictionary(self, dictionary: Optional[bytes]):
+        """Установить общий словарь (при загрузке хранилища)"""
+        self.dictionary = dictionary or None
+        self._zstd_dict = None
+        self._zstd_compressor = None
+        self._zstd_decompressor = None
+
+    def _get_zstd_dict(self):
+        if self._zstd_dict is None and self.dictionary and zstandard is not None:
+            self._zstd_dict = zstandard.ZstdCompressionDict(self.dictionary)
+        return self._zstd_dict
+
+    def train(self, samples: List[str]) -> bool:
+        """
+        Обучить словарь по выборке текстов чанков
+
+        Returns:
+            True, если словарь обучен
+        """
+        if self.method == "none" or not samples:
+            return False
+
+        encoded = [sample.encode('utf-8') for sample in samples]
+        if self.method == "zstd":
+            try:
+                dictionary = zstandard.train_dictionary(64 * 1024, encoded).as_bytes()
+            except zstandard.ZstdError as e:
+                print(f"⚠️  Не удалось обучить словарь zstd: {e}")
+                return False
+        else:
+            dictionary = self._build_zlib_dictionary(encoded)
+
+        self.set_dictionary(dictionary)
+        return True
+
+    @staticmethod
+    def _build_zlib_dictionary(samples: List[bytes]) -> bytes:
+        """
+        Словарь zlib: повторяющиеся строки выборки, самые частые - в конце
+        (deflate дешевле кодирует близкие ссылки)
+        """
+        lines = Counter(
+            line.strip()
+            for sample in samples
+            for line in sample.splitlines()
+            if len(line.strip()) >= 8
+        )
+        repeated = [line for line, count in lines.most_common() if count > 1]
+
+        selected: List[bytes] = []
+        size = 0
+        for line in repeated:
+            if size + len(line) + 1 > _ZLIB_DICT_SIZE:
+                break
+            selected.append(line)
+            size += len(line) + 1
+
+        # Остаток словаря - сами тексты (частые слова и обороты)
+        filler: List[bytes] = []
+        for sample in samples:
+            if size >= _ZLIB_DICT_SIZE:
+                break
+            piece = sample[:_ZLIB_DICT_SIZE - size]
+            filler.append(piece)
+            size += len(piece) + 1
+
+        return b"\n".join(filler + selected[::-1])[-_ZLIB_DICT_SIZE:]
+
+    def encode(self, text: str) -> bytes:
+        """Сжать текст чанка"""
+        raw = text.encode('utf-8')
+        if self.method == "none" or len(raw) < _MIN_COMPRESS_BYTES:
+            return bytes([_PLAIN]) + raw
+
+        if self.method == "zstd":
+            if self._zstd_compressor is None:
+                self._zstd_compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self._get_zstd_dict())
+            kind = _ZSTD_DICT if self.dictionary else _ZSTD
+            return bytes([kind]) + self._zstd_compressor.compress(raw)
+
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self.dictionary)
+            kind = _ZLIB_DICT
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            kind = _ZLIB
+        data = compressor.compress(raw) + compressor.flush()
+        if len(data) >= len(raw):
+            return bytes([_PLAIN]) + raw
+        return bytes([kind]) + data
+
+    def decode(self, data: bytes) -> str:
+        """Распаковать текст чанка"""
+        kind, payload = data[0], data[1:]
+
+        if kind == _PLAIN:
+            raw = payload
+        elif kind in (_ZLIB, _ZLIB_DICT):
+            if kind == _ZLIB_DICT:
+                decompressor = zlib.decompressobj(-15, zdict=self.dictionary)
+            else:
+                decompressor = zlib.decompressobj(-15)
+            raw = decompressor.decompress(payload) + decompressor.flush()
+        elif kind in (_ZSTD, _ZSTD_DICT):
+            if zstandard is None:
+                raise RuntimeError("Чанк сжат zstd, но zstandard не установлен")
+            if kind == _ZSTD_DICT:
+                if self._zstd_decompressor is None:
+                    self._zstd_decompressor = zstandard.ZstdDecompressor(dict_data=self._get_zstd_dict())
+                raw = self._zstd_decompressor.decompress(payload)
+            else:
+                raw = zstandard.ZstdDecompressor().decompress(payload)
+        else:
+            raise ValueError(f"Неизвестный формат чанка: {kind}")
+
+        return raw.decode('utf-8')
+
+
+class StoredChunk:
+    """
+    Чанк в хранилище: метаданные и сжатый текст.
+    Текст распаковывается только при обращении к content.
+    """
+
+    __slots__ = ('metadata', 'data', 'codec')
+
+    def __init__(self, metadata: Dict[str, Any], data: bytes, codec: ChunkCodec):
+        self.metadata = metadata
+        self.data = data
+        self.codec = codec
+
+    @property
+    def content(self) -> str:
+        return self.codec.decode(self.data)
+
+    def to_document(self, doc_id: Optional[int] = None) -> Document:
+        """
+        Распакованный документ для выдачи результатов поиска
+        (с doc_id - id чанка в metadata['vector_id'])
+        """
+        if doc_id is None:
+            return Document(content=self.content, metadata=self.metadata)
+        return Document(content=self.content, metadata={**self.metadata, 'vector_id': doc_id})
@@ -1,60 +1,153 @@
-from typing import List, Tuple
+from array import array
+from bisect import bisect_left
+from typing import Dict, KeysView, List, Tuple, Optional
+import random
 import faiss
 import numpy as np
-from langchain_openai import OpenAIEmbeddings
 import pickle
 import os
 from .vectorstore_base import BaseVectorStore
+from .vectorstore_codec import ChunkCodec, StoredChunk
+from .vectorstore_terms import lexical_terms
 from ..schemas import Document
+from ..embeddings.embeddings_service import EmbeddingsService, get_embeddings_service
 
 
 class FAISSVectorStore(BaseVectorStore):
     """FAISS векторное хранилище с OpenAI Embeddings"""
 
-    def __init__(self, embedding_model: str = "text-embedding-3-small"):
+    def __init__(
+        self,
+        embedding_model: str = "text-embedding-3-small",
+        embeddings_service: Optional[EmbeddingsService] = None
+    ):
         """
         Args:
             embedding_model: OpenAI модель эмбеддингов
                 - text-embedding-3-small (1536 dims, $0.02/1M tokens) - рекомендуется
                 - text-embedding-3-large (3072 dims, $0.13/1M tokens)
                 - text-embedding-ada-002 (1536 dims, $0.10/1M tokens) - legacy
+            embeddings_service: Общий сервис эмбеддингов (если None, берётся
+                общий сервис процесса для embedding_model)
         """
-        self.embeddings = OpenAIEmbeddings(model=embedding_model)
-        # Размерность для text-embedding-3-small и ada-002
-        self.dimension = 1536 if "small" in embedding_model or "ada" in embedding_model else 3072
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.documents: List[Document] = []
-    
-    async def add_documents(self, documents: List[Document]):
-        """Добавить документы в хранилище"""
-        if not documents:
+        self.embeddings_service = embeddings_service or get_embeddings_service(model=embedding_model)
+        self.dimension = self.embeddings_service.dimension
+        # IndexIDMap2 хранит стабильные id чанков и поддерживает удаление по id
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+        # Текст чанков хранится сжатым, распаковываются только результаты поиска
+        self.codec = ChunkCodec()
+        self.dict_min_chunks = int(os.getenv("CHUNK_DICT_MIN_CHUNKS", "256"))
+        self.documents: Dict[int, StoredChunk] = {}
+        self._next_id = 0
+        # Инвертированный индекс для лексического поиска: ведётся при добавлении
+        # и загрузке, чтобы fallback не распаковывал все чанки в момент сбоя API.
+        # Списки id - отсортированные array('I') (4 байта на вхождение вместо
+        # объектов int в set), иначе индекс съел бы экономию от сжатия текста
+        self._lexical_postings: Dict[str, array] = {}
+
+    def add_embeddings(self, documents: List[Document], embeddings_array: np.ndarray) -> List[int]:
+        """
+        Добавить документы с уже посчитанными эмбеддингами.
+        Синхронный метод: индекс и документы обновляются вместе,
+        без переключения event loop.
+
+        Returns:
+            Присвоенные id чанков (в порядке documents)
+        """
+        ids = list(range(self._next_id, self._next_id + len(documents)))
+        self._next_id += len(documents)
+
+        self.index.add_with_ids(embeddings_array, np.array(ids, dtype='int64'))
+        for doc_id, doc in zip(ids, documents):
+            # Вектор уже лежит в индексе, в документе его не дублируем
+            chunk = StoredChunk(doc.metadata, self.codec.encode(doc.content), self.codec)
+            self.documents[doc_id] = chunk
+            self._lexical_add(doc_id, doc.content)
+
+        self.generation += 1
+        self._maybe_train_dictionary()
+        return ids
+
+    def _maybe_train_dictionary(self):
+        """
+        Обучить словарь сжатия, когда накопилось достаточно чанков,
+        и пережать ими уже сохранённые чанки
+        """
+        if self.codec.dictionary is not None or len(self.documents) < self.dict_min_chunks:
             return
 
-        # Генерируем эмбеддинги через OpenAI API
+        chunks = list(self.documents.values())
+        samples = random.Random(0).sample(chunks, min(len(chunks), 2000))
+        if not self.codec.train([chunk.content for chunk in samples]):
+            return
+
+        before = sum(len(chunk.data) for chunk in chunks)
+        for chunk in chunks:
+            chunk.data = self.codec.encode(chunk.content)
+        after = sum(len(chunk.data) for chunk in chunks)
+        print(
+            f"🗜️  Обучен словарь сжатия чанков ({self.codec.method}, {len(self.codec.dictionary)} байт): "
+            f"{before} -> {after} байт"
+        )
+
+    async def add_documents(self, documents: List[Document]) -> List[int]:
+        """
+        Добавить документы в хранилище
+
+        Returns:
+            Присвоенные id чанков (в порядке documents)
+        """
+        if not documents:
+            return []
+
+        ids: List[Optional[int]] = [None] * len(documents)
+
+        def append_batch(indices: List[int], embeddings_array: np.ndarray):
+            batch_ids = self.add_embeddings([documents[idx] for idx in indices], embeddings_array)
+            for idx, doc_id in zip(indices, batch_ids):
+                ids[idx] = doc_id
+
+        # Генерируем эмбеддинги через OpenAI API (с учётом кэша),
+        # готовые батчи сразу попадают в индекс
+        # Количество токенов посчитано при нарезке и лежит в метаданных
         texts = [doc.content for doc in documents]
-        embeddings_list = await self.embeddings.aembed_documents(texts)
-        embeddings_array = np.array(embeddings_list, dtype='float32')
+        token_counts = [doc.metadata.get('token_count') for doc in documents]
+        await self.embeddings_service.ingest_scheduler.run(texts, append_batch, token_counts)
+        return ids
 
-        # Добавляем в FAISS индекс
-        self.index.add(embeddings_array)
+    def delete(self, ids: List[int]) -> int:
+        """
+        Удалить чанки по id
+
+        Returns:
+            Количество удалённых чанков
+        """
+        ids = [doc_id for doc_id in ids if doc_id in self.documents]
+        if not ids:
+            return 0
 
-        # Сохраняем документы
-        for i, doc in enumerate(documents):
-            doc.embedding = embeddings_list[i]
-            self.documents.append(doc)
+        self.index.remove_ids(np.array(ids, dtype='int64'))
+        for doc_id in ids:
+            self._lexical_remove(doc_id, self.documents.pop(doc_id).content)
+        self.generation += 1
+
+        return len(ids)
     
     async def similarity_search(
         self,
         query: str,
-        k: int = 3
+        k: int = 3,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Tuple[Document, float]]:
         """Поиск похожих документов"""
         if self.index.ntotal == 0:
             return []
 
-        # Генерируем эмбеддинг запроса через OpenAI API
-        query_embedding_list = await self.embeddings.aembed_query(query)
-        query_embedding = np.array([query_embedding_list], dtype='float32')
+        # Генерируем эмбеддинг запроса через OpenAI API (общий батч запросов),
+        # если вызывающий его ещё не посчитал
+        if query_embedding is None:
+            query_embedding = await self.embeddings_service.embed_query(query)
+        query_embedding = np.array([query_embedding], dtype='float32')
 
         # Ищем похожие векторы
         k = min(k, self.index.ntotal)
@@ -62,14 +155,78 @@ class FAISSVectorStore(BaseVectorStore):
 
         # Формируем результаты
         results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.documents):
-                doc = self.documents[idx]
+        for i, doc_id in enumerate(indices[0]):
+            chunk = self.documents.get(int(doc_id))
+            if chunk is not None:
                 similarity = 1 / (1 + distances[0][i])  # Конвертируем расстояние в similarity
-                results.append((doc, similarity))
+                results.append((chunk.to_document(int(doc_id)), similarity))
 
         return results
-    
+
+    def _lexical_add(self, doc_id: int, content: str):
+        """Добавить чанк в инвертированный индекс"""
+        for term in lexical_terms(content):
+            postings = self._lexical_postings.get(term)
+            if postings is None:
+                postings = self._lexical_postings[term] = array('I')
+            if not postings or postings[-1] < doc_id:
+                # id новых чанков растут - обычно просто дописываем в конец
+                postings.append(doc_id)
+            else:
+                position = bisect_left(postings, doc_id)
+                if position == len(postings) or postings[position] != doc_id:
+                    postings.insert(position, doc_id)
+
+    def _lexical_remove(self, doc_id: int, content: str):
+        """Удалить чанк из инвертированного индекса"""
+        for term in lexical_terms(content):
+            postings = self._lexical_postings.get(term)
+            if postings is None:
+                continue
+            position = bisect_left(postings, doc_id)
+            if position < len(postings) and postings[position] == doc_id:
+                del postings[position]
+                if not postings:
+                    del self._lexical_postings[term]
+
+    def lexical_vocabulary(self) -> KeysView[str]:
+        """Термы инвертированного индекса (живое представление, не копия)"""
+        return self._lexical_postings.keys()
+
+    async def lexical_search(
+        self,
+        query: str,
+        k: int = 3
+    ) -> List[Tuple[Document, float]]:
+        """
+        Лексический поиск по чанкам без обращения к embeddings API.
+        Score - доля термов запроса, найденных в чанке (0-1).
+        """
+        terms = lexical_terms(query)
+        if not terms or not self.documents:
+            return []
+
+        matches: Dict[int, int] = {}
+        for term in terms:
+            for doc_id in self._lexical_postings.get(term, ()):
+                matches[doc_id] = matches.get(doc_id, 0) + 1
+
+        ranked = sorted(matches.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[doc_id].to_document(doc_id), count / len(terms)) for doc_id, count in ranked]
+
+    def get_documents(self, ids: List[int]) -> List[Document]:
+        """Чанки по id в том же порядке (удалённые из индекса пропускаются)"""
+        return [self.documents[doc_id].to_document(doc_id) for doc_id in ids if doc_id in self.documents]
+
+    def ids_by_file(self) -> Dict[str, List[int]]:
+        """id чанков, сгруппированные по metadata['file_path']"""
+        result: Dict[str, List[int]] = {}
+        for doc_id, doc in self.documents.items():
+            file_path = doc.metadata.get('file_path')
+            if file_path:
+                result.setdefault(file_path, []).append(doc_id)
+        return result
+
     async def save(self, path: str):
         """Сохранить хранилище на диск"""
         os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -77,15 +234,48 @@ class FAISSVectorStore(BaseVectorStore):
         # Сохраняем FAISS индекс
         faiss.write_index(self.index, f"{path}.index")
         
-        # Сохраняем документы
+        # Сохраняем документы: сжатый текст, метаданные и словарь сжатия
         with open(f"{path}.docs", 'wb') as f:
-            pickle.dump(self.documents, f)
+            pickle.dump({
+                'format': 'compressed',
+                'dictionary': self.codec.dictionary,
+                'chunks': {doc_id: (chunk.metadata, chunk.data) for doc_id, chunk in self.documents.items()}
+            }, f)
     
     async def load(self, path: str):
         """Загрузить хранилище с диска"""
         if os.path.exists(f"{path}.index"):
-            self.index = faiss.read_index(f"{path}.index")
+            index = faiss.read_index(f"{path}.index")
+            if not isinstance(index, faiss.IndexIDMap2):
+                # Старый формат: плоский индекс, id = позиция вектора
+                vectors = index.reconstruct_n(0, index.ntotal)
+                index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+                index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+            self.index = index
         
         if os.path.exists(f"{path}.docs"):
             with open(f"{path}.docs", 'rb') as f:
-                self.documents = pickle.load(f)
+                documents = pickle.load(f)
+            if isinstance(documents, dict) and documents.get('format') == 'compressed':
+                self.codec.set_dictionary(documents['dictionary'])
+                self.documents = {
+                    doc_id: StoredChunk(metadata, data, self.codec)
+                    for doc_id, (metadata, data) in documents['chunks'].items()
+                }
+            else:
+                if isinstance(documents, list):
+                    # Старый формат: список документов по позициям
+                    documents = dict(enumerate(documents))
+                # Старый формат: несжатые документы
+                self.codec.set_dictionary(None)
+                self.documents = {
+                    doc_id: StoredChunk(doc.metadata, self.codec.encode(doc.content), self.codec)
+                    for doc_id, doc in documents.items()
+                }
+            self._maybe_train_dictionary()
+            self._next_id = max(self.documents) + 1 if self.documents else 0
+            self._lexical_postings = {}
+            # По возрастанию id: списки вхождений только дописываются
+            for doc_id in sorted(self.documents):
+                self._lexical_add(doc_id, self.documents[doc_id].content)
+            self.generation += 1
@@ -0,0 +1,16 @@
+"""
+Нормализованные термы текста для лексического сопоставления.
+
+Общие для лексического поиска хранилища, FAQ и фильтра retrieval,
+чтобы вопрос и тексты сравнивались по одним правилам.
+"""
+import re
+from typing import Set
+
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def lexical_terms(text: str) -> Set[str]:
+    """Нормализованные термы (слова длиннее 2 символов, грубый стемминг по префиксу)"""
+    return {word[:6] for word in _WORD_RE.findall(text.lower()) if len(word) > 2}
@@ -0,0 +1,141 @@
+"""
+Circuit breaker embeddings: пробный вызов half_open всегда закрывает
+или снова размыкает цепь.
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from app.embeddings.embeddings_resilience import CircuitBreaker, EmbeddingsUnavailableError
+from app.embeddings.embeddings_service import EmbeddingsService
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FakeClient:
+    """Клиент embeddings API с заданным поведением"""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.calls = 0
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        return await self.behaviour(texts)
+
+
+def _half_open_service(behaviour) -> EmbeddingsService:
+    """Сервис, у которого breaker разомкнут и готов пропустить пробу"""
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30.0)
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - breaker.recovery_timeout
+    service = EmbeddingsService(cache=None, breaker=breaker)
+    service.client = FakeClient(behaviour)
+    return service
+
+
+def test_rate_limited_probe_reopens_breaker():
+    async def rate_limited(texts):
+        raise RateLimitError("429")
+
+    async def run():
+        service = _half_open_service(rate_limited)
+        with pytest.raises(RateLimitError):
+            await service._call_api(["a"], timeout=1.0, max_retries=3, raise_rate_limit=True)
+        assert service.breaker.state == "open"
+
+        service = _half_open_service(rate_limited)
+        with pytest.raises(EmbeddingsUnavailableError):
+            await service._call_api(["a"], timeout=1.0, max_retries=3)
+        assert service.breaker.state == "open"
+        assert service.client.calls == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_probe_reopens_breaker():
+    async def hanging(texts):
+        await asyncio.sleep(60)
+
+    async def run():
+        service = _half_open_service(hanging)
+        task = asyncio.ensure_future(service._call_api(["a"], timeout=30.0, max_retries=0))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert service.breaker.state == "open"
+
+    asyncio.run(run())
+
+
+def test_stale_half_open_lets_next_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30.0)
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - breaker.recovery_timeout
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.probe_started_at = time.monotonic() - breaker.recovery_timeout
+    assert breaker.allow()
+
+
+class BadRequestError(Exception):
+    status_code = 400
+
+
+def test_client_error_is_not_retried_or_counted():
+    async def bad_request(texts):
+        raise BadRequestError("400")
+
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30.0)
+        service = EmbeddingsService(cache=None, breaker=breaker)
+        service.client = FakeClient(bad_request)
+        with pytest.raises(EmbeddingsUnavailableError):
+            await service._call_api(["a"], timeout=1.0, max_retries=3)
+        assert service.client.calls == 1
+        assert breaker.state == "closed"
+
+        service = _half_open_service(bad_request)
+        with pytest.raises(EmbeddingsUnavailableError):
+            await service._call_api(["a"], timeout=1.0, max_retries=3)
+        assert service.breaker.state == "closed"
+
+    asyncio.run(run())
+
+
+def test_late_slot_fails_fast_without_touching_breaker():
+    async def ok(texts):
+        return [[0.0] for _ in texts]
+
+    async def run():
+        from app.embeddings import embeddings_service
+
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30.0)
+        service = EmbeddingsService(cache=None, breaker=breaker)
+        service.client = FakeClient(ok)
+        semaphore = embeddings_service._get_global_semaphore()
+        held = semaphore._value
+        for _ in range(held):
+            await semaphore.acquire()
+
+        async def release_late():
+            await asyncio.sleep(0.9)
+            for _ in range(held):
+                semaphore.release()
+
+        releaser = asyncio.ensure_future(release_late())
+        with pytest.raises(EmbeddingsUnavailableError):
+            await service._call_api(["a"], timeout=1.0, max_retries=0)
+        await releaser
+        assert service.client.calls == 0
+        assert breaker.state == "closed" and breaker.failures == 0
+
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+"""
+Склейка чанков в контекст: соседними считаются только чанки одного документа.
+"""
+from app.rag.rag_context import merge_chunks
+from app.schemas import Document
+
+
+def _chunk(content: str, chunk_id: int, **metadata) -> Document:
+    return Document(content=content, metadata={'source': "api_upload", 'chunk_id': chunk_id, **metadata})
+
+
+def test_uploads_with_same_chunk_id_are_not_merged():
+    first = _chunk("Доставка по Москве занимает один день.", 0, document_id="job-a")
+    second = _chunk("Возврат товара возможен в течение 14 дней.", 0, document_id="job-b")
+
+    blocks = merge_chunks([(first, 0.9), (second, 0.8)])
+
+    assert [block.text for block in blocks] == [first.content, second.content]
+
+
+def test_adjacent_chunks_of_one_upload_are_merged():
+    first = _chunk("Первый чанк документа.", 0, document_id="job-a")
+    second = _chunk("Второй чанк документа.", 1, document_id="job-a")
+    other = _chunk("Чанк другой загрузки.", 1, document_id="job-b")
+
+    blocks = merge_chunks([(first, 0.9), (other, 0.85), (second, 0.8)])
+
+    assert len(blocks) == 2
+    assert blocks[0].documents == [first, second]
+    assert blocks[1].documents == [other]
+
+
+def test_chunks_without_document_key_stay_standalone():
+    first = _chunk("Старая загрузка без document_id.", 0)
+    second = _chunk("Другая старая загрузка.", 1)
+
+    blocks = merge_chunks([(first, 0.9), (second, 0.8)])
+
+    assert [block.documents for block in blocks] == [[first], [second]]